@@ -0,0 +1 @@
+"""End-to-end benchmark of the robot against local stand-ins for SharePoint, the queue table and Excel."""
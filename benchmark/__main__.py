@@ -0,0 +1,43 @@
+"""Run the end-to-end benchmark: python -m benchmark --cases 100KB:20,10MB:10,1GB:2"""
+
+import argparse
+import os
+import sys
+import tempfile
+from multiprocessing import freeze_support
+
+from benchmark.runner import BenchmarkSettings, parse_cases, run_benchmark
+
+DEFAULT_CASES = "100KB:20,1MB:20,10MB:10,100MB:5,1GB:2"
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def main() -> int:
+    """Parse the arguments, run the benchmark and report regressions."""
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="End-to-end throughput benchmark of the robot.")
+    parser.add_argument("--cases", default=DEFAULT_CASES, help="Comma separated size:count pairs. Default: %(default)s")
+    parser.add_argument("--workers", type=int, default=BenchmarkSettings.workers, help="config.MAX_WORKERS. Default: %(default)s")
+    parser.add_argument("--no-pipeline", action="store_true", help="Use the worker pool instead of the staged pipeline.")
+    parser.add_argument("--backend", default=BenchmarkSettings.backend, help="The refresh backend. Default: %(default)s")
+    parser.add_argument("--latency", type=float, default=BenchmarkSettings.latency, help="Seconds of latency per SharePoint request. Default: %(default)s")
+    parser.add_argument("--throttle", type=float, default=BenchmarkSettings.throttle, help="Share of SharePoint requests throttled with 429. Default: %(default)s")
+    parser.add_argument("--workspace", default=os.path.join(tempfile.gettempdir(), "excel_refresher_benchmark"), help="Scratch folder, emptied before the run. Default: %(default)s")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Folder for the result files. Default: %(default)s")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if a regression is found.")
+    args = parser.parse_args()
+
+    settings = BenchmarkSettings(workers=args.workers, pipeline=not args.no_pipeline, backend=args.backend, latency=args.latency, throttle=args.throttle)
+    try:
+        _, regressions = run_benchmark(parse_cases(args.cases), settings, args.workspace, args.output)
+    except ChildProcessError as e:
+        print(f"Benchmark failed: {e}", file=sys.stderr)
+        return 1
+
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""This module has the stand-ins for the QueueExcelRefresher table and OpenOrchestrator used by the benchmark.
+
+QueueTable keeps QueueExcelRefresher in SQLite and hands out sqlite3 connections in place of pyodbc,
+which queue_source claims rows from with its SQLite statement. BenchmarkOrchestrator implements the parts of
+OrchestratorConnection the robot uses, with an in-memory queue that records how long each element took.
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
+
+
+class QueueTable:
+    """The QueueExcelRefresher table in a SQLite database."""
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        with sqlite3.connect(database_path) as connection:
+            connection.execute("""
+            CREATE TABLE IF NOT EXISTS QueueExcelRefresher (
+                SharePointSite TEXT NOT NULL,
+                FolderPath TEXT NOT NULL,
+                CustomFunction TEXT,
+                TimeStamp TEXT
+            )
+            """)
+
+    def add_rows(self, rows: list[tuple[str, str, str | None]]) -> None:
+        """Add rows of SharePointSite, FolderPath and CustomFunction that are due for a refresh."""
+        with sqlite3.connect(self.database_path) as connection:
+            connection.executemany(
+                "INSERT INTO QueueExcelRefresher (SharePointSite, FolderPath, CustomFunction, TimeStamp) VALUES (?, ?, ?, NULL)",
+                rows,
+            )
+
+    def connect(self, *_args, **_kwargs) -> sqlite3.Connection:
+        """Open a connection. Accepts and ignores the arguments of pyodbc.connect."""
+        return sqlite3.connect(self.database_path, timeout=30, check_same_thread=False)
+
+
+class BenchmarkOrchestrator:
+    """Stands in for OrchestratorConnection during a benchmark.
+    Log messages go to a file, and the queue records when each element was handed out and finished.
+    """
+
+    def __init__(self, process_name: str, log_path: str, constants: dict[str, str], credentials: dict[str, tuple[str, str]]):
+        self.process_name = process_name
+        self._constants = constants
+        self._credentials = credentials
+        self._log_file = open(log_path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+        self._queue: list[QueueElement] = []
+        self._started: dict = {}
+        # Queue element id -> (status, seconds from being handed out to getting its final status)
+        self.results: dict = {}
+        self.error_count = 0
+
+    def log_trace(self, message: str) -> None:
+        """Log a trace message to the log file."""
+        self._log("TRACE", message)
+
+    def log_info(self, message: str) -> None:
+        """Log an info message to the log file."""
+        self._log("INFO", message)
+
+    def log_error(self, message: str) -> None:
+        """Log an error message to the log file and count it."""
+        self._log("ERROR", message)
+        with self._lock:
+            self.error_count += 1
+
+    def _log(self, level: str, message: str) -> None:
+        with self._lock:
+            self._log_file.write(f"{datetime.now().isoformat()} {level} [{threading.current_thread().name}] {message}\n")
+
+    def get_constant(self, constant_name: str) -> SimpleNamespace:
+        """Get a constant given to the orchestrator, or an empty value."""
+        return SimpleNamespace(name=constant_name, value=self._constants.get(constant_name, ""))
+
+    def get_credential(self, credential_name: str) -> SimpleNamespace:
+        """Get a credential given to the orchestrator, or an empty one."""
+        username, password = self._credentials.get(credential_name, ("", ""))
+        return SimpleNamespace(name=credential_name, username=username, password=password)
+
+    def bulk_create_queue_elements(self, queue_name: str, references: tuple, data: tuple, created_by: str | None = None) -> None:
+        """Add new queue elements."""
+        with self._lock:
+            for reference, element_data in zip(references, data):
+                self._queue.append(QueueElement(
+                    id=uuid.uuid4(),
+                    queue_name=queue_name,
+                    status=QueueStatus.NEW,
+                    data=element_data,
+                    reference=reference,
+                    created_by=created_by,
+                ))
+
+    def get_queue_elements(self, queue_name: str, reference: str | None = None, status: QueueStatus | None = None, offset: int = 0, limit: int = 100) -> tuple[QueueElement]:
+        """Get the queue elements of a queue, optionally by reference and status."""
+        with self._lock:
+            queue_elements = [
+                queue_element for queue_element in self._queue
+                if queue_element.queue_name == queue_name and reference in (None, queue_element.reference) and status in (None, queue_element.status)
+            ]
+        return tuple(queue_elements[offset:offset + limit])
+
+    def get_next_queue_element(self, queue_name: str, reference: str | None = None, set_status: bool = True) -> QueueElement | None:
+        """Take the first new queue element, optionally with a reference, and mark it as in progress."""
+        with self._lock:
+            for queue_element in self._queue:
+                if queue_element.queue_name == queue_name and queue_element.status == QueueStatus.NEW and reference in (None, queue_element.reference):
+                    if set_status:
+                        queue_element.status = QueueStatus.IN_PROGRESS
+                    self._started[queue_element.id] = time.perf_counter()
+                    return queue_element
+        return None
+
+    def set_queue_element_status(self, element_id, status: QueueStatus, message: str | None = None) -> None:
+        """Set the status of a queue element and record its duration when it's done or failed."""
+        with self._lock:
+            for queue_element in self._queue:
+                if queue_element.id == element_id:
+                    queue_element.status = status
+                    queue_element.message = message
+            if status in (QueueStatus.DONE, QueueStatus.FAILED):
+                started = self._started.get(element_id, time.perf_counter())
+                self.results[element_id] = (status, time.perf_counter() - started)
+
+    def close(self) -> None:
+        """Close the log file."""
+        self._log_file.close()
@@ -0,0 +1,348 @@
+"""This module runs the end-to-end benchmark of the robot.
+
+Every case is a number of workbooks of one size. A case runs queue_framework.main in its own process
+against the local SharePoint stand-in, a SQLite QueueExcelRefresher table, BenchmarkOrchestrator and
+the simulated refresh backend, so the measured path is the same as in production apart from Excel
+and the network. The results are saved as JSON and compared with the previous run in the same folder.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from benchmark import workbooks
+from benchmark.sharepoint_server import run_server
+
+SITE_PATH = "sites/benchmark"
+LIBRARY = "Delte dokumenter"
+
+# Stages timed in every case
+STAGES = ("download", "refresh", "upload")
+
+# A throughput drop or p95 increase above this fraction is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Seconds between checks that a child process is still running while waiting for it
+_POLL_SECONDS = 1.0
+
+
+@dataclass
+class BenchmarkCase:
+    """A number of workbooks of the same size."""
+    label: str
+    size: int
+    elements: int
+
+
+@dataclass
+class BenchmarkSettings:
+    """Settings of the robot and the stand-ins that apply to all cases."""
+    workers: int = 3
+    pipeline: bool = True
+    backend: str = "simulated"
+    latency: float = 0.02
+    throttle: float = 0.0
+
+
+def parse_cases(text: str) -> list[BenchmarkCase]:
+    """Parse cases like '100KB:20,10MB:10,1GB:2' into BenchmarkCases."""
+    cases = []
+    for item in text.split(","):
+        label, _, elements = item.strip().partition(":")
+        cases.append(BenchmarkCase(label.upper(), workbooks.parse_size(label), int(elements or 1)))
+    return cases
+
+
+def run_benchmark(cases: list[BenchmarkCase], settings: BenchmarkSettings, workspace: str, output_folder: str) -> tuple[dict, list[str]]:
+    """Run all cases and save the results.
+
+    Args:
+        cases: The cases to run.
+        settings: The settings shared by all cases.
+        workspace: A folder for the SharePoint stand-in, working folders and state. It is emptied first.
+        output_folder: The folder the result file is saved in.
+
+    Returns:
+        tuple: The results and a list of regressions compared with the previous result in output_folder.
+    """
+    shutil.rmtree(workspace, ignore_errors=True)
+    sharepoint_root = os.path.join(workspace, "sharepoint")
+    os.makedirs(sharepoint_root)
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server, args=(sharepoint_root, SITE_PATH, settings.latency, settings.throttle, child_connection), daemon=True)
+    server.start()
+    site_url = f"http://127.0.0.1:{_receive(parent_connection, server, 'SharePoint stand-in')}/{SITE_PATH}"
+
+    results = {
+        "version": _version(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "platform": sys.platform,
+        "settings": asdict(settings),
+        "cases": [],
+    }
+    try:
+        for case in cases:
+            folder_paths = _seed_workbooks(sharepoint_root, case, workspace)
+            print(f"Running {case.elements} x {case.label}...", flush=True)
+            case_result = _run_case_in_process(case, settings, site_url, folder_paths, os.path.join(workspace, case.label))
+            results["cases"].append(case_result)
+            print(format_case(case_result), flush=True)
+    finally:
+        server.kill()
+        server.join()
+
+    previous = _latest_result(output_folder)
+    regressions = compare(previous, results) if previous else []
+    save_result(results, output_folder)
+    return results, regressions
+
+
+def _seed_workbooks(sharepoint_root: str, case: BenchmarkCase, workspace: str) -> list[str]:
+    """Put the workbooks of a case on the SharePoint stand-in and return their folder paths."""
+    template = os.path.join(workspace, f"template_{case.label}.xlsx")
+    workbooks.create_workbook(template, case.size)
+
+    folder_paths = []
+    for i in range(1, case.elements + 1):
+        folder_path = f"{LIBRARY}/Benchmark/{case.label}/workbook_{i}.xlsx"
+        local_path = os.path.join(sharepoint_root, *folder_path.split("/"))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        shutil.copyfile(template, local_path)
+        folder_paths.append(folder_path)
+    os.remove(template)
+    return folder_paths
+
+
+def _run_case_in_process(case: BenchmarkCase, settings: BenchmarkSettings, site_url: str, folder_paths: list[str], case_folder: str) -> dict:
+    """Run a case in a separate process so its peak memory and module state are its own."""
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_case, args=(case, settings, site_url, folder_paths, case_folder, child_connection))
+    process.start()
+    try:
+        return _receive(parent_connection, process, f"{case.label} case")
+    finally:
+        process.join()
+
+
+def _receive(connection, process: multiprocessing.Process, name: str):
+    """Wait for a message from a child process, failing if the process exits without sending one.
+
+    Raises:
+        ChildProcessError: If the process exited first. Its traceback, if any, is printed by the process itself.
+    """
+    while not connection.poll(_POLL_SECONDS):
+        if not process.is_alive() and not connection.poll():
+            process.join()
+            raise ChildProcessError(f"The {name} process exited with code {process.exitcode} without a result.")
+    return connection.recv()
+
+
+def _run_case(case: BenchmarkCase, settings: BenchmarkSettings, site_url: str, folder_paths: list[str], case_folder: str, connection) -> None:
+    """Run queue_framework.main over a case against the stand-ins and send the measurements through connection."""
+    # pylint: disable=import-outside-toplevel
+    from office365.runtime.auth.token_response import TokenResponse
+
+    from benchmark.queue_store import BenchmarkOrchestrator, QueueTable
+    from benchmark.smtp_server import SmtpServer
+    from robot_framework import config, process, queue_framework, queue_source, sharepoint_session, sharepoint_transport
+
+    os.makedirs(case_folder, exist_ok=True)
+    os.chdir(case_folder)
+
+    config.STATE_FOLDER = os.path.join(case_folder, "state")
+    config.REFRESH_BACKEND = settings.backend
+    config.MAX_WORKERS = settings.workers
+    config.PIPELINE_ENABLED = settings.pipeline
+    config.MAX_TASK_COUNT = case.elements
+    config.FAIL_ROBOT_ON_TOO_MANY_ERRORS = False
+
+    smtp_server = SmtpServer(os.path.join(case_folder, "mail"))
+    smtp_server.start()
+    config.SMTP_SERVER = "127.0.0.1"
+    config.SMTP_PORT = smtp_server.port
+    config.SMTP_STARTTLS = False
+
+    queue_table = QueueTable(os.path.join(case_folder, "queue.db"))
+    queue_table.add_rows([(site_url, folder_path, None) for folder_path in folder_paths])
+    orchestrator = BenchmarkOrchestrator(
+        config.QUEUE_NAME,
+        os.path.join(case_folder, "robot.log"),
+        constants={"SqlServer": "benchmark", config.ERROR_EMAIL: "benchmark@localhost"},
+        credentials={"SharePointAPI": ("benchmark", "benchmark"), "SharePointCert": ("benchmark", "benchmark")},
+    )
+
+    def local_client(_tenant, _client_id, _thumbprint, _cert_path, sharepoint_site_url, _orchestrator_connection):
+        return sharepoint_transport.ThrottledClientContext(sharepoint_site_url).with_access_token(lambda: TokenResponse("benchmark", "Bearer", expiresIn=3600))
+
+    timings = {stage: [] for stage in STAGES}
+    timings_lock = threading.Lock()
+
+    def timed(stage: str, function):
+        def inner(*args, **kwargs):
+            started = time.perf_counter()
+            result = function(*args, **kwargs)
+            with timings_lock:
+                timings[stage].append(time.perf_counter() - started)
+            return result
+        return inner
+
+    queue_framework.OrchestratorConnection = SimpleNamespace(create_connection_from_args=lambda: orchestrator)
+    queue_source.pyodbc = SimpleNamespace(connect=queue_table.connect)
+    sharepoint_session.sharepoint_client = local_client
+    for stage in STAGES:
+        setattr(process, f"{stage}_stage", timed(stage, getattr(process, f"{stage}_stage")))
+
+    excepthook = sys.excepthook
+    started = time.perf_counter()
+    try:
+        queue_framework.main()
+    finally:
+        elapsed = time.perf_counter() - started
+        sys.excepthook = excepthook
+        orchestrator.close()
+        smtp_server.stop()
+
+    succeeded = sum(1 for status, _ in orchestrator.results.values() if status.name == "DONE")
+    stages = {stage: _summarize(durations) for stage, durations in timings.items()}
+    stages["element"] = _summarize([duration for _, duration in orchestrator.results.values()])
+    peak_rss, peak_worker_rss = _peak_rss()
+
+    connection.send({
+        "case": case.label,
+        "size_bytes": case.size,
+        "elements": case.elements,
+        "succeeded": succeeded,
+        "failed": len(orchestrator.results) - succeeded,
+        "seconds": round(elapsed, 3),
+        "elements_per_hour": round(succeeded / elapsed * 3600, 1) if elapsed else 0.0,
+        "megabytes_per_second": round(succeeded * case.size / 1024 / 1024 / elapsed, 2) if elapsed else 0.0,
+        "stages": stages,
+        "peak_rss_bytes": peak_rss,
+        "peak_worker_rss_bytes": peak_worker_rss,
+        "logged_errors": orchestrator.error_count,
+        "mails": smtp_server.mail_count,
+        "throttled": sharepoint_transport.counters()["throttled"],
+    })
+
+
+def _summarize(durations: list[float]) -> dict:
+    """Get the count, p50 and p95 of a list of durations in seconds."""
+    return {
+        "count": len(durations),
+        "p50": round(percentile(durations, 50), 4),
+        "p95": round(percentile(durations, 95), 4),
+    }
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get a percentile of values with the nearest-rank method. 0 if there are no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _peak_rss() -> tuple[int | None, int | None]:
+    """Get the peak resident memory of this process and of its finished child processes in bytes.
+    The memory of child processes isn't available on Windows.
+    """
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        import win32api  # pylint: disable=import-outside-toplevel
+        import win32process  # pylint: disable=import-outside-toplevel
+        return win32process.GetProcessMemoryInfo(win32api.GetCurrentProcess())["PeakWorkingSetSize"], None
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    )
+
+
+def _version() -> str:
+    """Get the git commit being benchmarked, or 'unknown' outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_result(results: dict, output_folder: str) -> str:
+    """Save results as a JSON file named by time and version, and return its path."""
+    os.makedirs(output_folder, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(output_folder, f"{timestamp}_{results['version']}.json")
+    with open(path, "w", encoding="utf-8") as result_file:
+        json.dump(results, result_file, indent=2)
+    return path
+
+
+def _latest_result(output_folder: str) -> dict | None:
+    """Load the newest result file in output_folder, if any."""
+    if not os.path.isdir(output_folder):
+        return None
+    names = sorted(name for name in os.listdir(output_folder) if name.endswith(".json"))
+    if not names:
+        return None
+    with open(os.path.join(output_folder, names[-1]), encoding="utf-8") as result_file:
+        return json.load(result_file)
+
+
+def compare(previous: dict, current: dict) -> list[str]:
+    """Compare two results case by case.
+    Cases are only compared when they ran with the same settings and element count.
+
+    Returns:
+        list[str]: A description of every regression above REGRESSION_THRESHOLD.
+    """
+    if previous.get("settings") != current.get("settings"):
+        return []
+
+    regressions = []
+    previous_cases = {case["case"]: case for case in previous["cases"]}
+    for case in current["cases"]:
+        old = previous_cases.get(case["case"])
+        if not old or old["elements"] != case["elements"]:
+            continue
+
+        if old["elements_per_hour"] and case["elements_per_hour"] < old["elements_per_hour"] * (1 - REGRESSION_THRESHOLD):
+            regressions.append(f"{case['case']}: throughput {old['elements_per_hour']} -> {case['elements_per_hour']} elements/hour")
+
+        for stage, summary in case["stages"].items():
+            old_p95 = old["stages"].get(stage, {}).get("p95")
+            if old_p95 and summary["p95"] > old_p95 * (1 + REGRESSION_THRESHOLD):
+                regressions.append(f"{case['case']}: {stage} p95 {old_p95}s -> {summary['p95']}s (since {previous['version']})")
+
+    return regressions
+
+
+def format_case(case: dict) -> str:
+    """Describe the result of a case in a few lines."""
+    lines = [
+        f"{case['case']}: {case['succeeded']}/{case['elements']} succeeded in {case['seconds']}s, "
+        f"{case['elements_per_hour']} elements/hour, {case['megabytes_per_second']} MB/s, "
+        f"peak RSS {_megabytes(case['peak_rss_bytes'])} (workers {_megabytes(case['peak_worker_rss_bytes'])})"
+    ]
+    for stage, summary in case["stages"].items():
+        lines.append(f"  {stage:<9} p50 {summary['p50']:>9.3f}s  p95 {summary['p95']:>9.3f}s  n={summary['count']}")
+    return "\n".join(lines)
+
+
+def _megabytes(value: int | None) -> str:
+    return "n/a" if value is None else f"{value / 1024 / 1024:.0f} MB"
@@ -0,0 +1,501 @@
+"""This module is a local stand-in for the SharePoint REST endpoints used by the robot.
+
+Files and folders are kept in a folder on disk. The server understands the endpoints reached through
+office365's ClientContext in sharepoint_transfer and process: contextInfo, getFileByServerRelativePath,
+getFolderByServerRelativeUrl, getFileById/getFolderById, lists/GetByTitle, Folders/Files GetByUrl,
+Files/add, Folders/Add, folder listings, CopyTo, the upload session (startUpload, continueUpload, finishUpload), $value with ranges
+and $batch requests of the above, including a change set.
+Each request can be delayed by a fixed latency to mimic the network. A $batch request is delayed once.
+A share of the requests can be throttled with 429 and Retry-After like SharePoint Online under load.
+"""
+
+import email
+import io
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Size of the blocks read and written when streaming file content
+_BLOCK_SIZE = 1024 * 1024
+
+_ARGUMENT = re.compile(r"\s*(?:(\w+)=)?(guid'[^']*'|'(?:[^']|'')*'|[^,]*)\s*,?")
+
+
+class SharePointServer:
+    """A SharePoint REST stand-in serving one site from a folder on disk.
+
+    Args:
+        root: The folder holding the site's files.
+        site_path: The server relative path of the site, e.g. 'sites/benchmark'.
+        latency: Seconds to wait before answering each request.
+        throttle: The share of requests answered with 429 Too Many Requests, from 0 to 1.
+    """
+
+    def __init__(self, root: str, site_path: str, latency: float = 0.0, throttle: float = 0.0):
+        self.root = root
+        self.site_path = site_path.strip("/")
+        self.latency = latency
+        self.throttle = throttle
+        self.request_count = 0
+        self._ids: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._upload_folder = os.path.join(root, ".uploads")
+        os.makedirs(self._upload_folder, exist_ok=True)
+        self._server = None
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 0, ready=None) -> None:
+        """Serve requests until the process is stopped.
+        The port actually used is sent through ready, if given.
+        """
+        server = self
+
+        class Handler(_RequestHandler):
+            """A request handler of this server."""
+            sharepoint = server
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        if ready is not None:
+            ready.send(self._server.server_address[1])
+        self._server.serve_forever()
+
+    def local_path(self, path: str) -> str:
+        """Get the path on disk of a site relative path."""
+        return os.path.join(self.root, *path.split("/"))
+
+    def normalize(self, url: str) -> str:
+        """Turn a server relative or site relative url into a site relative path."""
+        path = url.replace("''", "'").strip("/")
+        if path.lower().startswith(self.site_path.lower() + "/"):
+            path = path[len(self.site_path) + 1:]
+        return path
+
+    def unique_id(self, path: str) -> str:
+        """Get a stable id of a file or folder, remembering it so getFileById/getFolderById can find it."""
+        unique_id = str(uuid.uuid5(uuid.NAMESPACE_URL, path.lower()))
+        with self._lock:
+            self._ids[unique_id] = path
+        return unique_id
+
+    def path_of_id(self, unique_id: str) -> str | None:
+        """Get the path of a file or folder from its id."""
+        with self._lock:
+            return self._ids.get(unique_id.lower())
+
+    def file_properties(self, path: str) -> dict:
+        """Get the properties of a file like SharePoint returns them."""
+        local_path = self.local_path(path)
+        stat = os.stat(local_path)
+        unique_id = self.unique_id(path)
+        return {
+            "Name": posix_name(path),
+            "ServerRelativeUrl": f"/{self.site_path}/{path}",
+            "Length": str(stat.st_size),
+            "ETag": f'"{{{unique_id.upper()}}},{stat.st_mtime_ns}"',
+            "UniqueId": unique_id,
+            "TimeLastModified": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stat.st_mtime)),
+            "Exists": True,
+        }
+
+    def folder_properties(self, path: str) -> dict:
+        """Get the properties of a folder like SharePoint returns them."""
+        return {
+            "Name": posix_name(path),
+            "ServerRelativeUrl": f"/{self.site_path}/{path}".rstrip("/"),
+            "UniqueId": self.unique_id(path),
+            "Exists": True,
+            "ItemCount": len(os.listdir(self.local_path(path))),
+        }
+
+    def upload_path(self, upload_id: str) -> str:
+        """Get the path of the temporary file of an upload session."""
+        return os.path.join(self._upload_folder, upload_id.lower())
+
+
+def posix_name(path: str) -> str:
+    """Get the last segment of a site relative path."""
+    return path.rsplit("/", 1)[-1]
+
+
+class NotFound(Exception):
+    """Raised when a request refers to a file or folder that doesn't exist."""
+
+
+class BadRequest(Exception):
+    """Raised when a request isn't understood by the stand-in."""
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Handles a single REST request against the site of the server."""
+
+    sharepoint: SharePointServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer a GET request."""
+        self._handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a POST request, including a $batch request."""
+        self._handle("POST")
+
+    def _handle(self, method: str) -> None:
+        self.sharepoint.request_count += 1
+        if self.sharepoint.latency:
+            time.sleep(self.sharepoint.latency)
+
+        if self.sharepoint.throttle and random.random() < self.sharepoint.throttle:
+            self._drain_body()
+            self._send_error(429, "The request has been throttled.", {"Retry-After": "1"})
+            return
+
+        if method == "POST" and urlsplit(self.path).path.lower().endswith("/_api/$batch"):
+            self._batch()
+        else:
+            self.dispatch(method)
+
+    def dispatch(self, method: str) -> None:
+        """Answer a request to the REST api, or with an error like SharePoint's."""
+        try:
+            prefix = f"/{self.sharepoint.site_path}/_api/".lower()
+            path = unquote(urlsplit(self.path).path)
+            if not path.lower().startswith(prefix):
+                raise NotFound(path)
+            segments = _split_segments(path[len(prefix):])
+
+            if method == "POST" and segments[0].lower() == "contextinfo":
+                self._drain_body()
+                self._send_json({"GetContextWebInformation": {
+                    "FormDigestValue": "benchmark",
+                    "FormDigestTimeoutSeconds": 1800,
+                    "WebFullUrl": f"http://{self.headers['Host']}/{self.sharepoint.site_path}",
+                }})
+                return
+
+            self._resolve(method, segments)
+        except NotFound as e:
+            self._drain_body()
+            self._send_error(404, f"File Not Found. {e}")
+        except BadRequest as e:
+            self._drain_body()
+            self._send_error(400, str(e))
+        except Exception:  # pylint: disable=broad-exception-caught
+            self._send_error(500, traceback.format_exc())
+
+    def _batch(self) -> None:
+        """Run the parts of a $batch request in order and answer with a part for each, like SharePoint."""
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        request = email.message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+
+        parts = []
+        for part in request.get_payload():
+            if part.is_multipart():
+                boundary = f"changesetresponse_{uuid.uuid4()}"
+                change_set = _multipart(boundary, [self._batch_part(change) for change in part.get_payload()])
+                parts.append(f"Content-Type: multipart/mixed; boundary={boundary}\r\n\r\n".encode() + change_set)
+            else:
+                parts.append(self._batch_part(part))
+
+        boundary = f"batchresponse_{uuid.uuid4()}"
+        response = _multipart(boundary, parts)
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _batch_part(self, part) -> bytes:
+        """Run one application/http part of a $batch request with a handler writing to memory."""
+        head, *body = re.split(rb"\r?\n\r?\n", part.get_payload(decode=True).strip(), maxsplit=1)
+        request_line, *header_lines = head.decode("utf-8").splitlines()
+        method, rest = request_line.split(" ", 1)
+        url = rest.rsplit(" ", 1)[0]
+
+        handler = object.__new__(type(self))
+        handler.headers = email.message_from_string("\r\n".join(header_lines) + "\r\n\r\n")
+        handler.rfile = io.BytesIO(body[0].strip() if body else b"")
+        handler.wfile = io.BytesIO()
+        handler.path = url
+        handler.command = method
+        handler.request_version = "HTTP/1.1"
+        handler.requestline = request_line
+        handler.client_address = self.client_address
+        handler.dispatch(method.upper())
+        return b"Content-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n" + handler.wfile.getvalue()
+
+    def _resolve(self, method: str, segments: list[str]) -> None:
+        """Walk the resource path segment by segment and answer for the last one."""
+        sharepoint = self.sharepoint
+        kind, path = "folder", ""
+
+        for index, segment in enumerate(segments):
+            name, arguments = _parse_segment(segment)
+            lower = name.lower()
+            is_last = index == len(segments) - 1
+
+            if lower in ("web", "rootfolder"):
+                continue
+            if lower in ("getfilebyserverrelativepath", "getfilebyserverrelativeurl"):
+                kind, path = "file", sharepoint.normalize(_first(arguments))
+            elif lower in ("getfolderbyserverrelativepath", "getfolderbyserverrelativeurl"):
+                kind, path = "folder", sharepoint.normalize(_first(arguments))
+            elif lower in ("getfilebyid", "getfolderbyid"):
+                found = sharepoint.path_of_id(_first(arguments))
+                if found is None:
+                    raise NotFound(segment)
+                kind, path = ("file" if lower == "getfilebyid" else "folder"), found
+            elif lower == "lists":
+                kind = "lists"
+            elif lower == "getbytitle" and kind == "lists":
+                kind, path = "folder", _first(arguments)
+            elif lower in ("folders", "files"):
+                kind = lower
+            elif lower == "getbyurl" and kind in ("folders", "files"):
+                kind, path = kind[:-1], _join(path, sharepoint.normalize(_first(arguments)))
+            elif lower in ("add", "addusingpath") and kind == "folders" and is_last:
+                self._add_folder(_join(path, _first(arguments)))
+                return
+            elif lower == "add" and kind == "files" and is_last:
+                self._add_file(_join(path, arguments.get("url") or _first(arguments)), arguments)
+                return
+            elif lower in ("startupload", "continueupload", "finishupload", "cancelupload") and kind == "file" and is_last:
+                self._upload_session(lower, path, arguments)
+                return
+            elif lower == "copyto" and kind == "file" and is_last:
+                self._copy_file(path, arguments)
+                return
+            elif lower == "$value" and kind == "file" and is_last:
+                self._send_content(path)
+                return
+            elif kind == "folders" and not arguments:
+                # A folder added in this request's client addressed by name
+                kind, path = "folder", _join(path, name)
+            else:
+                raise BadRequest(f"Unsupported segment '{segment}'")
+
+        if method != "GET":
+            raise BadRequest("Only GET is supported on entities")
+        self._send_entity(kind, path)
+
+    def _send_entity(self, kind: str, path: str) -> None:
+        local_path = self.sharepoint.local_path(path)
+        if kind == "file":
+            if not os.path.isfile(local_path):
+                raise NotFound(path)
+            self._send_json(self.sharepoint.file_properties(path))
+        elif kind == "folder":
+            if not os.path.isdir(local_path):
+                raise NotFound(path)
+            self._send_json(self.sharepoint.folder_properties(path))
+        elif kind == "folders":
+            if not os.path.isdir(local_path):
+                raise NotFound(path)
+            self._send_json({"results": [
+                self.sharepoint.folder_properties(_join(path, entry.name))
+                for entry in os.scandir(local_path) if entry.is_dir()
+            ]})
+        else:
+            raise BadRequest(f"Collections are not supported: {kind}")
+
+    def _add_folder(self, path: str) -> None:
+        self._drain_body()
+        os.makedirs(self.sharepoint.local_path(path), exist_ok=True)
+        self._send_json(self.sharepoint.folder_properties(path))
+
+    def _add_file(self, path: str, arguments: dict) -> None:
+        local_path = self.sharepoint.local_path(path)
+        if os.path.exists(local_path) and arguments.get("overwrite", "false").lower() != "true":
+            self._drain_body()
+            self._send_error(400, f"A file with the name {path} already exists.")
+            return
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        self._receive_body(local_path, "wb")
+        self._send_json(self.sharepoint.file_properties(path))
+
+    def _copy_file(self, path: str, arguments: dict) -> None:
+        self._drain_body()
+        source_path = self.sharepoint.local_path(path)
+        if not os.path.isfile(source_path):
+            raise NotFound(path)
+        target = self.sharepoint.normalize(arguments.get("strnewurl", ""))
+        target_path = self.sharepoint.local_path(target)
+        if os.path.exists(target_path) and arguments.get("boverwrite", "false").lower() != "true":
+            self._send_error(400, f"A file with the name {target} already exists.")
+            return
+        if not os.path.isdir(os.path.dirname(target_path)):
+            raise NotFound(target)
+        shutil.copyfile(source_path, target_path)
+        self._send_json({})
+
+    def _upload_session(self, operation: str, path: str, arguments: dict) -> None:
+        upload_id = arguments.get("uploadid", "").removeprefix("guid'").strip("'")
+        upload_path = self.sharepoint.upload_path(upload_id)
+
+        if operation == "cancelupload":
+            self._drain_body()
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            self._send_json({})
+            return
+
+        if operation == "startupload":
+            self._receive_body(upload_path, "wb")
+        else:
+            offset = int(arguments.get("fileoffset", "0"))
+            if not os.path.exists(upload_path):
+                self._drain_body()
+                self._send_error(404, f"Upload session {upload_id} not found.")
+                return
+            if os.path.getsize(upload_path) != offset:
+                self._drain_body()
+                self._send_error(400, f"Offset {offset} doesn't match the uploaded {os.path.getsize(upload_path)} bytes.")
+                return
+            self._receive_body(upload_path, "ab")
+
+        if operation == "finishupload":
+            local_path = self.sharepoint.local_path(path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            shutil.move(upload_path, local_path)
+            self._send_json(self.sharepoint.file_properties(path))
+        else:
+            function = "StartUpload" if operation == "startupload" else "ContinueUpload"
+            self._send_json({function: str(os.path.getsize(upload_path))})
+
+    def _send_content(self, path: str) -> None:
+        """Stream a file, honouring Range and If-Range like SharePoint."""
+        local_path = self.sharepoint.local_path(path)
+        if not os.path.isfile(local_path):
+            raise NotFound(path)
+        size = os.path.getsize(local_path)
+        etag = self.sharepoint.file_properties(path)["ETag"]
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == etag):
+            start = int(range_header.removeprefix("bytes=").split("-")[0])
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+        with open(local_path, "rb") as file:
+            file.seek(start)
+            while block := file.read(_BLOCK_SIZE):
+                self.wfile.write(block)
+
+    def _receive_body(self, local_path: str, mode: str) -> None:
+        remaining = int(self.headers.get("Content-Length") or 0)
+        with open(local_path, mode) as file:
+            while remaining > 0:
+                block = self.rfile.read(min(_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                file.write(block)
+                remaining -= len(block)
+
+    def _drain_body(self) -> None:
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining > 0:
+            block = self.rfile.read(min(_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+
+    def _send_json(self, value: dict) -> None:
+        body = json.dumps({"d": value}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;odata=verbose;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: dict | None = None) -> None:
+        body = json.dumps({"error": {"code": str(status), "message": {"lang": "en-US", "value": message}}}).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json;odata=verbose;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _multipart(boundary: str, parts: list[bytes]) -> bytes:
+    """Join the parts of a multipart/mixed body."""
+    body = b"".join(f"--{boundary}\r\n".encode() + part + b"\r\n" for part in parts)
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def _split_segments(path: str) -> list[str]:
+    """Split a REST path on slashes outside quotes and parentheses."""
+    segments, current, depth, quoted = [], [], 0, False
+    for char in path:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == "/":
+            segments.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    segments.append("".join(current))
+    return [segment for segment in segments if segment]
+
+
+def _parse_segment(segment: str) -> tuple[str, dict]:
+    """Split a segment like add(url='a.xlsx',overwrite=true) into its name and arguments.
+    Named arguments are keyed by their lower case name, positional arguments by their index.
+    """
+    if "(" not in segment or not segment.endswith(")"):
+        return segment, {}
+    name, raw_arguments = segment[:-1].split("(", 1)
+    arguments = {}
+    for index, match in enumerate(_ARGUMENT.finditer(raw_arguments)):
+        key, value = match.groups()
+        if not value and not key:
+            continue
+        if value.startswith("'") and value.endswith("'"):
+            value = value[1:-1].replace("''", "'")
+        arguments[key.lower() if key else index] = value
+    return name, arguments
+
+
+def _first(arguments: dict) -> str:
+    """Get the only argument of a segment, positional or named."""
+    if not arguments:
+        raise BadRequest("Missing argument")
+    return next(iter(arguments.values()))
+
+
+def _join(folder: str, name: str) -> str:
+    return f"{folder}/{name}".strip("/") if folder else name.strip("/")
+
+
+def run_server(root: str, site_path: str, latency: float, throttle: float, ready) -> None:
+    """Run a SharePointServer in this process. Used as the target of a multiprocessing.Process."""
+    SharePointServer(root, site_path, latency, throttle).serve_forever(ready=ready)
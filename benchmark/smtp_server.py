@@ -0,0 +1,95 @@
+"""This module is a local stand-in for the SMTP server the robot sends mails through.
+
+The server understands the commands smtplib uses without authentication or STARTTLS: EHLO/HELO,
+MAIL, RCPT, DATA, RSET, NOOP and QUIT. Each mail is saved as an .eml file in a folder on disk.
+"""
+
+import os
+import socketserver
+import threading
+import uuid
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server: SmtpServer = self.server.smtp  # type: ignore[attr-defined]
+        self._reply(220, "benchmark SMTP")
+        while line := self.rfile.readline():
+            command = line.decode("ascii", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self._reply(250, "benchmark")
+            elif verb in ("MAIL", "RCPT"):
+                self._reply(250, "OK")
+            elif verb == "DATA":
+                self._reply(354, "End data with <CR><LF>.<CR><LF>")
+                server.save(self._read_data())
+                self._reply(250, "OK")
+            elif verb in ("RSET", "NOOP"):
+                self._reply(250, "OK")
+            elif verb == "QUIT":
+                self._reply(221, "Bye")
+                return
+            else:
+                self._reply(502, "Command not implemented")
+
+    def _read_data(self) -> bytes:
+        lines = []
+        while line := self.rfile.readline():
+            if line == b".\r\n":
+                break
+            lines.append(line[1:] if line.startswith(b"..") else line)
+        return b"".join(lines)
+
+    def _reply(self, code: int, message: str) -> None:
+        self.wfile.write(f"{code} {message}\r\n".encode("ascii"))
+
+
+class SmtpServer:
+    """An SMTP stand-in saving the mails it receives in a folder.
+
+    Args:
+        folder: The folder the mails are saved in.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.mail_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+        smtp = self
+
+        class _Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+            def process_request(self, request, client_address):
+                smtp.count_connection()
+                super().process_request(request, client_address)
+
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.smtp = self
+        self.port = self._server.server_address[1]
+
+    def count_connection(self) -> None:
+        """Count a new connection."""
+        with self._lock:
+            self.connection_count += 1
+
+    def save(self, message: bytes) -> None:
+        """Save a received mail."""
+        with open(os.path.join(self.folder, f"{uuid.uuid4().hex}.eml"), "wb") as mail_file:
+            mail_file.write(message)
+        with self._lock:
+            self.mail_count += 1
+
+    def start(self) -> None:
+        """Serve in a background thread."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
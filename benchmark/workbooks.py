@@ -0,0 +1,123 @@
+"""This module generates synthetic xlsx workbooks of a given size for the benchmark.
+
+Each workbook has a connection filling a query table on a data sheet and a pivot table on a second
+sheet whose cache reads the query table, so the simulated refresh backend has a realistic plan.
+The data sheet is padded with incompressible rows and stored without compression, so the file
+size on disk is close to the requested size.
+"""
+
+import base64
+import os
+import re
+import zipfile
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIP_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?B)?\s*$", re.IGNORECASE)
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+# Bytes of random data per generated row
+_ROW_DATA = 3 * 1024
+
+_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "docProps/core.xml": (
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        '<dcterms:modified xsi:type="dcterms:W3CDTF">2024-01-01T00:00:00Z</dcterms:modified>'
+        '</cp:coreProperties>'
+    ),
+    "xl/workbook.xml": (
+        f'<workbook xmlns="{MAIN_NS}" xmlns:r="{RELATIONSHIP_NS}"><sheets>'
+        '<sheet name="Data" sheetId="1" r:id="rId1"/><sheet name="Pivot" sheetId="2" r:id="rId2"/>'
+        '</sheets><pivotCaches><pivotCache cacheId="1" r:id="rId3"/></pivotCaches></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{RELATIONSHIP_NS}/worksheet" Target="worksheets/sheet2.xml"/>'
+        f'<Relationship Id="rId3" Type="{RELATIONSHIP_NS}/pivotCacheDefinition" Target="pivotCache/pivotCacheDefinition1.xml"/>'
+        f'<Relationship Id="rId4" Type="{RELATIONSHIP_NS}/connections" Target="connections.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/connections.xml": (
+        f'<connections xmlns="{MAIN_NS}">'
+        '<connection id="1" name="Query - Data" type="5" refreshedVersion="8" background="1">'
+        '<dbPr connection="Provider=Microsoft.Mashup.OleDb.1;Location=Data" command="SELECT * FROM [Data]"/>'
+        '</connection></connections>'
+    ),
+    "xl/worksheets/_rels/sheet1.xml.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/table" Target="../tables/table1.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/tables/table1.xml": f'<table xmlns="{MAIN_NS}" id="1" name="Data" displayName="Data" ref="A1:A2" tableType="queryTable"/>',
+    "xl/tables/_rels/table1.xml.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/queryTable" Target="../queryTables/queryTable1.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/queryTables/queryTable1.xml": f'<queryTable xmlns="{MAIN_NS}" name="Data" connectionId="1"/>',
+    "xl/worksheets/sheet2.xml": f'<worksheet xmlns="{MAIN_NS}"><sheetData/></worksheet>',
+    "xl/worksheets/_rels/sheet2.xml.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/pivotTable" Target="../pivotTables/pivotTable1.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/pivotTables/pivotTable1.xml": f'<pivotTableDefinition xmlns="{MAIN_NS}" name="Pivot" cacheId="1"/>',
+    "xl/pivotTables/_rels/pivotTable1.xml.rels": (
+        f'<Relationships xmlns="{PACKAGE_RELATIONSHIP_NS}">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIP_NS}/pivotCacheDefinition" Target="../pivotCache/pivotCacheDefinition1.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/pivotCache/pivotCacheDefinition1.xml": (
+        f'<pivotCacheDefinition xmlns="{MAIN_NS}" refreshedDate="45292.5" refreshedBy="Benchmark" recordCount="1">'
+        '<cacheSource type="worksheet"><worksheetSource name="Data"/></cacheSource></pivotCacheDefinition>'
+    ),
+}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like '100KB', '10MB' or '1GB' into bytes."""
+    match = _SIZE.match(size)
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * _UNITS[(match.group(2) or "B").upper()])
+
+
+def create_workbook(file_path: str, size: int) -> None:
+    """Write a workbook of about size bytes to file_path."""
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _PARTS.items():
+            archive.writestr(name, content)
+
+        remaining = max(size - sum(info.compress_size for info in archive.infolist()) - 1024, 0)
+        sheet_info = zipfile.ZipInfo("xl/worksheets/sheet1.xml", date_time=(2024, 1, 1, 0, 0, 0))
+        sheet_info.compress_type = zipfile.ZIP_STORED
+        with archive.open(sheet_info, "w", force_zip64=True) as sheet:
+            header = f'<worksheet xmlns="{MAIN_NS}"><sheetData>'.encode()
+            footer = b"</sheetData></worksheet>"
+            sheet.write(header)
+            remaining -= len(header) + len(footer)
+            row = 1
+            while remaining > 0:
+                data = base64.b64encode(os.urandom(_ROW_DATA * 3 // 4)).decode()[:max(remaining - 60, 1)]
+                line = f'<row r="{row}"><c t="inlineStr"><is><t>{data}</t></is></c></row>'.encode()
+                sheet.write(line)
+                remaining -= len(line)
+                row += 1
+            sheet.write(footer)
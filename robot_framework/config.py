@@ -1,5 +1,7 @@
 """This module contains configuration constants used across the framework"""
 
+import os
+
 # The number of times the robot retries on an error before terminating.
 MAX_RETRY_COUNT = 3
 
@@ -13,10 +15,160 @@ FAIL_ROBOT_ON_TOO_MANY_ERRORS = False
 SMTP_SERVER = "smtp.adm.aarhuskommune.dk"
 SMTP_PORT = 25
 SCREENSHOT_SENDER = "excelrefresher@aarhus.dk"
+# Whether error mails use STARTTLS
+SMTP_STARTTLS = True
+
+# Notifications (see notifications.py)
+# Mails waiting for the dispatcher thread before notify() blocks
+NOTIFICATION_QUEUE_SIZE = 100
+# Attempts to send a mail before it's given up
+NOTIFICATION_SEND_ATTEMPTS = 3
+# Send one mail per kind and recipients at the end of the run instead of one per queue element or error
+NOTIFICATION_DIGEST = False
+# Seconds to wait for room on the notification queue, for a flush and for the delivery of a mail a queue element waits for
+NOTIFICATION_TIMEOUT = 10 * 60
+# Seconds an SMTP command may take, and seconds without mail before the connection is closed
+SMTP_TIMEOUT = 30
+SMTP_IDLE_SECONDS = 60
 
 # Constant/Credential names
 ERROR_EMAIL = "Error Email"
 
+# SharePoint session cache
+# Seconds an OpenOrchestrator credential lookup is reused
+CREDENTIAL_CACHE_SECONDS = 15 * 60
+# Lifetime of a SharePoint access token when it can't be read from the token, and how long before expiry a new one is made
+SHAREPOINT_TOKEN_LIFETIME = 60 * 60
+SHAREPOINT_TOKEN_MARGIN = 5 * 60
+
+
+# SharePoint transfers
+# Bytes read per chunk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Number of times an interrupted download is resumed
+DOWNLOAD_ATTEMPTS = 3
+# Seconds to wait for the server before a request is considered failed
+HTTP_TIMEOUT = 120
+# Files up to this size are uploaded in a single request
+SHAREPOINT_SMALL_UPLOAD_LIMIT = 4 * 1024 * 1024
+# Chunked uploads start at UPLOAD_CHUNK_SIZE and adapt towards UPLOAD_CHUNK_TARGET_SECONDS per chunk
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+UPLOAD_MIN_CHUNK_SIZE = 2 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 100 * 1024 * 1024
+UPLOAD_CHUNK_TARGET_SECONDS = 15
+# Number of times in a row a chunk may fail before the upload gives up
+UPLOAD_CHUNK_ATTEMPTS = 5
+
+# SharePoint throttling (see sharepoint_transport)
+# Times a request is sent while SharePoint answers 429 or 503 before the error is raised
+SHAREPOINT_THROTTLE_ATTEMPTS = 6
+# Without Retry-After a throttled request waits SHAREPOINT_BACKOFF_BASE * 2^(attempt - 1) seconds, at most SHAREPOINT_BACKOFF_MAX.
+# Up to SHAREPOINT_BACKOFF_JITTER of the wait is added at random
+SHAREPOINT_BACKOFF_BASE = 2
+SHAREPOINT_BACKOFF_MAX = 5 * 60
+SHAREPOINT_BACKOFF_JITTER = 0.2
+# Requests per second shared by all workers, and the burst allowed above it
+SHAREPOINT_REQUESTS_PER_SECOND = 10
+SHAREPOINT_REQUEST_BURST = 20
+# Concurrent requests at the start and the bounds of the adaptive limit, and the factor it's multiplied by when throttled
+SHAREPOINT_CONCURRENCY = 4
+SHAREPOINT_MIN_CONCURRENCY = 1
+SHAREPOINT_MAX_CONCURRENCY = 16
+SHAREPOINT_CONCURRENCY_DECREASE = 0.5
+
+
+# Excel worker pool
+# The backend used by the Excel workers: "com" for Excel through COM, "simulated" to run without Excel
+REFRESH_BACKEND = "com"
+# Seconds a single workbook may take to refresh. Used until a workbook has a history, and as the cap of its timeout
+REFRESH_TIMEOUT = 60 * 60
+# A workbook's timeout is the p99 of its last REFRESH_HISTORY_SIZE refresh durations times REFRESH_TIMEOUT_FACTOR,
+# but at least REFRESH_TIMEOUT_FLOOR seconds. It is used once there are REFRESH_HISTORY_MIN_SAMPLES durations
+REFRESH_TIMEOUT_FACTOR = 3
+REFRESH_TIMEOUT_FLOOR = 120
+REFRESH_HISTORY_SIZE = 50
+REFRESH_HISTORY_MIN_SAMPLES = 3
+# Whether independent OLEDB/ODBC connections of a pivot workbook refresh concurrently in the background
+REFRESH_CONNECTIONS_IN_BACKGROUND = True
+# Whether pivot workbooks skip connections whose source data hasn't changed since their last refresh, see source_fingerprint
+INCREMENTAL_REFRESH = False
+# Probe query per connection name, returning a row that changes when the source data changes,
+# e.g. {"Query - Salg": "SELECT COUNT_BIG(*), MAX(RowVersion) FROM dbo.Salg"}. Connections to a table are probed without one
+SOURCE_PROBES = {}
+# Seconds a probe may take before the connection is refreshed anyway
+SOURCE_PROBE_TIMEOUT = 10
+# Whether a refreshed workbook is verified from its saved parts, see refresh_verifier. Connections, query tables and
+# pivot caches that fail are refreshed again in the same Excel session, up to REFRESH_REPAIR_ATTEMPTS times
+REFRESH_VERIFICATION = True
+REFRESH_REPAIR_ATTEMPTS = 1
+# Whether a workbook that still fails verification fails its queue element instead of being uploaded partly stale
+FAIL_UNVERIFIED_REFRESH = True
+# Whether the refresh strategy of a workbook is chosen from its structure, see workbook_inspector.
+# Workbooks with nothing to refresh skip Excel, and workbooks with pivot caches on connections get the planned pivot refresh
+WORKBOOK_INSPECTION = True
+# Estimated seconds to refresh each kind of node and to open and save each megabyte of parts, for workbooks without a refresh history
+INSPECTION_NODE_SECONDS = {"connection": 30, "query table": 5, "pivot cache": 5, "pivot table": 1}
+INSPECTION_SECONDS_PER_MB = 0.5
+# Replace an Excel worker after this many workbooks or when Excel uses more than this many bytes
+EXCEL_RECYCLE_AFTER = 25
+EXCEL_RECYCLE_MEMORY = 2 * 1024 * 1024 * 1024
+# Seconds to wait for an Excel worker to start Excel and to close gracefully
+EXCEL_START_TIMEOUT = 5 * 60
+EXCEL_STOP_TIMEOUT = 30
+
+# Simulated refresh backend
+# Median seconds of each step; the durations are log-normal with the given sigma
+SIMULATED_LATENCY = {
+    "open": 0.5,
+    "connection": 2.0,
+    "query table": 0.2,
+    "pivot cache": 0.5,
+    "pivot table": 0.1,
+    "save": 0.3,
+}
+SIMULATED_LATENCY_SIGMA = 0.5
+# Extra seconds per megabyte of workbook when opening and saving
+SIMULATED_SECONDS_PER_MB = 0.05
+# Probability that a node refresh fails, that a workbook hangs and that a refresh changes the data
+SIMULATED_FAILURE_RATE = 0.0
+SIMULATED_HANG_RATE = 0.0
+SIMULATED_DATA_CHANGE_RATE = 0.5
+# Reported memory usage of a simulated Excel instance
+SIMULATED_BASE_MEMORY = 100 * 1024 * 1024
+SIMULATED_MEMORY_PER_WORKBOOK = 20 * 1024 * 1024
+
+# Skip uploading workbooks whose data didn't change during the refresh
+SKIP_UNCHANGED_UPLOADS = True
+
+
+# Local state
+# Folder outside the working directory where state is kept between runs
+STATE_FOLDER = os.path.join(os.path.expanduser("~"), "ExcelRefresher")
+
+# Workbook cache keyed on SharePoint ETag (subfolder of STATE_FOLDER)
+WORKBOOK_CACHE_ENABLED = True
+WORKBOOK_CACHE_FOLDER = "workbook_cache"
+WORKBOOK_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+# Refresh durations of every workbook (file in STATE_FOLDER)
+WORKBOOK_HISTORY_FILE = "workbook_history.json"
+
+# Source fingerprints of every pivot workbook's last successful refresh (file in STATE_FOLDER)
+SOURCE_FINGERPRINTS_FILE = "source_fingerprints.json"
+
+# Stages finished by the queue elements being processed, so retries can resume (file in STATE_FOLDER)
+CHECKPOINTS_FILE = "element_checkpoints.json"
+
+# Process ids of the Excel instances started by the robot, so orphans of a crashed run can be killed (file in STATE_FOLDER)
+EXCEL_PIDS_FILE = "excel_pids.json"
+
+# Timed spans and metrics of every run (subfolder of STATE_FOLDER)
+TELEMETRY_FOLDER = "telemetry"
+# Format of the metrics file written at the end of a run: "prometheus" or "openmetrics"
+METRICS_FORMAT = "prometheus"
+# Upper bounds in seconds of the buckets of the span duration histogram
+METRICS_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
 
 # Queue specific configs
 # ----------------------
@@ -24,7 +176,44 @@ ERROR_EMAIL = "Error Email"
 # The name of the job queue (if any)
 QUEUE_NAME = "ExcelRefresher"
 
+# Rows of QueueExcelRefresher are due when their TimeStamp is older than this many hours
+CLAIM_INTERVAL_HOURS = 20
+
+# The number of due rows claimed and queued per transaction
+CLAIM_BATCH_SIZE = 500
+
 # The limit on how many queue elements to process
 MAX_TASK_COUNT = 100
 
+# The number of queue elements processed concurrently by the worker pool
+MAX_WORKERS = 3
+
+# Folder (relative to the working directory) holding a working folder per worker
+WORK_FOLDER = "work"
+
+# Whether a retried queue element resumes at the first stage it didn't finish, see element_checkpoints
+STAGE_CHECKPOINTS = True
+# Hours before the checkpoints of an element that was never finished are dropped
+CHECKPOINT_MAX_AGE_HOURS = 24
+
+# Whether to run download, refresh and upload as overlapping pipeline stages.
+# The refresh stage runs MAX_WORKERS refreshes at a time.
+PIPELINE_ENABLED = True
+
+# The number of workbooks that may wait between two pipeline stages
+PIPELINE_QUEUE_SIZE = 1
+
+# Scheduling
+# Priority lane of queue elements by FolderPath or CustomFunction. Lower lanes are processed first, others get SCHEDULER_DEFAULT_LANE
+SCHEDULER_LANES = {"VeryRefreshed": 0}
+SCHEDULER_DEFAULT_LANE = 1
+# Local time ("HH:MM", e.g. "07:00") the batch must be done by, or None. Elements that aren't expected to finish in time are left for the next run
+SCHEDULER_DEADLINE = None
+# Whether the workbooks of a SharePoint site are processed together within a lane, sharing session and folder lookups
+SCHEDULER_GROUP_BY_SITE = True
+# Estimated seconds of a workbook while no workbook has a history
+SCHEDULER_DEFAULT_ESTIMATE = 5 * 60
+# The maximum number of new queue elements read when planning
+SCHEDULER_PLAN_LIMIT = 1000
+
 # ----------------------
@@ -0,0 +1,142 @@
+"""This module keeps checkpoints of the stages each queue element has finished, so a retry resumes
+at the first stage that didn't finish instead of starting over.
+
+The stages are DOWNLOADED and REFRESHED, which record the local workbook and its sha256, and
+UPLOADED, ARCHIVED and MAILED. A retried element reuses the local workbook of its latest checkpoint
+if the file still has the recorded hash, so an upload timeout costs one upload and not another download
+and refresh. If the file is gone or has changed, the checkpoints are dropped and the element starts over.
+
+The checkpoints are kept in config.CHECKPOINTS_FILE in config.STATE_FOLDER. They are cleared when the
+element is done, and discarded together with the local workbook when it fails for good.
+"""
+
+import json
+import os
+import threading
+import time
+
+from robot_framework import config
+from robot_framework import sharepoint_transfer
+from robot_framework import workbook_fingerprint
+
+DOWNLOADED = "downloaded"
+REFRESHED = "refreshed"
+UPLOADED = "uploaded"
+ARCHIVED = "archived"
+MAILED = "mailed"
+
+# Stages that leave a local workbook, latest first
+_FILE_STAGES = (REFRESHED, DOWNLOADED)
+
+_lock = threading.Lock()
+
+
+def _checkpoints_path() -> str:
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    return os.path.join(config.STATE_FOLDER, config.CHECKPOINTS_FILE)
+
+
+def _read() -> dict:
+    try:
+        with open(_checkpoints_path(), encoding="utf-8") as checkpoints_file:
+            return json.load(checkpoints_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write(checkpoints: dict) -> None:
+    checkpoints_path = _checkpoints_path()
+    with open(f"{checkpoints_path}.tmp", "w", encoding="utf-8") as checkpoints_file:
+        json.dump(checkpoints, checkpoints_file)
+    os.replace(f"{checkpoints_path}.tmp", checkpoints_path)
+
+
+def _stages(queue_element_id) -> dict:
+    with _lock:
+        return _read().get(str(queue_element_id), {}).get("stages", {})
+
+
+def mark(queue_element_id, stage: str, local_file_path: str | None = None) -> None:
+    """Record that a queue element finished a stage. Nothing is recorded without a queue element.
+
+    Args:
+        queue_element_id: The id of the queue element, or None.
+        stage: The stage that finished, e.g. UPLOADED.
+        local_file_path: The local workbook the stage left, whose hash is recorded with the checkpoint.
+    """
+    if not config.STAGE_CHECKPOINTS or queue_element_id is None:
+        return
+
+    checkpoint = {}
+    if local_file_path:
+        checkpoint = {"path": os.path.abspath(local_file_path), "sha256": sharepoint_transfer.file_sha256(local_file_path)}
+
+    now = time.time()
+    with _lock:
+        checkpoints = _read()
+        # Checkpoints of elements that were never finished, e.g. because the robot was stopped, are dropped eventually
+        checkpoints = {
+            element_id: entry for element_id, entry in checkpoints.items()
+            if now - entry.get("updated", 0) < config.CHECKPOINT_MAX_AGE_HOURS * 3600
+        }
+        entry = checkpoints.setdefault(str(queue_element_id), {"stages": {}})
+        entry["stages"][stage] = checkpoint
+        entry["updated"] = now
+        _write(checkpoints)
+
+
+def is_done(queue_element_id, stage: str) -> bool:
+    """Check if a queue element has finished a stage in an earlier attempt."""
+    return config.STAGE_CHECKPOINTS and queue_element_id is not None and stage in _stages(queue_element_id)
+
+
+def resume_file(queue_element_id) -> str | None:
+    """Get the local workbook of a queue element's latest checkpoint, if it's still there unchanged.
+    Otherwise the element's checkpoints are dropped, as its stages have to run again from the start.
+
+    Returns:
+        str | None: The path of the workbook, or None if the element must be downloaded.
+    """
+    if not config.STAGE_CHECKPOINTS:
+        return None
+
+    stages = _stages(queue_element_id)
+    for stage in _FILE_STAGES:
+        checkpoint = stages.get(stage)
+        if checkpoint is None:
+            continue
+        path = checkpoint["path"]
+        if os.path.exists(path) and sharepoint_transfer.file_sha256(path) == checkpoint["sha256"]:
+            return path
+        break
+
+    if stages:
+        clear(queue_element_id)
+    return None
+
+
+def holds(queue_element_id, local_file_path: str | None) -> bool:
+    """Check if a local workbook belongs to a checkpoint of the queue element and should be kept for a retry."""
+    if not config.STAGE_CHECKPOINTS or not local_file_path:
+        return False
+    path = os.path.abspath(local_file_path)
+    return any(checkpoint.get("path") == path for checkpoint in _stages(queue_element_id).values())
+
+
+def clear(queue_element_id) -> None:
+    """Drop the checkpoints of a queue element."""
+    with _lock:
+        checkpoints = _read()
+        if checkpoints.pop(str(queue_element_id), None) is not None:
+            _write(checkpoints)
+
+
+def discard(queue_element_id) -> None:
+    """Drop the checkpoints of a queue element that won't be retried, and remove the local workbooks they kept."""
+    for checkpoint in _stages(queue_element_id).values():
+        path = checkpoint.get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+        if path:
+            workbook_fingerprint.forget(path)
+    clear(queue_element_id)
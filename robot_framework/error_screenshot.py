@@ -1,7 +1,5 @@
 """This module has functionality to send error screenshots via smtp."""
 
-import smtplib
-from email.message import EmailMessage
 #import base64
 import traceback
 # from io import BytesIO
@@ -9,23 +7,20 @@ import traceback
 #from PIL import ImageGrab
 
 from robot_framework import config
+from robot_framework import notifications
 
 
 def send_error_screenshot(to_address: str | list[str], exception: Exception, process_name: str):
     """Sends an email with an error report, including a screenshot, when an exception occurs.
     Configuration details such as SMTP server, port, sender email, etc., should be set in 'config' module.
+    The mail is sent in the background by notifications, and with config.NOTIFICATION_DIGEST the errors
+    of the run are sent in one mail at the end.
 
     Args:
         to_address: Email address or list of addresses to send the error report.
         exception: The exception that triggered the error.
         process_name: Name of the process from OpenOrchestrator.
     """
-    # Create message
-    msg = EmailMessage()
-    msg['to'] = to_address
-    msg['from'] = config.SCREENSHOT_SENDER
-    msg['subject'] = f"Error: {process_name}"
-
     # Take screenshot and convert to base64
  #   screenshot = ImageGrab.grab()
  #   buffer = BytesIO()
@@ -44,11 +39,11 @@ def send_error_screenshot(to_address: str | list[str], exception: Exception, pro
     """
     #            <img src="data:image/png;base64,{screenshot_base64}" alt="Screenshot">
 
-
-    msg.set_content("Please enable HTML to view this message.")
-    msg.add_alternative(html_message, subtype='html')
-
-    # Send message
-    with smtplib.SMTP(config.SMTP_SERVER, config.SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.send_message(msg)
+    notifications.notify(notifications.Notification(
+        sender=config.SCREENSHOT_SENDER,
+        to=to_address,
+        subject=f"Error: {process_name}",
+        html=html_message,
+        digest_key="error",
+        starttls=config.SMTP_STARTTLS,
+    ))
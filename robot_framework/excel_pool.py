@@ -0,0 +1,319 @@
+"""This module keeps a pool of long-lived Excel worker processes.
+
+Each worker process keeps one Excel instance warm through a refresh backend and refreshes one workbook
+at a time. Between workbooks the worker reports its health and memory usage, and the pool replaces it
+when it is unhealthy, has refreshed config.EXCEL_RECYCLE_AFTER workbooks or uses more than
+config.EXCEL_RECYCLE_MEMORY bytes.
+A worker that exceeds its timeout is killed together with its own Excel process only.
+The process ids of the Excel instances are kept in config.EXCEL_PIDS_FILE while they run, so
+instances orphaned by a crashed run can be killed without touching anybody else's Excel.
+"""
+
+import json
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+
+from robot_framework import config
+from robot_framework import refresh_backend
+from robot_framework import telemetry
+
+# The executable of Excel, so a reused process id of another program is never killed
+EXCEL_IMAGE_NAME = "EXCEL.EXE"
+
+# Seconds between checks that a starting worker is still alive
+_START_POLL_SECONDS = 1.0
+
+
+class ExcelWorkerError(Exception):
+    """Raised when a workbook refresh fails inside an Excel worker."""
+
+
+def _worker_main(connection: Connection, backend_name: str) -> None:
+    """The main loop of a worker process."""
+    backend = refresh_backend.create_backend(backend_name)
+    try:
+        backend.start()
+    except Exception:  # pylint: disable=broad-exception-caught
+        connection.send(("error", traceback.format_exc()))
+        return
+    connection.send(("started", backend.pid))
+
+    try:
+        while (message := connection.recv()) is not None:
+            file_path, pivot, unchanged = message
+            with telemetry.capture() as spans:
+                try:
+                    result = ("ok", refresh_backend.refresh_workbook(backend, file_path, pivot, unchanged))
+                except Exception:  # pylint: disable=broad-exception-caught
+                    result = ("error", traceback.format_exc())
+            # Et syg Excel kan fejle her, og arbejderen skal stadig svare
+            try:
+                health = (backend.is_healthy(), backend.memory_usage())
+            except Exception:  # pylint: disable=broad-exception-caught
+                health = (False, 0)
+            connection.send((*result, *health, spans))
+    finally:
+        backend.stop()
+
+
+class ExcelWorker:
+    """The parent side of an Excel worker process."""
+
+    def __init__(self, backend_name: str):
+        self.workbook_count = 0
+        self.healthy = True
+        self.memory_usage = 0
+
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_worker_main, args=(child_connection, backend_name), daemon=True)
+        self._process.start()
+        # Only the worker holds its end, so the parent gets EOF when the worker dies
+        child_connection.close()
+
+        status, value = self._wait_for_start()
+        if status != "started":
+            self._process.join()
+            raise ExcelWorkerError(f"Excel worker failed to start:\n{value}")
+        self.excel_pid = value
+        _track_excel_pid(self.excel_pid, running=True)
+
+    def _wait_for_start(self) -> tuple:
+        """Wait up to config.EXCEL_START_TIMEOUT for the worker's first message.
+        A worker that dies or doesn't answer in time raises ExcelWorkerError instead of blocking the pool.
+        """
+        deadline = time.monotonic() + config.EXCEL_START_TIMEOUT
+        while not self._connection.poll(_START_POLL_SECONDS):
+            if not self._process.is_alive() and not self._connection.poll():
+                raise ExcelWorkerError(f"Excel worker exited with code {self._process.exitcode} before Excel started.")
+            if time.monotonic() >= deadline:
+                self._process.kill()
+                self._process.join()
+                raise ExcelWorkerError(f"Excel didn't start within {config.EXCEL_START_TIMEOUT} seconds.")
+        try:
+            return self._connection.recv()
+        except EOFError as e:
+            self._process.join(config.EXCEL_STOP_TIMEOUT)
+            raise ExcelWorkerError(f"Excel worker exited with code {self._process.exitcode} before Excel started.") from e
+
+    @property
+    def pid(self) -> int:
+        """The process id of the worker process."""
+        return self._process.pid
+
+    def refresh(self, file_path: str, pivot: bool, timeout: float, unchanged: frozenset[str] = frozenset()) -> refresh_backend.RefreshResult:
+        """Refresh a workbook in the worker.
+
+        Args:
+            file_path: The path of the workbook.
+            pivot: Whether pivot caches and tables should be refreshed explicitly.
+            timeout: Seconds to wait for the refresh.
+            unchanged: Keys of connections whose source data hasn't changed.
+
+        Returns:
+            refresh_backend.RefreshResult: What the backend refreshed and the nodes that failed.
+
+        Raises:
+            TimeoutError: If the refresh didn't finish within the timeout.
+            ExcelWorkerError: If the refresh failed.
+        """
+        self._connection.send((file_path, pivot, unchanged))
+        if not self._connection.poll(timeout):
+            self.healthy = False
+            raise TimeoutError(f"Refresh of {file_path} exceeded the timeout of {timeout:.0f} seconds.")
+
+        try:
+            status, value, self.healthy, self.memory_usage, spans = self._connection.recv()
+        except (EOFError, OSError) as e:
+            self.healthy = False
+            raise ExcelWorkerError(f"Excel worker died while refreshing {file_path}.") from e
+        # The spans of the worker belong to the element being refreshed in this thread
+        telemetry.record_spans(spans)
+        self.workbook_count += 1
+        if status != "ok":
+            raise ExcelWorkerError(f"Refresh of {file_path} failed:\n{value}")
+        return value
+
+    def needs_recycling(self) -> bool:
+        """Check if the worker should be replaced before its next workbook."""
+        return (
+            not self.healthy
+            or self.workbook_count >= config.EXCEL_RECYCLE_AFTER
+            or self.memory_usage >= config.EXCEL_RECYCLE_MEMORY
+        )
+
+    def stop(self) -> None:
+        """Ask the worker to close Excel and exit, killing it if it doesn't.
+        The worker's Excel instance is killed in any case, as it can outlive a worker that has died.
+        """
+        try:
+            self._connection.send(None)
+        except OSError:
+            pass
+        self._process.join(config.EXCEL_STOP_TIMEOUT)
+        if self._process.is_alive():
+            self.kill()
+        elif self.excel_pid:
+            # Excel kan overleve en arbejder, der er gået ned, og skal så lukkes, før den glemmes
+            kill_process_tree(self.excel_pid, image_name=EXCEL_IMAGE_NAME)
+            _track_excel_pid(self.excel_pid, running=False)
+
+    def kill(self) -> None:
+        """Kill the worker process and its Excel instance without touching other Excel instances."""
+        self._process.kill()
+        self._process.join()
+        if self.excel_pid:
+            kill_process_tree(self.excel_pid)
+            _track_excel_pid(self.excel_pid, running=False)
+
+
+def kill_process_tree(pid: int, image_name: str | None = None) -> None:
+    """Forcefully close a process and its children.
+    If image_name is given the process is only killed if it runs that executable,
+    which guards against a process id that has been reused.
+    """
+    image_filter = f' /FI "IMAGENAME eq {image_name}"' if image_name else ""
+    subprocess.call(f"taskkill /F /T{image_filter} /PID {pid}", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
+
+
+_pids_lock = threading.Lock()
+
+
+def _pids_path() -> str:
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    return os.path.join(config.STATE_FOLDER, config.EXCEL_PIDS_FILE)
+
+
+def _read_pids() -> list[int]:
+    try:
+        with open(_pids_path(), encoding="utf-8") as pids_file:
+            return json.load(pids_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def _write_pids(pids: list[int]) -> None:
+    with open(f"{_pids_path()}.tmp", "w", encoding="utf-8") as pids_file:
+        json.dump(pids, pids_file)
+    os.replace(f"{_pids_path()}.tmp", _pids_path())
+
+
+def _track_excel_pid(pid: int | None, running: bool) -> None:
+    """Add or remove the process id of an Excel instance started by the robot."""
+    if not pid:
+        return
+    with _pids_lock:
+        pids = [p for p in _read_pids() if p != pid]
+        if running:
+            pids.append(pid)
+        _write_pids(pids)
+
+
+def kill_orphaned_excel() -> int:
+    """Kill the Excel instances started by the robot that no worker owns anymore,
+    e.g. after a crash or a worker that couldn't be stopped.
+    Should only be called when no workers are running.
+
+    Returns:
+        int: The number of process ids that were killed.
+    """
+    with _pids_lock:
+        pids = _read_pids()
+        for pid in pids:
+            kill_process_tree(pid, EXCEL_IMAGE_NAME)
+        _write_pids([])
+    return len(pids)
+
+
+class ExcelPool:
+    """A bounded pool of Excel workers. Workers are started when first needed."""
+
+    def __init__(self, size: int, backend_name: str):
+        self._size = size
+        self._backend_name = backend_name
+        self._idle: list[ExcelWorker] = []
+        self._condition = threading.Condition()
+        self._started = 0
+
+    def refresh(self, file_path: str, pivot: bool, timeout: float, unchanged: frozenset[str] = frozenset()) -> refresh_backend.RefreshResult:
+        """Refresh a workbook on the next idle worker.
+
+        Args:
+            file_path: The path of the workbook.
+            pivot: Whether pivot caches and tables should be refreshed explicitly.
+            timeout: Seconds to wait for the refresh.
+            unchanged: Keys of connections whose source data hasn't changed.
+
+        Returns:
+            refresh_backend.RefreshResult: What the backend refreshed and the nodes that failed.
+        """
+        worker = self._acquire()
+        try:
+            return worker.refresh(file_path, pivot, timeout, unchanged)
+        except TimeoutError:
+            worker.kill()
+            worker = None
+            raise
+        finally:
+            self._release(worker)
+
+    def _acquire(self) -> ExcelWorker:
+        with self._condition:
+            while not self._idle and self._started >= self._size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+
+        try:
+            return ExcelWorker(self._backend_name)
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker: ExcelWorker | None) -> None:
+        """Put a worker back in the pool, or free its slot if it's gone or needs recycling."""
+        if worker is not None and worker.needs_recycling():
+            worker.stop()
+            worker = None
+
+        with self._condition:
+            if worker is None:
+                self._started -= 1
+            else:
+                self._idle.append(worker)
+            self._condition.notify()
+
+    def shutdown(self) -> None:
+        """Stop all idle workers."""
+        with self._condition:
+            workers, self._idle = self._idle, []
+            self._started -= len(workers)
+        for worker in workers:
+            worker.stop()
+
+
+_pool: ExcelPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ExcelPool:
+    """Get the Excel pool of this run, creating it on first use."""
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExcelPool(config.MAX_WORKERS, config.REFRESH_BACKEND)
+        return _pool
+
+
+def shutdown() -> None:
+    """Stop the Excel pool of this run, if any."""
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
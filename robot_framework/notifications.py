@@ -0,0 +1,396 @@
+"""This module sends mails from a background thread, so mail delivery doesn't hold up the queue elements.
+
+notify() puts a Notification on a bounded queue of config.NOTIFICATION_QUEUE_SIZE and returns at once
+with a future of its delivery, which a caller that must know the mail went out can wait for.
+The dispatcher thread keeps one SMTP connection per server open between mails, closes it after
+config.SMTP_IDLE_SECONDS without mail and reconnects if the server has dropped it.
+notify() and flush() wait at most config.NOTIFICATION_TIMEOUT and raise NotificationError instead of
+hanging if the dispatcher thread has stopped, and notify() starts a new dispatcher in that case.
+Attachments are snapshots of the files taken by snapshot() when the notification is made, and are
+streamed as base64 lines straight to the SMTP socket, so a large workbook is never held in memory.
+
+With config.NOTIFICATION_DIGEST, notifications with a digest key are held until flush() or shutdown()
+at the end of the run and sent as one mail per digest key and recipients.
+"""
+
+import atexit
+import base64
+import os
+import queue
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+
+from robot_framework import config
+from robot_framework import telemetry
+
+# Bytes of an attachment read at a time; a multiple of 57 so every base64 line is 76 characters
+_ATTACHMENT_CHUNK = 57 * 1024
+
+
+class NotificationError(Exception):
+    """Raised when a mail couldn't be sent or queued."""
+
+
+@dataclass
+class Attachment:
+    """A file attached to a notification. Snapshots are deleted once the notification is handled."""
+    path: str
+    filename: str
+    maintype: str = "application"
+    subtype: str = "octet-stream"
+    snapshot: bool = False
+
+
+@dataclass
+class Notification:
+    """A mail to send.
+
+    Attributes:
+        sender: The from address.
+        to: The recipients, as a list or a string separated by ',' or ';'.
+        subject: The subject.
+        html: The html body.
+        text: The plain text body shown by clients without html.
+        attachments: Files to attach.
+        digest_key: Notifications with the same key and recipients are combined in config.NOTIFICATION_DIGEST mode.
+        starttls: Whether to use STARTTLS on the connection.
+        log: Called with a message when the mail is sent.
+        log_error: Called with a message when the mail couldn't be sent.
+        delivered: Done when the mail is sent, or failed with a NotificationError when it couldn't be.
+    """
+    sender: str
+    to: str | list[str]
+    subject: str
+    html: str
+    text: str = "Please enable HTML to view this message."
+    attachments: list[Attachment] = field(default_factory=list)
+    digest_key: str | None = None
+    starttls: bool = False
+    log: Callable[[str], None] | None = None
+    log_error: Callable[[str], None] | None = None
+    delivered: Future = field(default_factory=Future, repr=False, compare=False)
+
+    @property
+    def recipients(self) -> list[str]:
+        """The recipients as a list of addresses."""
+        addresses = self.to if isinstance(self.to, list) else re.split(r"[;,]", self.to or "")
+        return [address.strip() for address in addresses if address.strip()]
+
+    @property
+    def held(self) -> bool:
+        """Whether the notification is held for a digest until the end of the run."""
+        return config.NOTIFICATION_DIGEST and self.digest_key is not None
+
+
+def snapshot(file_path: str, filename: str, subtype: str = "octet-stream") -> Attachment:
+    """Take a snapshot of a file to attach, so the file itself can be deleted or changed right away.
+    The snapshot is a hard link where possible and otherwise a copy.
+
+    Args:
+        file_path: The file to attach.
+        filename: The name of the attachment.
+        subtype: The subtype of the application/* content type.
+
+    Returns:
+        Attachment: The attachment of the snapshot.
+    """
+    snapshot_path = os.path.join(tempfile.gettempdir(), f"mail_{uuid.uuid4().hex}_{os.path.basename(file_path)}")
+    # Kopiér så en tilbageværende Excel-lås ikke blokerer vedhæftningen
+    delay = 0.3
+    for attempt in range(1, 6):
+        try:
+            try:
+                os.link(file_path, snapshot_path)
+            except OSError as e:
+                if isinstance(e, PermissionError):
+                    raise
+                shutil.copyfile(file_path, snapshot_path)
+            break
+        except PermissionError:
+            if attempt == 5:
+                raise
+            time.sleep(delay)
+            delay *= 1.7
+    return Attachment(snapshot_path, filename, "application", subtype, snapshot=True)
+
+
+class Dispatcher:
+    """Sends notifications from a background thread over reused SMTP connections."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=config.NOTIFICATION_QUEUE_SIZE)
+        self._held: list[Notification] = []
+        # (server, port, starttls) -> open SMTP connection
+        self._connections: dict[tuple, smtplib.SMTP] = {}
+        self._thread = threading.Thread(target=self._run, name="Notifications", daemon=True)
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        """Check if the dispatcher thread is running."""
+        return self._thread.is_alive()
+
+    def notify(self, notification: Notification) -> Future:
+        """Queue a notification, waiting up to config.NOTIFICATION_TIMEOUT if the queue is full.
+
+        Returns:
+            Future: notification.delivered.
+
+        Raises:
+            NotificationError: If the dispatcher has stopped or the queue stayed full.
+        """
+        self._put(notification)
+        return notification.delivered
+
+    def flush(self) -> None:
+        """Send any held digests and wait until every queued notification is handled.
+
+        Raises:
+            NotificationError: If the dispatcher has stopped or didn't get through the queue within config.NOTIFICATION_TIMEOUT.
+        """
+        flushed = Future()
+        self._put(flushed)
+        try:
+            flushed.result(timeout=config.NOTIFICATION_TIMEOUT)
+        except TimeoutError as e:
+            raise NotificationError(f"The notifications weren't sent within {config.NOTIFICATION_TIMEOUT} seconds.") from e
+
+    def close(self) -> None:
+        """Send everything queued and held, close the connections and stop the thread."""
+        if not self.is_alive():
+            return
+        try:
+            self._put(None)
+        except NotificationError:
+            return
+        self._thread.join(config.NOTIFICATION_TIMEOUT)
+
+    def _put(self, item) -> None:
+        if not self.is_alive():
+            raise NotificationError("The notification dispatcher has stopped.")
+        try:
+            self._queue.put(item, timeout=config.NOTIFICATION_TIMEOUT)
+        except queue.Full as e:
+            raise NotificationError(f"The notification queue stayed full for {config.NOTIFICATION_TIMEOUT} seconds.") from e
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=config.SMTP_IDLE_SECONDS)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            # Tråden må ikke dø, for så venter notify og flush forgæves
+            try:
+                if item is None or isinstance(item, Future):
+                    self._send_held()
+                    if item is not None:
+                        item.set_result(None)
+                elif item.held:
+                    self._held.append(item)
+                else:
+                    self._deliver(item)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                if isinstance(item, Notification):
+                    _fail(item, e)
+                elif isinstance(item, Future):
+                    item.set_exception(NotificationError(f"Sending the held notifications failed: {e}"))
+            if item is None:
+                self._disconnect()
+                return
+
+    def _send_held(self) -> None:
+        """Send the held notifications as one mail per digest key, sender and recipients."""
+        groups: dict[tuple, list[Notification]] = {}
+        for notification in self._held:
+            key = (notification.digest_key, notification.sender, tuple(notification.recipients), notification.starttls)
+            groups.setdefault(key, []).append(notification)
+        self._held = []
+
+        for group in groups.values():
+            if len(group) == 1:
+                self._deliver(group[0])
+                continue
+            first = group[0]
+            digest = Notification(
+                sender=first.sender,
+                to=first.recipients,
+                subject=f"{first.subject} ({len(group)})",
+                html="<hr>".join(notification.html for notification in group),
+                text=first.text,
+                attachments=[attachment for notification in group for attachment in notification.attachments],
+                starttls=first.starttls,
+                log=_log_all([notification.log for notification in group]),
+                log_error=_log_all([notification.log_error for notification in group]),
+            )
+            self._deliver(digest)
+            for notification in group:
+                _resolve(notification.delivered, digest.delivered)
+
+    def _deliver(self, notification: Notification) -> None:
+        """Send a notification with up to config.NOTIFICATION_SEND_ATTEMPTS attempts and delete its snapshots.
+        The outcome is set on notification.delivered.
+        """
+        try:
+            for attempt in range(1, config.NOTIFICATION_SEND_ATTEMPTS + 1):
+                key = (config.SMTP_SERVER, config.SMTP_PORT, notification.starttls)
+                try:
+                    size = sum(os.path.getsize(attachment.path) for attachment in notification.attachments)
+                    with telemetry.span("mail", bytes=size, recipients=", ".join(notification.recipients)):
+                        _send(self._connect(key), notification)
+                    if notification.log:
+                        notification.log(f"[Ok] Mail '{notification.subject}' sent to {', '.join(notification.recipients)}")
+                    notification.delivered.set_result(None)
+                    return
+                except (smtplib.SMTPException, OSError) as e:
+                    self._disconnect(key)
+                    if attempt == config.NOTIFICATION_SEND_ATTEMPTS:
+                        _fail(notification, e)
+                        return
+                    time.sleep(2 ** attempt)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            _fail(notification, e)
+        finally:
+            for attachment in notification.attachments:
+                if attachment.snapshot:
+                    try:
+                        os.remove(attachment.path)
+                    except OSError:
+                        pass
+
+    def _connect(self, key: tuple) -> smtplib.SMTP:
+        smtp = self._connections.get(key)
+        if smtp is None:
+            server, port, starttls = key
+            smtp = smtplib.SMTP(server, port, timeout=config.SMTP_TIMEOUT)
+            if starttls:
+                smtp.starttls()
+            self._connections[key] = smtp
+        return smtp
+
+    def _disconnect(self, key: tuple | None = None) -> None:
+        for connection_key in [key] if key else list(self._connections):
+            smtp = self._connections.pop(connection_key, None)
+            if smtp is None:
+                continue
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+
+def _fail(notification: Notification, error: Exception) -> None:
+    """Log that a notification couldn't be sent and fail its delivery."""
+    message = f"Mail '{notification.subject}' to {', '.join(notification.recipients)} could not be sent: {error}"
+    if notification.log_error:
+        notification.log_error(message)
+    if not notification.delivered.done():
+        notification.delivered.set_exception(NotificationError(message))
+
+
+def _resolve(future: Future, outcome: Future) -> None:
+    """Give a future the outcome of another, finished future."""
+    if outcome.exception() is not None:
+        future.set_exception(outcome.exception())
+    else:
+        future.set_result(None)
+
+
+def _log_all(logs: list) -> Callable[[str], None]:
+    def log(message: str) -> None:
+        for function in dict.fromkeys(logs):
+            if function:
+                function(message)
+    return log
+
+
+def _send(smtp: smtplib.SMTP, notification: Notification) -> None:
+    """Send a notification, streaming its attachments to the socket after the DATA command."""
+    message = EmailMessage()
+    message["From"] = notification.sender
+    message["To"] = ", ".join(notification.recipients)
+    message["Subject"] = notification.subject
+    message.set_content(notification.text)
+    message.add_alternative(notification.html, subtype="html")
+
+    if not notification.attachments:
+        smtp.send_message(message)
+        return
+
+    boundary = f"=_{uuid.uuid4().hex}"
+    message.make_mixed()
+    message.set_boundary(boundary)
+    head = message.as_bytes(policy=SMTP)
+    head = head[:head.rindex(f"--{boundary}--".encode())]
+
+    smtp.ehlo_or_helo_if_needed()
+    code, response = smtp.mail(notification.sender)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, notification.sender)
+    for recipient in notification.recipients:
+        code, response = smtp.rcpt(recipient)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+    code, response = smtp.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+
+    smtp.sock.sendall(_quote_periods(head))
+    for attachment in notification.attachments:
+        part = MIMEPart()
+        part.set_content(b"", attachment.maintype, attachment.subtype, filename=attachment.filename)
+        smtp.sock.sendall(f"--{boundary}\r\n".encode() + _quote_periods(part.as_bytes(policy=SMTP)))
+        with open(attachment.path, "rb") as file:
+            while chunk := file.read(_ATTACHMENT_CHUNK):
+                # base64 har aldrig et punktum først på linjen, så den skal ikke escapes
+                smtp.sock.sendall(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+    smtp.sock.sendall(f"--{boundary}--\r\n.\r\n".encode())
+
+    code, response = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+
+def _quote_periods(data: bytes) -> bytes:
+    return re.sub(rb"(?m)^\.", b"..", data)
+
+
+_lock = threading.Lock()
+_dispatcher: Dispatcher | None = None
+
+
+def notify(notification: Notification) -> Future:
+    """Queue a notification on the dispatcher, starting it on first use or if it has stopped.
+
+    Returns:
+        Future: The delivery of the notification, see Notification.delivered.
+
+    Raises:
+        NotificationError: If the notification couldn't be queued.
+    """
+    global _dispatcher  # pylint: disable=global-statement
+    with _lock:
+        if _dispatcher is None:
+            atexit.register(shutdown)
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = Dispatcher()
+        dispatcher = _dispatcher
+    return dispatcher.notify(notification)
+
+
+def shutdown() -> None:
+    """Send all queued and held notifications and stop the dispatcher. Called at the end of the run."""
+    global _dispatcher  # pylint: disable=global-statement
+    with _lock:
+        dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.close()
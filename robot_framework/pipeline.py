@@ -0,0 +1,192 @@
+"""This module runs the queue as a staged pipeline where downloads, refreshes and uploads overlap.
+
+The download stage prefetches the next workbooks while Excel refreshes the current ones,
+and the upload stage sends finished workbooks in the background.
+The stages are connected by bounded queues of size config.PIPELINE_QUEUE_SIZE.
+"""
+
+import os
+import shutil
+import queue
+import threading
+from collections import deque
+from collections.abc import Callable
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
+
+from robot_framework import config
+from robot_framework import process
+from robot_framework import scheduler
+from robot_framework.exceptions import BusinessError, handle_error
+
+
+class _Job:
+    """A queue element moving through the pipeline."""
+    def __init__(self, queue_element: QueueElement, work_dir: str):
+        self.queue_element = queue_element
+        self.work_dir = work_dir
+        self.local_file_path: str | None = None
+        self.attempt = 1
+
+
+class Pipeline:
+    """A download -> refresh -> upload pipeline over the OpenOrchestrator queue.
+    A failure in any stage sends the element back to the download stage until
+    config.QUEUE_ATTEMPTS is reached, after which it's marked as failed.
+    The download stage resumes a retried element from its checkpoints, so finished stages aren't repeated.
+    """
+    def __init__(self, orchestrator_connection: OrchestratorConnection, schedule: scheduler.Schedule):
+        self.orchestrator_connection = orchestrator_connection
+        self.schedule = schedule
+        self.error_count = 0
+
+        self._refresh_queue = queue.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+        self._upload_queue = queue.Queue(maxsize=config.PIPELINE_QUEUE_SIZE)
+        self._retries = deque()
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._task_budget = config.MAX_TASK_COUNT
+        self._queue_exhausted = False
+
+    def run(self) -> int:
+        """Run the pipeline until the queue is empty or the task budget is spent.
+
+        Returns:
+            int: The number of queue elements that failed.
+        """
+        downloader = threading.Thread(target=self._download_loop, name="Pipeline-download")
+        refreshers = [
+            threading.Thread(target=self._refresh_loop, name=f"Pipeline-refresh-{i}")
+            for i in range(1, config.MAX_WORKERS + 1)
+        ]
+        uploader = threading.Thread(target=self._upload_loop, name="Pipeline-upload")
+
+        downloader.start()
+        for refresher in refreshers:
+            refresher.start()
+        uploader.start()
+
+        downloader.join()
+        for refresher in refreshers:
+            refresher.join()
+        self._upload_queue.put(None)
+        uploader.join()
+
+        return self.error_count
+
+    def _next_job(self) -> _Job | None:
+        """Get the next job for the download stage.
+        Retries go first, then new queue elements. Returns None when there is nothing left to do.
+        """
+        while True:
+            with self._condition:
+                while True:
+                    if self._retries:
+                        return self._retries.popleft()
+                    if not self._queue_exhausted:
+                        break
+                    if self._in_flight == 0:
+                        return None
+                    self._condition.wait()
+
+            queue_element = None
+            if self._task_budget > 0:
+                self._task_budget -= 1
+                queue_element = self.schedule.next_element()
+
+            with self._condition:
+                if not queue_element:
+                    self.orchestrator_connection.log_info("Queue empty.")
+                    self._queue_exhausted = True
+                    continue
+                self._in_flight += 1
+
+            work_dir = os.path.join(os.getcwd(), config.WORK_FOLDER, f"element_{queue_element.id}")
+            os.makedirs(work_dir, exist_ok=True)
+            return _Job(queue_element, work_dir)
+
+    def _download_loop(self):
+        while (job := self._next_job()) is not None:
+            if self._run_stage(job, self._download):
+                self._refresh_queue.put(job)
+
+        for _ in range(config.MAX_WORKERS):
+            self._refresh_queue.put(None)
+
+    def _refresh_loop(self):
+        while (job := self._refresh_queue.get()) is not None:
+            if self._run_stage(job, self._refresh):
+                self._upload_queue.put(job)
+
+    def _upload_loop(self):
+        while (job := self._upload_queue.get()) is not None:
+            if self._run_stage(job, self._upload):
+                self.orchestrator_connection.set_queue_element_status(job.queue_element.id, QueueStatus.DONE)
+                self._finish(job)
+
+    def _download(self, job: _Job):
+        job.local_file_path = process.download_stage(self.orchestrator_connection, job.queue_element, job.work_dir)
+
+    def _refresh(self, job: _Job):
+        process.refresh_stage(self.orchestrator_connection, job.queue_element, job.local_file_path)
+
+    def _upload(self, job: _Job):
+        process.upload_stage(self.orchestrator_connection, job.queue_element, job.local_file_path)
+
+    def _run_stage(self, job: _Job, stage: Callable[[_Job], None]) -> bool:
+        """Run a stage for a job and handle any error.
+
+        Returns:
+            bool: True if the stage succeeded and the job should move on.
+        """
+        try:
+            stage(job)
+            return True
+
+        except BusinessError as error:
+            process.clean_up_failed_element(job.local_file_path)
+            process.discard_checkpoints(job.queue_element)
+            handle_error("Business Error", error, job.queue_element, self.orchestrator_connection)
+            self._finish(job, failed=True)
+
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            process.clean_up_failed_element(job.local_file_path, job.queue_element)
+            self.orchestrator_connection.log_trace(f"Attempt {job.attempt} failed for queue element {job.queue_element.id}: {error}")
+            if job.attempt < config.QUEUE_ATTEMPTS:
+                self.orchestrator_connection.log_trace("Retrying queue element.")
+                job.attempt += 1
+                job.local_file_path = None
+                with self._condition:
+                    self._retries.append(job)
+                    self._condition.notify_all()
+            else:
+                self.orchestrator_connection.log_trace(f"Queue element failed after {job.attempt} attempts.")
+                process.discard_checkpoints(job.queue_element)
+                handle_error("Process Error", error, job.queue_element, self.orchestrator_connection)
+                self._finish(job, failed=True)
+
+        return False
+
+    def _finish(self, job: _Job, failed: bool = False):
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        self.schedule.finish(job.queue_element, failed)
+        with self._condition:
+            self._in_flight -= 1
+            if failed:
+                self.error_count += 1
+            self._condition.notify_all()
+
+
+def run_pipeline(orchestrator_connection: OrchestratorConnection, schedule: scheduler.Schedule) -> int:
+    """Process the queue as a staged pipeline.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        schedule: The schedule new queue elements are taken from.
+
+    Returns:
+        int: The number of queue elements that failed.
+    """
+    return Pipeline(orchestrator_connection, schedule).run()
@@ -3,231 +3,215 @@
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 from OpenOrchestrator.database.queues import QueueElement
 import os
-import gc
-import win32com.client
-from office365.runtime.auth.user_credential import UserCredential
+from office365.runtime.client_request_exception import ClientRequestException
+from office365.runtime.queries.service_operation import ServiceOperationQuery
 from office365.sharepoint.client_context import ClientContext
 import time
 import json
+from concurrent.futures import Future
 import datetime
 import locale
-from pebble import concurrent
-import subprocess
-import smtplib
-import shutil
-import tempfile
-from email.message import EmailMessage
-
-SHAREPOINT_SMALL_UPLOAD_LIMIT = 4 * 1024 * 1024
-SHAREPOINT_UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
-
-
-def process(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement | None = None) -> None:
-    """Do the primary process of the robot."""
+import requests
+
+from robot_framework import config
+from robot_framework import element_checkpoints
+from robot_framework import excel_pool
+from robot_framework import notifications
+from robot_framework import sharepoint_folders
+from robot_framework import sharepoint_session
+from robot_framework import sharepoint_transfer
+from robot_framework import source_fingerprint
+from robot_framework import telemetry
+from robot_framework import workbook_cache
+from robot_framework import workbook_fingerprint
+from robot_framework import workbook_history
+from robot_framework import workbook_inspector
+from robot_framework import xlsx_parts
+
+
+def process(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement | None = None, work_dir: str | None = None) -> None:
+    """Do the primary process of the robot.
+    The workbook is downloaded into work_dir, or the current working directory if not given.
+    A retried queue element resumes at the first stage it didn't finish, see element_checkpoints.
+    """
     orchestrator_connection.log_trace("Running process.")
-    data = json.loads(queue_element.data)
-     # Assign each field to a named variable
-    sharepoint_site = data.get("SharePointSite")
-    folder_path = data.get("FolderPath")
-    custom_function = data.get("CustomFunction")
-    certification = orchestrator_connection.get_credential("SharePointCert")
-    api = orchestrator_connection.get_credential("SharePointAPI")
-    
-    tenant = api.username
-    client_id = api.password
-    thumbprint = certification.username
-    cert_path = certification.password
-    
-    certification = orchestrator_connection.get_credential("SharePointCert")
-    api = orchestrator_connection.get_credential("SharePointAPI")
-
-    client = sharepoint_client(tenant, client_id, thumbprint, cert_path, sharepoint_site, orchestrator_connection)
 
+    local_file_path = None
     try:
-        # 2. Download the file from SharePoint
-        local_file_path = download_file_from_sharepoint(client, folder_path, orchestrator_connection)
-
-         # Run refresh_excel_file with timeout handling
-        if custom_function == "VeryRefreshed": 
-            future = refresh_excel_file_pivot(local_file_path)
-        else:
-            future = refresh_excel_file(local_file_path)
-
-        try:
-            future.result()  # Wait for the result
-            orchestrator_connection.log_info(f"[Ok] Excel file at {local_file_path} has been refreshed and saved.")
-
-        except Exception as e:
-            if "timeout" in str(e).lower():  # Check if the exception indicates a timeout
-                orchestrator_connection.log_error(f"refresh_excel_file exceeded the timeout of 30 minutes. {e}")
-                raise RuntimeError(f"refresh_excel_file did not complete within the allowed time. {e}")
-            else:
-                orchestrator_connection.log_error(f"An error occurred during refresh_excel_file execution: {e}")
-                raise RuntimeError(f"Error in refresh_excel_file: {e}")
-
-        upload_file_to_sharepoint(client, folder_path, local_file_path, custom_function, orchestrator_connection)
+        local_file_path = download_stage(orchestrator_connection, queue_element, work_dir)
+        refresh_stage(orchestrator_connection, queue_element, local_file_path)
+        upload_stage(orchestrator_connection, queue_element, local_file_path)
     except Exception as e:
-        # Force garbage collection to release COM objects
-        gc.collect()
-        subprocess.call("taskkill /im excel.exe /f >nul 2>&1", shell=True)
-        time.sleep(2)
-        os.remove(local_file_path)
+        clean_up_failed_element(local_file_path, queue_element)
         orchestrator_connection.log_error(str(e))
         raise e
 
-def sharepoint_client(tenant: str, client_id: str, thumbprint: str, cert_path: str, sharepoint_site_url: str, orchestrator_connection: OrchestratorConnection) -> ClientContext:
-    """
-    Creates and returns a SharePoint client context.
-    """
-    # Authenticate to SharePoint
-    cert_credentials = {
-        "tenant": tenant,
-        "client_id": client_id,
-        "thumbprint": thumbprint,
-        "cert_path": cert_path
-    }
-    ctx = ClientContext(sharepoint_site_url).with_client_certificate(**cert_credentials)
-
-    # Load and verify connection
-    web = ctx.web
-    ctx.load(web)
-    ctx.execute_query()
-
-    orchestrator_connection.log_info(f"Authenticated successfully. Site Title: {web.properties['Title']}")
-    return ctx
-
-def download_file_from_sharepoint(client: ClientContext, sharepoint_file_url: str, orchestrator_connection: OrchestratorConnection) -> str:
-    """
-    Downloads a file from SharePoint and returns the local file path.
-    Handles both cases where subfolders exist or only the root folder is used.
-    """
-    # Extract the root folder, folder path, and file name
-    path_parts = sharepoint_file_url.split('/')
-    DOCUMENT_LIBRARY = path_parts[0]  # Root folder name (document library)
-    FOLDER_PATH = '/'.join(path_parts[1:-1]) if len(path_parts) > 2 else ''  # Subfolders inside root, or empty if none
-    file_name = path_parts[-1]  # File name
-
-    # Construct the local folder path inside the Documents folder
-    documents_folder = os.path.join(os.path.expanduser("~"), "Documents", FOLDER_PATH) if FOLDER_PATH else os.path.join(os.path.expanduser("~"), "Documents", DOCUMENT_LIBRARY)
-
-    # Ensure the folder exists
-    if not os.path.exists(documents_folder):
-        os.makedirs(documents_folder)
-
-    # Define the download path inside the folder
-    download_path = os.path.join(os.getcwd(), file_name)
-
-    # Download the file from SharePoint
-    with open(download_path, "wb") as local_file:
-        file = (
-            client.web.get_file_by_server_relative_path(sharepoint_file_url)
-            .download(local_file)
-            .execute_query()
-        )
-    # Define the maximum wait time (60 seconds) and check interval (1 second)
-    wait_time = 60  # 60 seconds
-    elapsed_time = 0
-    check_interval = 1  # Check every 1 second
 
+def read_element_data(queue_element: QueueElement) -> tuple[str, str, str | None]:
+    """Read the SharePoint site, folder path and custom function of a queue element."""
+    data = json.loads(queue_element.data)
+    return data.get("SharePointSite"), data.get("FolderPath"), data.get("CustomFunction")
 
-    # While loop to check if the file exists at `file_path`
-    while not os.path.exists(download_path) and elapsed_time < wait_time:
-        time.sleep(check_interval)  # Wait 1 second
-        elapsed_time += check_interval
 
-    # After the loop, check if the file still doesn't exist and raise an error
-    if not os.path.exists(download_path):
-        raise FileNotFoundError(f"File not found at {download_path} after waiting for {wait_time} seconds.")
+def custom_functions(custom_function: str | None) -> list[str]:
+    """Split the CustomFunction of a queue element, which holds several comma separated functions when elements are merged."""
+    return [name.strip() for name in (custom_function or "").split(",") if name.strip()]
 
-    orchestrator_connection.log_info(f"[Ok] file has been downloaded into: {download_path}")
-    return download_path
 
-@concurrent.process(timeout=3600)  # Timeout after 60 minutes
-def refresh_excel_file_pivot(file_path: str):
+def download_stage(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement, work_dir: str | None = None) -> str:
+    """Download the workbook of a queue element and return the local file path.
+    A workbook kept by the element's checkpoints from an earlier attempt is used instead of downloading it again.
     """
-    Refresh via RefreshAll (håndterer connection-/query-afhængigheder i rigtig
-    rækkefølge), efterfulgt af eksplicit pivot-refresh for at sikre pivottabellen.
+    sharepoint_site, folder_path, _ = read_element_data(queue_element)
+    if local_file_path := element_checkpoints.resume_file(queue_element.id):
+        orchestrator_connection.log_info(f"[Ok] resuming from the checkpointed file: {local_file_path}")
+        return local_file_path
+
+    with telemetry.element(queue_element.id, sharepoint_site, folder_path), telemetry.span("download") as span:
+        started = time.perf_counter()
+        client = sharepoint_session.get_client(orchestrator_connection, sharepoint_site)
+        local_file_path = download_file_from_sharepoint(client, folder_path, orchestrator_connection, work_dir)
+        span["bytes"] = os.path.getsize(local_file_path)
+        workbook_history.record_transfer(sharepoint_site, folder_path, "download", time.perf_counter() - started, span["bytes"])
+        element_checkpoints.mark(queue_element.id, element_checkpoints.DOWNLOADED, local_file_path)
+        return local_file_path
+
+
+def refresh_stage(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement, local_file_path: str) -> None:
+    """Refresh the downloaded workbook of a queue element.
+    The strategy is chosen by workbook_inspector unless the element is VeryRefreshed, which is always refreshed as a pivot workbook.
+    The timeout comes from the workbook's refresh history, see workbook_history.refresh_timeout.
+    A workbook refreshed in an earlier attempt of the element isn't refreshed again.
     """
-    xlapp = win32com.client.DispatchEx("Excel.Application")
-    xlapp.Visible = False
-    xlapp.DisplayAlerts = False
+    sharepoint_site, folder_path, custom_function = read_element_data(queue_element)
+    if element_checkpoints.is_done(queue_element.id, element_checkpoints.REFRESHED):
+        orchestrator_connection.log_info(f"[Ok] Excel file at {local_file_path} was refreshed in an earlier attempt.")
+        return
+
+    pivot = "VeryRefreshed" in custom_functions(custom_function)
+    timeout = workbook_history.refresh_timeout(sharepoint_site, folder_path)
+    # Fingeraftryk fra en tidligere opdatering passer ikke til den fil, der uploades nu
+    source_fingerprint.hold(sharepoint_site, folder_path, {})
 
-    workbook = xlapp.Workbooks.Open(file_path)
     try:
-        # Slå baggrundskørsel fra på alle connections så RefreshAll bliver synkront
-        connections = workbook.Connections
-        for i in range(1, connections.Count + 1):
-            connection = connections.Item(i)
-            try:
-                connection.OLEDBConnection.BackgroundQuery = False
-            except Exception:
-                pass
-            try:
-                connection.ODBCConnection.BackgroundQuery = False
-            except Exception:
-                pass
-
-        # Lad Excel selv opdatere alt i korrekt afhængighedsrækkefølge
-        workbook.RefreshAll()
-        xlapp.CalculateUntilAsyncQueriesDone()
-
-        # Tving pivot-caches og -tabeller bagefter (var den upålidelige del i UiPath)
-        pivot_caches = workbook.PivotCaches()
-        for pc in range(1, pivot_caches.Count + 1):
-            try:
-                pivot_caches.Item(pc).Refresh()
-            except Exception:
-                pass
-
-        for s in range(1, workbook.Worksheets.Count + 1):
-            pivot_tables = workbook.Worksheets.Item(s).PivotTables()
-            for pt in range(1, pivot_tables.Count + 1):
-                pivot_tables.Item(pt).RefreshTable()
-
-        xlapp.CalculateUntilAsyncQueriesDone()
-        workbook.Save()
-        workbook.Close(SaveChanges=True)
-    finally:
-        xlapp.Quit()
-        del workbook
-        del xlapp
-
-@concurrent.process(timeout=3600)  # Timeout after 60 minutes (3600 seconds)
-def refresh_excel_file(file_path: str):
+        with telemetry.element(queue_element.id, sharepoint_site, folder_path):
+            inspection = None
+            if config.WORKBOOK_INSPECTION:
+                try:
+                    with telemetry.span("inspect") as span:
+                        inspection = workbook_inspector.inspect(local_file_path)
+                        span["strategy"] = inspection.strategy
+                except workbook_inspector.InspectionError as e:
+                    orchestrator_connection.log_info(f"{e}. Refreshing it by its custom function.")
+            if inspection:
+                workbook_history.record_inspection(sharepoint_site, folder_path, inspection.strategy, inspection.estimate)
+                orchestrator_connection.log_info(f"Inspected {local_file_path}. {inspection.describe()}")
+                if inspection.strategy == workbook_inspector.SKIP and not pivot:
+                    orchestrator_connection.log_info(f"[Ok] Excel file at {local_file_path} has nothing to refresh and was left as it is.")
+                    element_checkpoints.mark(queue_element.id, element_checkpoints.REFRESHED, local_file_path)
+                    return
+                pivot = pivot or inspection.strategy == workbook_inspector.PLANNED
+
+            fingerprints, unchanged = {}, frozenset()
+            if pivot and config.INCREMENTAL_REFRESH:
+                with telemetry.span("source_probe") as span:
+                    structure = inspection.structure if inspection else xlsx_parts.read_structure(local_file_path)
+                    fingerprints = source_fingerprint.probe(structure)
+                    unchanged = source_fingerprint.unchanged_connections(sharepoint_site, folder_path, fingerprints)
+                    span["unchanged"] = len(unchanged)
+
+            with telemetry.span("refresh", bytes=os.path.getsize(local_file_path), timeout=timeout):
+                started = time.perf_counter()
+                result = excel_pool.get_pool().refresh(local_file_path, pivot, timeout, unchanged)
+                workbook_history.record_refresh(sharepoint_site, folder_path, time.perf_counter() - started)
+
+            # Fejlede noder skal opdateres igen næste gang, så fingeraftryk gemmes kun efter en fejlfri opdatering og upload
+            if fingerprints and result.succeeded:
+                source_fingerprint.hold(sharepoint_site, folder_path, fingerprints)
+        orchestrator_connection.log_info(f"[Ok] Excel file at {local_file_path} has been refreshed and saved. {result.report()}")
+        element_checkpoints.mark(queue_element.id, element_checkpoints.REFRESHED, local_file_path)
+
+    except TimeoutError as e:
+        workbook_history.record_timeout(sharepoint_site, folder_path, timeout)
+        orchestrator_connection.log_error(f"refresh_excel_file exceeded the timeout of {timeout:.0f} seconds. {e}")
+        raise RuntimeError(f"refresh_excel_file did not complete within the allowed time. {e}") from e
+    except excel_pool.ExcelWorkerError as e:
+        orchestrator_connection.log_error(f"An error occurred during refresh_excel_file execution: {e}")
+        raise RuntimeError(f"Error in refresh_excel_file: {e}") from e
+
+
+def upload_stage(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement, local_file_path: str) -> None:
+    """Upload the refreshed workbook of a queue element and run its custom function.
+    The source fingerprints of the refresh are stored and the element's checkpoints cleared once everything is done.
     """
-    Refreshes an Excel file at the specified file path.
+    sharepoint_site, folder_path, custom_function = read_element_data(queue_element)
+    with telemetry.element(queue_element.id, sharepoint_site, folder_path), telemetry.span("upload", bytes=os.path.getsize(local_file_path)) as span:
+        started = time.perf_counter()
+        client = sharepoint_session.get_client(orchestrator_connection, sharepoint_site)
+        try:
+            upload_file_to_sharepoint(client, folder_path, local_file_path, custom_function, orchestrator_connection, queue_element.id)
+        except ClientRequestException:
+            # En mappe kan være slettet siden den blev slået op
+            sharepoint_folders.forget(client)
+            raise
+        workbook_history.record_transfer(sharepoint_site, folder_path, "upload", time.perf_counter() - started, span["bytes"])
+    source_fingerprint.store_held(sharepoint_site, folder_path)
+    element_checkpoints.clear(queue_element.id)
+
+
+def clean_up_failed_element(local_file_path: str | None, queue_element: QueueElement | None = None) -> None:
+    """Remove the local copy of a workbook after a failed stage.
+    A workbook kept by the element's checkpoints stays for the retry, see discard_checkpoints.
+    A hung Excel is killed by the Excel pool, so nothing else needs to be closed here.
     """
+    if queue_element and element_checkpoints.holds(queue_element.id, local_file_path):
+        return
+    if local_file_path and os.path.exists(local_file_path):
+        os.remove(local_file_path)
+    if local_file_path:
+        workbook_fingerprint.forget(local_file_path)
 
-    # Open an Instance of Application
-    xlapp = win32com.client.DispatchEx("Excel.Application")
-
-    # Optional, e.g., if you want to debug
-    xlapp.Visible = False
-
-    # Open File
-    Workbook = xlapp.Workbooks.Open(file_path)
 
-    # Refresh all  
-    Workbook.RefreshAll()
+def discard_checkpoints(queue_element: QueueElement) -> None:
+    """Drop the checkpoints of a queue element that won't be retried, along with the workbook they kept."""
+    element_checkpoints.discard(queue_element.id)
 
-    # Wait until Refresh is complete
-    xlapp.CalculateUntilAsyncQueriesDone()
 
-    # Save File  
-    Workbook.Save()
-    Workbook.Close(SaveChanges=True)
+def download_file_from_sharepoint(client: ClientContext, sharepoint_file_url: str, orchestrator_connection: OrchestratorConnection, work_dir: str | None = None) -> str:
+    """
+    Downloads a file from SharePoint into work_dir and returns the local file path.
+    The download is checked against the file's Length and ETag on SharePoint before it's moved into place,
+    and downloaded again with new metadata if the file changed on SharePoint in the meantime.
+    If the file's ETag matches the local workbook cache the cached copy is used instead,
+    and otherwise the download is stored in the cache under its ETag.
+    """
+    file_name = sharepoint_file_url.split('/')[-1]
+    download_path = os.path.join(work_dir or os.getcwd(), file_name)
 
-    # Quit Instance of Application
-    xlapp.Quit()
+    metadata = sharepoint_transfer.get_file_metadata(client, sharepoint_file_url)
+    if workbook_cache.fetch(client.base_url, sharepoint_file_url, metadata.get("ETag"), download_path):
+        orchestrator_connection.log_info(f"[Ok] unchanged file (ETag {metadata.get('ETag')}) has been copied from the local cache into: {download_path}")
+    else:
+        try:
+            sha256 = sharepoint_transfer.download_file(client, metadata, download_path, orchestrator_connection.log_info)
+        except sharepoint_transfer.DownloadError as e:
+            orchestrator_connection.log_info(f"{e} Downloading it again.")
+            metadata = sharepoint_transfer.get_file_metadata(client, sharepoint_file_url)
+            sha256 = sharepoint_transfer.download_file(client, metadata, download_path, orchestrator_connection.log_info)
+        orchestrator_connection.log_info(f"[Ok] file has been downloaded into: {download_path} ({metadata['Length']} bytes, sha256 {sha256})")
+        # Keep the download too, so a workbook whose upload is skipped as unchanged isn't downloaded again tomorrow
+        workbook_cache.store(client.base_url, sharepoint_file_url, metadata.get("ETag"), download_path)
+
+    # Remember the data of the original so an unchanged refresh can skip the upload
+    workbook_fingerprint.remember(download_path)
+    return download_path
 
-    # Delete Instance of Application
-    del Workbook
-    del xlapp
 
-def upload_file_to_sharepoint(client: ClientContext, sharepoint_file_url: str, local_file_path: str, custom_function, orchestrator_connection: OrchestratorConnection):
+def upload_file_to_sharepoint(client: ClientContext, sharepoint_file_url: str, local_file_path: str, custom_function, orchestrator_connection: OrchestratorConnection, queue_element_id=None):
     """
     Uploads the specified local file back to SharePoint at the given URL.
     Uses the folder path directly to upload files.
+    The upload, archive copy and mail are checkpointed for queue_element_id, so a retry only repeats those that didn't finish.
     """
     # Extract the root folder, folder path, and file name
     path_parts = sharepoint_file_url.split('/')
@@ -241,99 +225,102 @@ def upload_file_to_sharepoint(client: ClientContext, sharepoint_file_url: str, l
     else:
         folder_path = f"{DOCUMENT_LIBRARY}"
 
-    # Get the folder where the file should be uploaded
-    target_folder = client.web.get_folder_by_server_relative_url(folder_path)
-    client.load(target_folder)
-    client.execute_query()
-
-    # Upload the file to the correct folder in SharePoint
-    uploaded_file = _upload_file_to_sharepoint_folder(
-        target_folder,
-        local_file_path,
-        file_name,
-        orchestrator_connection,
+    uploaded = element_checkpoints.is_done(queue_element_id, element_checkpoints.UPLOADED)
+    skip_upload = config.SKIP_UNCHANGED_UPLOADS and workbook_fingerprint.is_unchanged(local_file_path)
+    monthly_folder = "MonthlyFolder" in custom_functions(custom_function) and not element_checkpoints.is_done(queue_element_id, element_checkpoints.ARCHIVED)
+    # Slå de mapper op, som ikke allerede er kendt, i én $batch
+    sharepoint_folders.prefetch(
+        client,
+        folder_paths=[] if skip_upload or uploaded else [folder_path],
+        list_folders=[("Dokumenter", "Historik")] if monthly_folder else [],
     )
 
-    orchestrator_connection.log_info(
-        f"[Ok] file has been uploaded to: {_get_server_relative_url(uploaded_file)} on SharePoint"
-    )
+    if uploaded:
+        orchestrator_connection.log_info(f"[Ok] {file_name} was uploaded in an earlier attempt")
+    elif skip_upload:
+        file_size = os.path.getsize(local_file_path)
+        workbook_fingerprint.record_skipped_upload(file_size)
+        orchestrator_connection.log_info(f"[Ok] refresh of {file_name} produced no data change, skipped uploading {file_size} bytes")
+    else:
+        # Get the folder where the file should be uploaded
+        target_folder = sharepoint_folders.get_folder(client, folder_path)
 
-    if custom_function == "MonthlyFolder":
+        # Upload the file to the correct folder in SharePoint
+        uploaded_file = _upload_file_to_sharepoint_folder(
+            target_folder,
+            local_file_path,
+            file_name,
+            orchestrator_connection,
+        )
+
+        orchestrator_connection.log_info(
+            f"[Ok] file has been uploaded to: {_get_server_relative_url(uploaded_file)} on SharePoint"
+        )
+
+        # Keep the uploaded workbook so tomorrow's run can skip the download if nobody changes it
+        etag = getattr(uploaded_file, "properties", {}).get("ETag") or sharepoint_transfer.get_file_metadata(client, sharepoint_file_url).get("ETag")
+        workbook_cache.store(client.base_url, sharepoint_file_url, etag, local_file_path)
+    element_checkpoints.mark(queue_element_id, element_checkpoints.UPLOADED)
+
+    if monthly_folder:
         orchestrator_connection.log_info(f"Custom function: {custom_function}")
 
-        library = client.web.lists.get_by_title("Dokumenter")
-        client.load(library).execute_query()
+        parent_folder = sharepoint_folders.get_list_folder(client, "Dokumenter", "Historik")
 
-        parent_folder = library.root_folder.folders.get_by_url("Historik")
-        client.load(parent_folder).execute_query()
-    
         locale.setlocale(locale.LC_TIME, "da_DK")
         current_month = datetime.datetime.now().strftime("%B").capitalize()
         current_year = str(datetime.datetime.now().year)
-        year_folder = parent_folder.folders.add(current_year).execute_query()
-        month_folder = year_folder.folders.add(current_month).execute_query()
+        month_folder = sharepoint_folders.ensure_folders(client, parent_folder, [current_year, current_month])
 
         archive_file_name = f'DKPlan_{current_month}_{current_year}.xlsx'
-        uploaded_file_2 = _upload_file_to_sharepoint_folder(
-            month_folder,
-            local_file_path,
-            archive_file_name,
-            orchestrator_connection,
-        )
+        archived_file = _archive_copy(client, sharepoint_file_url, month_folder, archive_file_name, local_file_path, orchestrator_connection)
         orchestrator_connection.log_info(
-            f"[Ok] file has been uploaded to: {_get_server_relative_url(uploaded_file_2)} on SharePoint"
+            f"[Ok] file has been archived to: {archived_file} on SharePoint"
         )
-        
-    if custom_function == "VeryRefreshed":
+        element_checkpoints.mark(queue_element_id, element_checkpoints.ARCHIVED)
+
+    if "VeryRefreshed" in custom_functions(custom_function) and not element_checkpoints.is_done(queue_element_id, element_checkpoints.MAILED):
         orchestrator_connection.log_info(f"Custom function: {custom_function}")
-        send_faktura_mail(local_file_path, file_name, orchestrator_connection)
-    try:            
+        delivered = send_faktura_mail(local_file_path, file_name, orchestrator_connection)
+        # Elementet fejler, hvis mailen ikke kan sendes. En samlet mail sendes først ved kørslens afslutning
+        if not config.NOTIFICATION_DIGEST:
+            delivered.result(timeout=config.NOTIFICATION_TIMEOUT)
+        element_checkpoints.mark(queue_element_id, element_checkpoints.MAILED)
+    try:
         os.remove(local_file_path)
+        workbook_fingerprint.forget(local_file_path)
     except Exception:
         orchestrator_connection.log_error('Failed in removing file')
 
 
+def _archive_copy(client: ClientContext, sharepoint_file_url: str, archive_folder, archive_file_name: str, local_file_path: str, orchestrator_connection: OrchestratorConnection) -> str:
+    """Copy the uploaded workbook into the archive folder on the server.
+    The local file is only uploaded again if the copy fails.
+
+    Returns:
+        str: The server-relative url of the archived file.
+    """
+    try:
+        with telemetry.span("archive_copy", file=archive_file_name):
+            source_file = client.web.get_file_by_server_relative_path(sharepoint_file_url)
+            # CopyTo kaldes direkte, så kilden ikke først skal slås op som i File.copyto
+            params = {"strNewUrl": f"{archive_folder.serverRelativeUrl}/{archive_file_name}", "boverwrite": True}
+            client.add_query(ServiceOperationQuery(source_file, "CopyTo", params)).execute_query()
+        return f"{archive_folder.serverRelativeUrl}/{archive_file_name}"
+    except (ClientRequestException, requests.RequestException) as e:
+        orchestrator_connection.log_info(f"Server-side copy to the archive failed, uploading the file instead. Error: {e}")
+
+    uploaded_file = _upload_file_to_sharepoint_folder(archive_folder, local_file_path, archive_file_name, orchestrator_connection)
+    return _get_server_relative_url(uploaded_file)
+
+
 def _upload_file_to_sharepoint_folder(
     target_folder,
     local_file_path: str,
     file_name: str,
     orchestrator_connection: OrchestratorConnection,
 ):
-    file_size = os.path.getsize(local_file_path)
-
-    if file_size <= SHAREPOINT_SMALL_UPLOAD_LIMIT:
-        try:
-            with open(local_file_path, "rb") as file_content:
-                return target_folder.files.add(
-                    file_name,
-                    file_content.read(),
-                    True,
-                ).execute_query()
-        except Exception as e:
-            orchestrator_connection.log_info(
-                f"Normal upload failed for '{file_name}', switching to chunked upload. Error: {e}"
-            )
-
-    def log_upload_progress(uploaded_bytes):
-        if uploaded_bytes == 0:
-            return
-
-        percent_uploaded = (
-            round(uploaded_bytes / file_size * 100, 2)
-            if file_size
-            else 100
-        )
-        orchestrator_connection.log_info(
-            f"Uploaded {uploaded_bytes} bytes of {file_size} ({percent_uploaded}%) for '{file_name}'"
-        )
-
-    with open(local_file_path, "rb") as file_content:
-        return target_folder.files.create_upload_session(
-            file_content,
-            SHAREPOINT_UPLOAD_CHUNK_SIZE,
-            log_upload_progress,
-            file_name=file_name,
-        ).execute_query()
+    return sharepoint_transfer.upload_file(target_folder, local_file_path, file_name, orchestrator_connection.log_info)
 
 
 def _get_server_relative_url(uploaded_file):
@@ -344,13 +331,15 @@ def _get_server_relative_url(uploaded_file):
         or properties.get("ServerRelativeUrl")
     )
 
-def send_faktura_mail(local_file_path: str, file_name: str, orchestrator_connection: OrchestratorConnection):
-    """Sender det opdaterede regneark som vedhæftning til faktura-modtagerne."""
-    smtp_server = "smtp.adm.aarhuskommune.dk"
-    smtp_port = 25
+
+def send_faktura_mail(local_file_path: str, file_name: str, orchestrator_connection: OrchestratorConnection) -> Future:
+    """Sender det opdaterede regneark som vedhæftning til faktura-modtagerne.
+    Mailen sendes i baggrunden af notifications fra et øjebliksbillede af regnearket,
+    så den lokale fil kan slettes med det samme. Den returnerede future fortæller, om mailen blev sendt.
+    """
     sender = "robotinfo@aarhus.dk"
 
-    recipients = orchestrator_connection.get_constant("EmailExcelRefreshLukkedeBrugere")
+    recipients = orchestrator_connection.get_constant("EmailExcelRefreshLukkedeBrugere").value
     # recipients = orchestrator_connection.get_constant('balas').value
 
     subject = "Genstart af fakturaer ved lukkede brugere"
@@ -364,40 +353,14 @@ def send_faktura_mail(local_file_path: str, file_name: str, orchestrator_connect
     </html>
     """
 
-    # Kopiér til temp så en tilbageværende Excel-lås ikke blokerer vedhæftningen
-    base = os.path.basename(local_file_path)
-    tmp_path = os.path.join(tempfile.gettempdir(), f"mail_{int(time.time() * 1000)}_{base}")
-    delay = 0.3
-    for attempt in range(1, 6):
-        try:
-            shutil.copyfile(local_file_path, tmp_path)
-            break
-        except PermissionError:
-            if attempt == 5:
-                raise
-            time.sleep(delay)
-            delay *= 1.7
-
-    msg = EmailMessage()
-    msg["From"] = sender
-    msg["To"] = recipients
-    msg["Subject"] = subject
-    msg.set_content("Aktiver HTML for at se denne besked.")
-    msg.add_alternative(html_body, subtype="html")
-
-    try:
-        with open(tmp_path, "rb") as f:
-            msg.add_attachment(
-                f.read(),
-                maintype="application",
-                subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                filename=file_name,
-            )
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=30) as smtp:
-            smtp.send_message(msg)
-        orchestrator_connection.log_info(f"[Ok] Faktura-mail sendt til {recipients}")
-    finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+    return notifications.notify(notifications.Notification(
+        sender=sender,
+        to=recipients,
+        subject=subject,
+        html=html_body,
+        text="Aktiver HTML for at se denne besked.",
+        attachments=[notifications.snapshot(local_file_path, file_name, "vnd.openxmlformats-officedocument.spreadsheetml.sheet")],
+        digest_key="faktura",
+        log=orchestrator_connection.log_info,
+        log_error=orchestrator_connection.log_error,
+    ))
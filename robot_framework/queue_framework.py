@@ -4,17 +4,23 @@
 # pylint: disable=duplicate-code
 
 import sys
-import pyodbc
-import json
-from datetime import datetime, timedelta, timezone
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
-from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
 
 from robot_framework import initialize
 from robot_framework import reset
 from robot_framework.exceptions import handle_error, BusinessError, log_exception
 from robot_framework import process
+from robot_framework import pipeline
+from robot_framework import queue_source
+from robot_framework import scheduler
+from robot_framework import sharepoint_transport
+from robot_framework import workbook_fingerprint
+from robot_framework import telemetry
 from robot_framework import config
 
 
@@ -24,98 +30,33 @@ def main():
     sys.excepthook = log_exception(orchestrator_connection)
     orchestrator_connection.log_trace("Robot Framework started.")
     initialize.initialize(orchestrator_connection)
-    sql_server = orchestrator_connection.get_constant("SqlServer")
-    conn_string = "DRIVER={SQL Server};"+f"SERVER={sql_server.value};DATABASE=PYORCHESTRATOR;Trusted_Connection=yes;"
-    # Gets queue from db
-    conn = pyodbc.connect(conn_string)
-
-    # Get the current UTC time and 24-hour threshold
-    current_time = datetime.now(timezone.utc)  # Timezone-aware UTC time
-    time_threshold = current_time - timedelta(hours=20)
-
-    # VeryRefreshed må kun køre om onsdagen.
-    is_wednesday = 1 if datetime.now().weekday() == 2 else 0
-
-    # Step 1: Hent forfaldne rækker – VeryRefreshed dog kun om mandagen
-    query = """
-    SELECT SharePointSite, FolderPath, CustomFunction
-    FROM [PyOrchestrator].[dbo].[QueueExcelRefresher]
-    WHERE (TimeStamp < ? OR TimeStamp IS NULL)
-      AND (COALESCE(CustomFunction, '') <> 'VeryRefreshed' OR ? = 1)
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, time_threshold, is_wednesday)
-
-    rows = cursor.fetchall()
-    if rows:
-        references = tuple(row[1] for row in rows)
-
-        data = tuple(json.dumps({
-            "SharePointSite": row[0],
-            "FolderPath": row[1],
-            "CustomFunction": row[2]
-        }) for row in rows)
-
-        orchestrator_connection.bulk_create_queue_elements("ExcelRefresher", references=references, data=data)
-
-        update_query = """
-        UPDATE [PyOrchestrator].[dbo].[QueueExcelRefresher]
-        SET TimeStamp = ?
-        WHERE (TimeStamp < ? OR TimeStamp IS NULL)
-          AND (COALESCE(CustomFunction, '') <> 'VeryRefreshed' OR ? = 1)
-        """
-        cursor.execute(update_query, (current_time, time_threshold, is_wednesday))
-        conn.commit()
-
-        
-    queue_element = None
+    enqueued = queue_source.enqueue_due_rows(orchestrator_connection)
+    orchestrator_connection.log_info(f"Added {enqueued} due rows to the queue.")
+
+    schedule = scheduler.plan(orchestrator_connection)
+    orchestrator_connection.log_info(schedule.summary(config.MAX_WORKERS, config.MAX_TASK_COUNT))
+
     error_count = 0
-    task_count = 0
     # Retry loop
     for _ in range(config.MAX_RETRY_COUNT):
         try:
             reset.reset(orchestrator_connection)
-
-               # Queue loop
-            while task_count < config.MAX_TASK_COUNT:
-                task_count += 1
-                queue_element = orchestrator_connection.get_next_queue_element(config.QUEUE_NAME)
-
-                if not queue_element:
-                    orchestrator_connection.log_info("Queue empty.")
-                    break  # Break queue loop
-
-                try:
-                    for attempt in range(1, config.QUEUE_ATTEMPTS + 1):
-                        try:
-                            process.process(orchestrator_connection, queue_element)
-                            break
-                        except Exception as e:
-                            orchestrator_connection.log_trace(f"Attempt {attempt} failed for current queue element: {e}")
-                            if attempt < config.QUEUE_ATTEMPTS:
-                                orchestrator_connection.log_trace("Retrying queue element.")
-                                reset.reset(orchestrator_connection)
-                            else:
-                                orchestrator_connection.log_trace(f"Queue element failed after {attempt} attempts.")
-                                raise
-                    orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
-
-                except BusinessError as error:
-                    handle_error("Business Error", error, queue_element, orchestrator_connection)
-
-                except Exception as error:
-                    # Isolér fejl pr. køelement: markér FAILED og fortsæt med resten af køen
-                    error_count += 1
-                    handle_error(f"Process Error #{error_count}", error, queue_element, orchestrator_connection)
-                    reset.reset(orchestrator_connection)
-
+            if config.PIPELINE_ENABLED:
+                error_count += pipeline.run_pipeline(orchestrator_connection, schedule)
+            else:
+                error_count += _run_worker_pool(orchestrator_connection, schedule)
             break  # Break retry loop
 
         # We actually want to catch all exceptions possible here.
         # pylint: disable-next = broad-exception-caught
         except Exception as error:
             error_count += 1
-            handle_error(f"Process Error #{error_count}", error, queue_element, orchestrator_connection)
+            handle_error(f"Process Error #{error_count}", error, None, orchestrator_connection)
+
+    skipped_count, skipped_bytes = workbook_fingerprint.skipped_uploads()
+    orchestrator_connection.log_info(f"Skipped {skipped_count} uploads of unchanged workbooks ({skipped_bytes} bytes).")
+    orchestrator_connection.log_info(sharepoint_transport.summary())
+    orchestrator_connection.log_info(f"Timing metrics written to {telemetry.export_metrics()}")
 
     reset.clean_up(orchestrator_connection)
     reset.close_all(orchestrator_connection)
@@ -124,4 +65,101 @@ def main():
     if config.FAIL_ROBOT_ON_TOO_MANY_ERRORS and error_count >= config.MAX_RETRY_COUNT:
         raise RuntimeError("Process failed too many times.")
 
-main()
+
+def _run_worker_pool(orchestrator_connection: OrchestratorConnection, schedule: scheduler.Schedule) -> int:
+    """Process the queue with config.MAX_WORKERS concurrent workers.
+    The workers share the config.MAX_TASK_COUNT budget between them.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        schedule: The schedule the workers take queue elements from.
+
+    Returns:
+        int: The number of queue elements that failed.
+    """
+    task_budget = threading.Semaphore(config.MAX_TASK_COUNT)
+
+    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS, thread_name_prefix="ExcelRefresher") as executor:
+        futures = [
+            executor.submit(_worker, orchestrator_connection, schedule, worker_id, task_budget)
+            for worker_id in range(1, config.MAX_WORKERS + 1)
+        ]
+        return sum(future.result() for future in futures)
+
+
+def _worker(orchestrator_connection: OrchestratorConnection, schedule: scheduler.Schedule, worker_id: int, task_budget: threading.Semaphore) -> int:
+    """Fetch and process queue elements until the queue is empty or the task budget is spent.
+    Each worker downloads into its own working folder so files with the same name don't collide.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        schedule: The schedule the workers take queue elements from.
+        worker_id: The number of the worker, used to name its working folder.
+        task_budget: Semaphore holding the remaining number of tasks for all workers.
+
+    Returns:
+        int: The number of queue elements that failed in this worker.
+    """
+    work_dir = os.path.join(os.getcwd(), config.WORK_FOLDER, f"worker_{worker_id}")
+    os.makedirs(work_dir, exist_ok=True)
+
+    error_count = 0
+    # Queue loop
+    while task_budget.acquire(blocking=False):
+        queue_element = schedule.next_element()
+
+        if not queue_element:
+            orchestrator_connection.log_info(f"Queue empty. Stopping worker {worker_id}.")
+            break
+
+        succeeded = _process_queue_element(orchestrator_connection, queue_element, work_dir)
+        schedule.finish(queue_element, failed=not succeeded)
+        if not succeeded:
+            error_count += 1
+
+    return error_count
+
+
+def _process_queue_element(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement, work_dir: str) -> bool:
+    """Process a single queue element with up to config.QUEUE_ATTEMPTS attempts
+    and mark it as done or failed in OpenOrchestrator.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        queue_element: The queue element to process.
+        work_dir: The working folder of the worker processing the element.
+
+    Returns:
+        bool: True if the queue element was processed successfully.
+    """
+    try:
+        for attempt in range(1, config.QUEUE_ATTEMPTS + 1):
+            try:
+                process.process(orchestrator_connection, queue_element, work_dir)
+                break
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                orchestrator_connection.log_trace(f"Attempt {attempt} failed for queue element {queue_element.id}: {e}")
+                if attempt < config.QUEUE_ATTEMPTS:
+                    orchestrator_connection.log_trace("Retrying queue element.")
+                    # Resetting shuts down the Excel pool the other workers are refreshing in
+                    if config.MAX_WORKERS == 1:
+                        reset.reset(orchestrator_connection)
+                else:
+                    orchestrator_connection.log_trace(f"Queue element failed after {attempt} attempts.")
+                    raise
+        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
+        return True
+
+    except BusinessError as error:
+        handle_error("Business Error", error, queue_element, orchestrator_connection)
+        return False
+
+    # Isolér fejl pr. køelement: markér FAILED og fortsæt med resten af køen
+    # pylint: disable-next = broad-exception-caught
+    except Exception as error:
+        handle_error("Process Error", error, queue_element, orchestrator_connection)
+        return False
+
+    finally:
+        # Et færdigt element har ryddet sine checkpoints, og et fejlet prøves ikke igen, så dets arbejdsfil fjernes
+        process.discard_checkpoints(queue_element)
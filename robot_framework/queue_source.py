@@ -0,0 +1,145 @@
+"""This module claims the rows of QueueExcelRefresher that are due for a refresh and adds them to the queue.
+
+A row is claimed by setting its TimeStamp in the same statement that returns it (UPDATE ... OUTPUT),
+so a row that becomes due during the run is either claimed and queued or left for the next run.
+Robots starting at the same time never claim the same row, since READPAST skips rows another robot
+is claiming. Rows are claimed in batches of config.CLAIM_BATCH_SIZE, each in a transaction that is
+only committed once the batch is in the OpenOrchestrator queue, so a failed enqueue leaves the rows due.
+Small batches also keep SQL Server from escalating the row locks to a lock on the whole table.
+
+The connection to the database is kept open and reused between claims. Tests and the benchmark
+can hand out sqlite3 connections instead, which use the equivalent UPDATE ... RETURNING.
+
+The reference of a queue element is qualified by its site (see reference), as the same FolderPath
+can exist on several sites and the scheduler claims elements by their reference.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pyodbc
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework import workbook_history
+
+# The longest reference OpenOrchestrator can store
+_REFERENCE_LENGTH = 100
+# Hex digits of the workbook's hash at the start of its reference
+_REFERENCE_HASH_LENGTH = 12
+
+_CLAIM_QUERY = """
+SET NOCOUNT ON;
+UPDATE TOP (?) [PyOrchestrator].[dbo].[QueueExcelRefresher] WITH (ROWLOCK, READPAST)
+SET TimeStamp = ?
+OUTPUT inserted.SharePointSite, inserted.FolderPath, inserted.CustomFunction
+WHERE (TimeStamp < ? OR TimeStamp IS NULL)
+  AND (COALESCE(CustomFunction, '') <> 'VeryRefreshed' OR ? = 1)
+"""
+
+_CLAIM_QUERY_SQLITE = """
+UPDATE QueueExcelRefresher
+SET TimeStamp = ?
+WHERE rowid IN (
+    SELECT rowid FROM QueueExcelRefresher
+    WHERE (TimeStamp < ? OR TimeStamp IS NULL)
+      AND (COALESCE(CustomFunction, '') <> 'VeryRefreshed' OR ? = 1)
+    LIMIT ?
+)
+RETURNING SharePointSite, FolderPath, CustomFunction
+"""
+
+_lock = threading.Lock()
+_connection = None
+
+
+def enqueue_due_rows(orchestrator_connection: OrchestratorConnection) -> int:
+    """Claim the due rows of QueueExcelRefresher and add them to the queue.
+    A row is due when its TimeStamp is older than config.CLAIM_INTERVAL_HOURS or null.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+
+    Returns:
+        int: The number of rows added to the queue.
+    """
+    current_time = datetime.now(timezone.utc)
+    time_threshold = current_time - timedelta(hours=config.CLAIM_INTERVAL_HOURS)
+    # VeryRefreshed må kun køre om onsdagen.
+    is_wednesday = 1 if datetime.now().weekday() == 2 else 0
+
+    with _lock:
+        connection = _get_connection(orchestrator_connection)
+        claimed = 0
+        try:
+            while True:
+                rows = _claim_batch(connection, current_time, time_threshold, is_wednesday)
+                if rows:
+                    orchestrator_connection.bulk_create_queue_elements(
+                        config.QUEUE_NAME,
+                        references=tuple(reference(row[0], row[1]) for row in rows),
+                        data=tuple(json.dumps({
+                            "SharePointSite": row[0],
+                            "FolderPath": row[1],
+                            "CustomFunction": row[2]
+                        }) for row in rows),
+                    )
+                connection.commit()
+                claimed += len(rows)
+                if len(rows) < config.CLAIM_BATCH_SIZE:
+                    return claimed
+        except Exception:
+            _discard_connection()
+            raise
+
+
+def reference(sharepoint_site: str, folder_path: str) -> str:
+    """Get the queue reference of a workbook: a hash of its site and path followed by its FolderPath.
+    The hash tells workbooks with the same path on different sites apart, and the path keeps the reference readable.
+    """
+    digest = hashlib.sha256(workbook_history.key(sharepoint_site, folder_path).encode("utf-8")).hexdigest()
+    return f"{digest[:_REFERENCE_HASH_LENGTH]}:{folder_path}"[:_REFERENCE_LENGTH]
+
+
+def _claim_batch(connection, current_time: datetime, time_threshold: datetime, is_wednesday: int) -> list[tuple]:
+    """Set the TimeStamp of up to config.CLAIM_BATCH_SIZE due rows and return them, without committing."""
+    cursor = connection.cursor()
+    if isinstance(connection, sqlite3.Connection):
+        cursor.execute(_CLAIM_QUERY_SQLITE, (current_time.isoformat(sep=" "), time_threshold.isoformat(sep=" "), is_wednesday, config.CLAIM_BATCH_SIZE))
+    else:
+        cursor.execute(_CLAIM_QUERY, (config.CLAIM_BATCH_SIZE, current_time, time_threshold, is_wednesday))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def _get_connection(orchestrator_connection: OrchestratorConnection):
+    """Get the open database connection, connecting on first use."""
+    global _connection  # pylint: disable=global-statement
+    if _connection is None:
+        sql_server = orchestrator_connection.get_constant("SqlServer")
+        conn_string = "DRIVER={SQL Server};"+f"SERVER={sql_server.value};DATABASE=PYORCHESTRATOR;Trusted_Connection=yes;"
+        _connection = pyodbc.connect(conn_string)
+    return _connection
+
+
+def _discard_connection() -> None:
+    """Roll back and close the connection, so the next claim reconnects."""
+    global _connection  # pylint: disable=global-statement
+    if _connection is None:
+        return
+    try:
+        _connection.rollback()
+        _connection.close()
+    # Forbindelsen kan allerede være død
+    # pylint: disable-next = broad-exception-caught
+    except Exception:
+        pass
+    _connection = None
+
+
+def close_connection() -> None:
+    """Close the database connection if it's open."""
+    with _lock:
+        _discard_connection()
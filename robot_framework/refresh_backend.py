@@ -0,0 +1,657 @@
+"""This module contains the backends used by the Excel worker pool to refresh workbooks.
+
+A backend keeps one application alive between workbooks and exposes the steps of a refresh:
+open, list the refreshable nodes, refresh, save and close. The COM backend drives Excel in production.
+The simulated backend rewrites the xlsx parts itself and injects latency and failures drawn from
+the distributions in config, so scheduling, pooling and timeouts can be measured on machines without Excel.
+"""
+
+import math
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Protocol
+
+from robot_framework import config
+from robot_framework import refresh_planner
+from robot_framework import refresh_verifier
+from robot_framework import telemetry
+from robot_framework import xlsx_parts
+from robot_framework.refresh_planner import RefreshNode, CONNECTION, QUERY_TABLE, PIVOT_CACHE, PIVOT_TABLE
+
+# Excel constants (XlConnectionType, XlListObjectSourceType and XlPivotTableSourceType)
+XL_CONNECTION_OLEDB = 1
+XL_CONNECTION_ODBC = 2
+XL_CONNECTION_MODEL = 7
+XL_SOURCE_QUERY = 3
+XL_PIVOT_DATABASE = 1
+XL_PIVOT_EXTERNAL = 2
+
+
+class RefreshBackend(Protocol):
+    """The interface between an Excel worker and the application doing the refresh.
+    Only one workbook is open at a time.
+    """
+
+    pid: int | None
+
+    def start(self) -> None:
+        """Start the application."""
+
+    def open(self, file_path: str) -> None:
+        """Open a workbook."""
+
+    def list_nodes(self) -> list[RefreshNode]:
+        """List the connections, query tables, pivot caches and pivot tables of the open workbook."""
+
+    def refresh(self, node: RefreshNode, background: bool) -> None:
+        """Refresh a node. If background is True the refresh may continue until wait is called."""
+
+    def refresh_all(self, pivot: bool) -> None:
+        """Refresh everything in the open workbook and wait for it to finish.
+        If pivot is True pivot caches and tables are refreshed explicitly afterwards.
+        """
+
+    def wait(self) -> None:
+        """Wait for all background refreshes to finish."""
+
+    def save(self) -> None:
+        """Save the open workbook."""
+
+    def close(self) -> None:
+        """Close the open workbook without saving."""
+
+    def is_healthy(self) -> bool:
+        """Check that the application is responsive and has no workbooks left open."""
+
+    def memory_usage(self) -> int:
+        """Get the memory used by the application in bytes."""
+
+    def stop(self) -> None:
+        """Close the application."""
+
+
+class RefreshVerificationError(Exception):
+    """Raised when a workbook still fails verification after its failed nodes were refreshed again."""
+
+
+@dataclass
+class RefreshResult:
+    """What a refresh did.
+
+    Attributes:
+        summary: A summary of what was refreshed.
+        failures: A description of every node that failed, keyed on the node's key.
+        not_refreshed: Keys of nodes that were deliberately not refreshed.
+        repaired: Keys of nodes that failed at first and passed after being refreshed again.
+        verified: Whether the saved workbook was checked by refresh_verifier.
+    """
+    summary: str
+    failures: dict[str, str] = field(default_factory=dict)
+    not_refreshed: frozenset[str] = frozenset()
+    repaired: list[str] = field(default_factory=list)
+    verified: bool = False
+
+    @property
+    def succeeded(self) -> bool:
+        """Whether every node was refreshed without failing."""
+        return not self.failures
+
+    def report(self) -> str:
+        """Describe the refresh in a single line for the log."""
+        report = self.summary
+        if self.repaired:
+            report += f" Refreshed again: {', '.join(self.repaired)}."
+        if self.failures:
+            report += " Failed: " + "; ".join(self.failures.values())
+        elif self.verified:
+            report += " Verified."
+        return report
+
+
+def refresh_workbook(backend: RefreshBackend, file_path: str, pivot: bool, unchanged: frozenset[str] = frozenset()) -> RefreshResult:
+    """Open, refresh, save and close a workbook.
+    Pivot workbooks are refreshed through a refresh_planner plan, other workbooks with refresh_all.
+    With config.REFRESH_VERIFICATION the saved workbook is checked by refresh_verifier, and the nodes
+    that failed are refreshed again and saved before the workbook is closed.
+
+    Args:
+        backend: The backend to refresh with.
+        file_path: The path of the workbook.
+        pivot: Whether pivot caches and tables should be refreshed explicitly.
+        unchanged: Keys of connections of a pivot workbook whose source data hasn't changed, see source_fingerprint.
+
+    Returns:
+        RefreshResult: What was refreshed and the nodes that failed.
+
+    Raises:
+        RefreshVerificationError: If the workbook still fails verification and config.FAIL_UNVERIFIED_REFRESH is set.
+    """
+    before = xlsx_parts.read_structure(file_path) if config.REFRESH_VERIFICATION else None
+    with telemetry.span("excel_open", bytes=os.path.getsize(file_path)):
+        backend.open(file_path)
+    try:
+        started = datetime.now()
+        if pivot:
+            result = _refresh_planned(backend, unchanged)
+        else:
+            with telemetry.span("refresh_all"):
+                backend.refresh_all(pivot=False)
+            result = RefreshResult("RefreshAll")
+        _save(backend, file_path)
+
+        if before is not None:
+            _verify_and_repair(backend, file_path, before, started, result)
+            if result.failures and config.FAIL_UNVERIFIED_REFRESH:
+                raise RefreshVerificationError(f"{file_path} failed verification. {result.report()}")
+        return result
+    finally:
+        backend.close()
+
+
+def _save(backend: RefreshBackend, file_path: str) -> None:
+    with telemetry.span("excel_save") as span:
+        backend.save()
+        span["bytes"] = os.path.getsize(file_path)
+
+
+def _refresh_planned(backend: RefreshBackend, unchanged: frozenset[str]) -> RefreshResult:
+    """Refresh every connection and pivot cache of a workbook exactly once in dependency order.
+    Falls back to refresh_all if the dependencies can't be read or ordered.
+
+    Returns:
+        RefreshResult: A summary of the plan, the nodes that failed to refresh and the nodes skipped as unchanged.
+    """
+    try:
+        plan = refresh_planner.build_plan(backend.list_nodes(), unchanged)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        with telemetry.span("refresh_all"):
+            backend.refresh_all(pivot=True)
+        return RefreshResult(f"Refresh planning failed, used RefreshAll instead: {e}")
+
+    failures = _refresh_stages(backend, plan.stages)
+    return RefreshResult(plan.summary(), failures, plan.not_refreshed)
+
+
+def _refresh_stages(backend: RefreshBackend, stages: list[list[RefreshNode]]) -> dict[str, str]:
+    """Refresh the stages of a plan in order.
+
+    Returns:
+        dict[str, str]: A description of the error of every node that failed, keyed on the node's key.
+    """
+    failures = {}
+    for stage in stages:
+        background_nodes = []
+        for node in stage:
+            background = node.background and config.REFRESH_CONNECTIONS_IN_BACKGROUND
+            try:
+                # A background refresh only times starting the refresh, the rest is in the stage's excel_wait
+                with telemetry.span(f"refresh_{node.kind.replace(' ', '_')}", node=node.name, background=background):
+                    backend.refresh(node, background)
+                if background:
+                    background_nodes.append(node)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                failures[node.key] = f"{node.kind} '{node.name}': {e}"
+        # Background connections of the stage run concurrently until here
+        try:
+            with telemetry.span("excel_wait"):
+                backend.wait()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The error doesn't tell which background refresh failed, so every one of them is suspect
+            for node in background_nodes or [None]:
+                failures[node.key if node else "background"] = f"background refresh{f' of {node.kind} {node.name!r}' if node else ''}: {e}"
+    return failures
+
+
+def _verify_and_repair(backend: RefreshBackend, file_path: str, before: xlsx_parts.WorkbookStructure, started: datetime, result: RefreshResult) -> None:
+    """Verify the saved workbook and refresh the failed nodes again until it passes
+    or config.REFRESH_REPAIR_ATTEMPTS is used up. The outcome is kept in result.
+    """
+    failed_once = []
+    for attempt in range(config.REFRESH_REPAIR_ATTEMPTS + 1):
+        with telemetry.span("verify", attempt=attempt) as span:
+            findings = refresh_verifier.verify(file_path, before, started, result.not_refreshed)
+            span["findings"] = len(findings)
+        for finding in findings:
+            result.failures.setdefault(finding.key, f"{finding.key} failed verification: {finding.reason}")
+        failed_once += [key for key in result.failures if key not in failed_once]
+
+        if not result.failures or attempt == config.REFRESH_REPAIR_ATTEMPTS:
+            break
+        with telemetry.span("refresh_repair", nodes=len(result.failures)):
+            result.failures = _refresh_again(backend, result.failures)
+        _save(backend, file_path)
+
+    result.verified = True
+    result.repaired = [key for key in failed_once if key not in result.failures]
+
+
+def _refresh_again(backend: RefreshBackend, failures: dict[str, str]) -> dict[str, str]:
+    """Refresh the failed nodes again together with the nodes they read from, in dependency order.
+
+    Returns:
+        dict[str, str]: The nodes that failed again.
+    """
+    try:
+        nodes = {node.key: node for node in backend.list_nodes()}
+        selected = set()
+        pending = [key for key in failures if key in nodes]
+        while pending:
+            key = pending.pop()
+            if key not in selected:
+                selected.add(key)
+                pending += [dependency for dependency in nodes[key].depends_on if dependency in nodes]
+        plan = refresh_planner.build_plan([node for key, node in nodes.items() if key in selected])
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return {key: f"{description} (not refreshed again: {e})" for key, description in failures.items()}
+    return _refresh_stages(backend, plan.stages)
+
+
+class ComRefreshBackend:
+    """Refreshes workbooks in a hidden Excel instance through COM."""
+
+    def __init__(self):
+        self.pid = None
+        self._xlapp = None
+        self._workbook = None
+
+    def start(self) -> None:
+        """Start a hidden Excel instance without alerts and remember its process id."""
+        # Imported here so the module can be used on machines without pywin32
+        import win32com.client  # pylint: disable=import-outside-toplevel
+        import win32process  # pylint: disable=import-outside-toplevel
+
+        self._xlapp = win32com.client.DispatchEx("Excel.Application")
+        self._xlapp.Visible = False
+        self._xlapp.DisplayAlerts = False
+        _, self.pid = win32process.GetWindowThreadProcessId(self._xlapp.Hwnd)
+
+    def open(self, file_path: str) -> None:
+        """Open a workbook in Excel."""
+        self._workbook = self._xlapp.Workbooks.Open(file_path)
+
+    def list_nodes(self) -> list[RefreshNode]:
+        """List the refresh nodes of the open workbook through COM."""
+        return _collect_refresh_nodes(self._workbook)
+
+    def refresh(self, node: RefreshNode, background: bool) -> None:
+        """Refresh a node. Connections are set to refresh in the background or not first."""
+        if node.kind == CONNECTION:
+            _set_background_query(node.handle, background)
+        node.handle.Refresh()
+
+    def refresh_all(self, pivot: bool) -> None:
+        """Refresh everything with RefreshAll, or the pivot workbook way if pivot is True."""
+        if pivot:
+            _refresh_pivot_workbook(self._xlapp, self._workbook)
+        else:
+            self._workbook.RefreshAll()
+            # Wait until Refresh is complete
+            self._xlapp.CalculateUntilAsyncQueriesDone()
+
+    def wait(self) -> None:
+        """Wait until Excel has finished all asynchronous queries."""
+        self._xlapp.CalculateUntilAsyncQueriesDone()
+
+    def save(self) -> None:
+        """Save the open workbook."""
+        self._workbook.Save()
+
+    def close(self) -> None:
+        """Close the open workbook without saving, if any."""
+        if self._workbook is not None:
+            self._workbook.Close(SaveChanges=False)
+            self._workbook = None
+
+    def is_healthy(self) -> bool:
+        """Check that Excel answers, is ready and has no workbooks open."""
+        try:
+            return self._xlapp.Workbooks.Count == 0 and bool(self._xlapp.Ready)
+        except Exception:  # pylint: disable=broad-exception-caught
+            return False
+
+    def memory_usage(self) -> int:
+        """Get the working set of the Excel process in bytes."""
+        import win32api  # pylint: disable=import-outside-toplevel
+        import win32con  # pylint: disable=import-outside-toplevel
+        import win32process  # pylint: disable=import-outside-toplevel
+
+        handle = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, self.pid)
+        try:
+            return win32process.GetProcessMemoryInfo(handle)["WorkingSetSize"]
+        finally:
+            win32api.CloseHandle(handle)
+
+    def stop(self) -> None:
+        """Quit Excel."""
+        try:
+            self._xlapp.Quit()
+        finally:
+            self._xlapp = None
+
+
+def _collect_refresh_nodes(workbook) -> list[RefreshNode]:
+    """Read the connections, query tables, pivot caches and pivot tables of a workbook as refresh nodes."""
+    nodes = []
+
+    connections = workbook.Connections
+    model_sources = []
+    for i in range(1, connections.Count + 1):
+        connection = connections.Item(i)
+        key = f"connection:{connection.Name}"
+        if connection.Type == XL_CONNECTION_MODEL:
+            nodes.append(RefreshNode(key, CONNECTION, connection.Name, depends_on=model_sources, handle=connection))
+            continue
+        if getattr(connection, "InModel", False):
+            model_sources.append(key)
+        background = connection.Type in (XL_CONNECTION_OLEDB, XL_CONNECTION_ODBC)
+        nodes.append(RefreshNode(key, CONNECTION, connection.Name, background=background, handle=connection))
+
+    # Query tables, keyed on their sheet and name so pivot caches on their ranges can depend on them
+    query_tables = {}
+    for s in range(1, workbook.Worksheets.Count + 1):
+        worksheet = workbook.Worksheets.Item(s)
+        list_objects = worksheet.ListObjects
+        for lo in range(1, list_objects.Count + 1):
+            list_object = list_objects.Item(lo)
+            if list_object.SourceType != XL_SOURCE_QUERY:
+                continue
+            connection_key = f"connection:{list_object.QueryTable.WorkbookConnection.Name}"
+            key = f"query table:{worksheet.Name}!{list_object.Name}"
+            query_tables[key] = (worksheet.Name, list_object.Name)
+            nodes.append(RefreshNode(key, QUERY_TABLE, list_object.Name, depends_on=[connection_key], covered_by=connection_key, handle=list_object.QueryTable))
+
+        pivot_tables = worksheet.PivotTables()
+        for pt in range(1, pivot_tables.Count + 1):
+            pivot_table = pivot_tables.Item(pt)
+            cache_key = f"pivot cache:{pivot_table.CacheIndex}"
+            nodes.append(RefreshNode(f"pivot table:{worksheet.Name}!{pivot_table.Name}", PIVOT_TABLE, pivot_table.Name, depends_on=[cache_key], covered_by=cache_key, handle=pivot_table))
+
+    pivot_caches = workbook.PivotCaches()
+    for pc in range(1, pivot_caches.Count + 1):
+        pivot_cache = pivot_caches.Item(pc)
+        key = f"pivot cache:{pivot_cache.Index}"
+        name = f"#{pivot_cache.Index}"
+        if pivot_cache.SourceType == XL_PIVOT_EXTERNAL:
+            connection_key = f"connection:{pivot_cache.WorkbookConnection.Name}"
+            nodes.append(RefreshNode(key, PIVOT_CACHE, name, depends_on=[connection_key], covered_by=connection_key, handle=pivot_cache))
+        elif pivot_cache.SourceType == XL_PIVOT_DATABASE:
+            source = str(pivot_cache.SourceData)
+            depends_on = [
+                query_key for query_key, (sheet_name, table_name) in query_tables.items()
+                if table_name in source or sheet_name in source
+            ]
+            nodes.append(RefreshNode(key, PIVOT_CACHE, name, depends_on=depends_on, handle=pivot_cache))
+        else:
+            nodes.append(RefreshNode(key, PIVOT_CACHE, name, handle=pivot_cache))
+
+    return nodes
+
+
+def _set_background_query(connection, background: bool) -> None:
+    """Set whether an OLEDB or ODBC connection refreshes in the background."""
+    if connection.Type == XL_CONNECTION_OLEDB:
+        connection.OLEDBConnection.BackgroundQuery = background
+    elif connection.Type == XL_CONNECTION_ODBC:
+        connection.ODBCConnection.BackgroundQuery = background
+
+
+def _refresh_pivot_workbook(xlapp, workbook) -> None:
+    """
+    Refresh via RefreshAll (håndterer connection-/query-afhængigheder i rigtig
+    rækkefølge), efterfulgt af eksplicit pivot-refresh for at sikre pivottabellen.
+    """
+    # Slå baggrundskørsel fra på alle connections så RefreshAll bliver synkront
+    connections = workbook.Connections
+    for i in range(1, connections.Count + 1):
+        connection = connections.Item(i)
+        try:
+            connection.OLEDBConnection.BackgroundQuery = False
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+        try:
+            connection.ODBCConnection.BackgroundQuery = False
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+
+    # Lad Excel selv opdatere alt i korrekt afhængighedsrækkefølge
+    workbook.RefreshAll()
+    xlapp.CalculateUntilAsyncQueriesDone()
+
+    # Tving pivot-caches og -tabeller bagefter (var den upålidelige del i UiPath)
+    pivot_caches = workbook.PivotCaches()
+    for pc in range(1, pivot_caches.Count + 1):
+        try:
+            pivot_caches.Item(pc).Refresh()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # En fejlet pivot-cache beholder sin gamle refreshedDate og fanges af refresh_verifier
+            pass
+
+    for s in range(1, workbook.Worksheets.Count + 1):
+        pivot_tables = workbook.Worksheets.Item(s).PivotTables()
+        for pt in range(1, pivot_tables.Count + 1):
+            pivot_tables.Item(pt).RefreshTable()
+
+    xlapp.CalculateUntilAsyncQueriesDone()
+
+
+class SimulatedRefreshBackend:
+    """Simulates Excel by reading and rewriting the xlsx parts of the workbook.
+
+    Every step sleeps for a duration drawn from a log-normal distribution with the median in
+    config.SIMULATED_LATENCY and spread config.SIMULATED_LATENCY_SIGMA. Opening and saving also
+    take config.SIMULATED_SECONDS_PER_MB per megabyte. Node refreshes fail with probability
+    config.SIMULATED_FAILURE_RATE, and a workbook hangs with probability config.SIMULATED_HANG_RATE.
+    Saving stamps the pivot caches and core properties like Excel would and, with probability
+    config.SIMULATED_DATA_CHANGE_RATE, changes the worksheet data. Pivot caches whose refresh failed,
+    directly or through their connection, keep their old refreshedDate.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self._memory = 0
+        self._running = False
+        self._file_path = None
+        self._structure = None
+        self._background = []
+        self._background_errors = []
+        # The part and covering connection of every pivot cache node, and the parts whose refresh failed
+        self._pivot_caches: dict[str, tuple[str, str | None]] = {}
+        self._stale_parts: set[str] = set()
+
+    def start(self) -> None:
+        """Start the simulated application."""
+        self._memory = config.SIMULATED_BASE_MEMORY
+        self._running = True
+
+    def open(self, file_path: str) -> None:
+        """Read the structure of a workbook. Hangs forever with probability config.SIMULATED_HANG_RATE."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        self._sleep("open", os.path.getsize(file_path))
+        self._file_path = file_path
+        self._structure = xlsx_parts.read_structure(file_path)
+        parts = {pivot_cache.key: pivot_cache.part for pivot_cache in self._structure.pivot_caches}
+        self._pivot_caches = {node.key: (parts[node.key], node.covered_by) for node in structure_nodes(self._structure) if node.kind == PIVOT_CACHE}
+        self._stale_parts = set()
+        self._memory += config.SIMULATED_MEMORY_PER_WORKBOOK
+        if random.random() < config.SIMULATED_HANG_RATE:
+            # Like a modal dialog nobody will ever close
+            while True:
+                time.sleep(60)
+
+    def list_nodes(self) -> list[RefreshNode]:
+        """List the refresh nodes read from the xlsx parts of the open workbook."""
+        return structure_nodes(self._structure)
+
+    def refresh(self, node: RefreshNode, background: bool) -> None:
+        """Refresh a node, on a thread of its own if background is True."""
+        if background:
+            thread = threading.Thread(target=self._refresh_in_background, args=(node,), daemon=True)
+            thread.start()
+            self._background.append(thread)
+        else:
+            self._refresh_node(node)
+
+    def _refresh_node(self, node: RefreshNode) -> None:
+        self._sleep(node.kind)
+        refreshed_parts = {part for key, (part, covered_by) in self._pivot_caches.items() if node.key in (key, covered_by)}
+        if random.random() < config.SIMULATED_FAILURE_RATE:
+            self._stale_parts |= refreshed_parts
+            raise RuntimeError(f"Simulated failure refreshing {node.kind} '{node.name}'")
+        self._stale_parts -= refreshed_parts
+
+    def _refresh_in_background(self, node: RefreshNode) -> None:
+        try:
+            self._refresh_node(node)
+        except RuntimeError as e:
+            self._background_errors.append(e)
+
+    def refresh_all(self, pivot: bool) -> None:
+        """Refresh the connections and pivot caches like RefreshAll.
+        If pivot is True the pivot tables are refreshed explicitly afterwards.
+        """
+        for node in structure_nodes(self._structure):
+            if node.kind == CONNECTION:
+                self._refresh_node(node)
+            elif node.kind == PIVOT_CACHE:
+                # Like the pivot refresh through COM, a failed pivot cache is only left stale
+                try:
+                    self._refresh_node(node)
+                except RuntimeError:
+                    pass
+        if pivot:
+            for node in structure_nodes(self._structure):
+                if node.kind == PIVOT_TABLE:
+                    self._sleep(node.kind)
+
+    def wait(self) -> None:
+        """Wait for the background refreshes and raise their errors."""
+        for thread in self._background:
+            thread.join()
+        self._background = []
+        errors, self._background_errors = self._background_errors, []
+        if errors:
+            raise RuntimeError("; ".join(str(e) for e in errors))
+
+    def save(self) -> None:
+        """Rewrite the xlsx parts of the open workbook like Excel would when saving."""
+        self._sleep("save", os.path.getsize(self._file_path))
+        _rewrite_parts(self._file_path, random.random() < config.SIMULATED_DATA_CHANGE_RATE, frozenset(self._stale_parts))
+
+    def close(self) -> None:
+        """Forget the open workbook once its background refreshes have finished."""
+        for thread in self._background:
+            thread.join()
+        self._background = []
+        self._background_errors = []
+        self._file_path = None
+        self._structure = None
+
+    def is_healthy(self) -> bool:
+        """Check that the application is running with no workbook open."""
+        return self._running and self._file_path is None
+
+    def memory_usage(self) -> int:
+        """Get the simulated memory usage in bytes."""
+        return self._memory
+
+    def stop(self) -> None:
+        """Stop the simulated application."""
+        self._running = False
+
+    @staticmethod
+    def _sleep(step: str, size: int = 0) -> None:
+        median = config.SIMULATED_LATENCY.get(step, 0)
+        duration = random.lognormvariate(math.log(median), config.SIMULATED_LATENCY_SIGMA) if median > 0 else 0
+        duration += size / 1024 / 1024 * config.SIMULATED_SECONDS_PER_MB
+        time.sleep(duration)
+
+
+def structure_nodes(structure: xlsx_parts.WorkbookStructure) -> list[RefreshNode]:
+    """Describe the structure read from the xlsx parts as refresh nodes.
+    The keys follow the same pattern as the nodes read through COM.
+    """
+    nodes = []
+    model_sources = [c.key for c in structure.connections if c.in_model]
+    for connection in structure.connections:
+        if connection.is_model:
+            nodes.append(RefreshNode(connection.key, CONNECTION, connection.name, depends_on=model_sources))
+        else:
+            nodes.append(RefreshNode(connection.key, CONNECTION, connection.name, background=connection.type in ("OLEDB", "ODBC")))
+
+    for query_table in structure.query_tables:
+        connection_key = f"connection:{structure.connection_name(query_table.connection_id)}"
+        nodes.append(RefreshNode(query_table.key, QUERY_TABLE, query_table.table_name or query_table.name, depends_on=[connection_key], covered_by=connection_key))
+
+    cache_keys = {}
+    for pivot_cache in structure.pivot_caches:
+        cache_keys[pivot_cache.part] = pivot_cache.key
+        name = os.path.basename(pivot_cache.part)
+        if pivot_cache.connection_id:
+            connection_key = f"connection:{structure.connection_name(pivot_cache.connection_id)}"
+            nodes.append(RefreshNode(pivot_cache.key, PIVOT_CACHE, name, depends_on=[connection_key], covered_by=connection_key))
+        else:
+            depends_on = [
+                query_table.key for query_table in structure.query_tables
+                if (pivot_cache.source_name and pivot_cache.source_name == query_table.table_name)
+                or (pivot_cache.source_sheet and pivot_cache.source_sheet == query_table.sheet)
+            ]
+            nodes.append(RefreshNode(pivot_cache.key, PIVOT_CACHE, name, depends_on=depends_on))
+
+    for pivot_table in structure.pivot_tables:
+        cache_key = cache_keys.get(pivot_table.cache_part, f"pivot cache:{pivot_table.cache_part}")
+        nodes.append(RefreshNode(f"pivot table:{pivot_table.sheet}!{pivot_table.name}", PIVOT_TABLE, pivot_table.name, depends_on=[cache_key], covered_by=cache_key))
+
+    return nodes
+
+
+_REFRESHED_DATE = re.compile(rb'refreshedDate="[^"]*"')
+_MODIFIED = re.compile(rb"(<dcterms:modified[^>]*>)[^<]*(</dcterms:modified>)")
+
+
+def _rewrite_parts(file_path: str, change_data: bool, stale_parts: frozenset[str] = frozenset()) -> None:
+    """Rewrite a workbook's parts like an Excel save after a refresh would.
+    The pivot caches in stale_parts keep their refreshedDate, like a pivot cache whose refresh failed.
+    """
+    now = datetime.now(timezone.utc)
+    # Excel stores refreshedDate as a serial date in local time
+    serial_date = refresh_verifier.to_serial_date(datetime.now())
+    changed_sheet = False
+
+    temp_path = f"{file_path}.saving"
+    with zipfile.ZipFile(file_path) as source, zipfile.ZipFile(temp_path, "w") as target:
+        for info in source.infolist():
+            # Keep the compression of every part like Excel does
+            target_info = zipfile.ZipInfo(info.filename, info.date_time)
+            target_info.compress_type = info.compress_type
+            with source.open(info) as source_part, target.open(target_info, "w", force_zip64=True) as target_part:
+                if info.filename.startswith("xl/pivotCache/pivotCacheDefinition") and info.filename not in stale_parts:
+                    target_part.write(_REFRESHED_DATE.sub(f'refreshedDate="{serial_date}"'.encode(), source_part.read()))
+                elif info.filename == "docProps/core.xml":
+                    target_part.write(_MODIFIED.sub(rb"\g<1>" + now.strftime("%Y-%m-%dT%H:%M:%SZ").encode() + rb"\g<2>", source_part.read()))
+                elif change_data and not changed_sheet and info.filename.startswith("xl/worksheets/sheet"):
+                    shutil.copyfileobj(source_part, target_part)
+                    target_part.write(f"<!-- refreshed {uuid.uuid4()} -->".encode())
+                    changed_sheet = True
+                else:
+                    shutil.copyfileobj(source_part, target_part)
+    os.replace(temp_path, file_path)
+
+
+BACKENDS = {
+    "com": ComRefreshBackend,
+    "simulated": SimulatedRefreshBackend,
+}
+
+
+def create_backend(name: str) -> RefreshBackend:
+    """Create a refresh backend by its name in BACKENDS."""
+    return BACKENDS[name]()
@@ -0,0 +1,131 @@
+"""This module plans the refresh of a workbook so each data source is refreshed exactly once.
+
+A workbook is described as a graph of connections, query tables, pivot caches and pivot tables.
+Nodes whose refresh is already done by another node (a query table by its connection, a pivot table
+by its pivot cache, an external pivot cache by its connection) are skipped, and the rest is ordered
+in stages so every node is refreshed after the nodes it depends on.
+Nodes within a stage don't depend on each other and can be refreshed concurrently.
+
+For an incremental refresh, connections whose source data hasn't changed are passed as unchanged.
+They are skipped along with every node that only depends on unchanged nodes.
+"""
+
+from dataclasses import dataclass, field
+
+CONNECTION = "connection"
+QUERY_TABLE = "query table"
+PIVOT_CACHE = "pivot cache"
+PIVOT_TABLE = "pivot table"
+
+
+class RefreshPlanError(Exception):
+    """Raised when a workbook's dependencies can't be ordered, e.g. because of a cycle."""
+
+
+@dataclass
+class RefreshNode:
+    """Something in a workbook that can be refreshed.
+
+    Attributes:
+        key: A unique key for the node, e.g. 'connection:Query - Sales'.
+        kind: One of CONNECTION, QUERY_TABLE, PIVOT_CACHE or PIVOT_TABLE.
+        name: The name shown in reports.
+        depends_on: Keys of nodes whose data this node reads.
+        covered_by: Key of a node whose refresh also refreshes this node, if any.
+        background: Whether the node can refresh in the background alongside others.
+        handle: The backend's object used to refresh the node.
+    """
+    key: str
+    kind: str
+    name: str
+    depends_on: list[str] = field(default_factory=list)
+    covered_by: str | None = None
+    background: bool = False
+    handle: object = None
+
+
+@dataclass
+class RefreshPlan:
+    """The result of planning a workbook refresh.
+
+    Attributes:
+        stages: Lists of nodes to refresh, in order. Nodes in a stage are independent.
+        skipped: Pairs of a skipped node and the reason it was skipped.
+        not_refreshed: Keys of the skipped nodes whose data isn't refreshed at all, because their sources are
+            unchanged or they are covered by such a node. Other skipped nodes are refreshed by the node covering them.
+    """
+    stages: list[list[RefreshNode]]
+    skipped: list[tuple[RefreshNode, str]]
+    not_refreshed: frozenset[str] = frozenset()
+
+    def summary(self) -> str:
+        """Describe the plan in a single line for the log."""
+        refreshed = sum(len(stage) for stage in self.stages)
+        skipped = ", ".join(f"{node.kind} '{node.name}' ({reason})" for node, reason in self.skipped)
+        return f"Refreshed {refreshed} nodes in {len(self.stages)} stages. Skipped {len(self.skipped)}: {skipped or 'none'}."
+
+
+def build_plan(nodes: list[RefreshNode], unchanged: frozenset[str] = frozenset()) -> RefreshPlan:
+    """Order the nodes of a workbook into refresh stages.
+
+    Args:
+        nodes: All refreshable nodes of the workbook.
+        unchanged: Keys of connections whose source data hasn't changed since their last refresh.
+
+    Returns:
+        RefreshPlan: The stages to refresh and the nodes that were skipped.
+
+    Raises:
+        RefreshPlanError: If the dependencies contain a cycle.
+    """
+    by_key = {node.key: node for node in nodes}
+
+    skipped = []
+    to_refresh = {}
+    for node in nodes:
+        if node.covered_by in by_key:
+            covering = by_key[node.covered_by]
+            skipped.append((node, f"refreshed with {covering.kind} '{covering.name}'"))
+        else:
+            to_refresh[node.key] = node
+
+    # A dependency on a skipped node is a dependency on the node covering it
+    def resolve(key: str) -> str | None:
+        seen = set()
+        while key in by_key and key not in to_refresh:
+            if key in seen:
+                return None
+            seen.add(key)
+            key = by_key[key].covered_by
+        return key if key in to_refresh else None
+
+    dependencies = {
+        key: {resolved for dependency in node.depends_on if (resolved := resolve(dependency)) and resolved != key}
+        for key, node in to_refresh.items()
+    }
+
+    stages = []
+    done = set()
+    not_refreshed = set()
+    while len(done) < len(to_refresh):
+        ready = [to_refresh[key] for key, deps in dependencies.items() if key not in done and deps <= done]
+        if not ready:
+            remaining = ", ".join(key for key in to_refresh if key not in done)
+            raise RefreshPlanError(f"Circular refresh dependencies between: {remaining}")
+
+        stage = []
+        for node in ready:
+            if node.key in unchanged:
+                skipped.append((node, "source unchanged"))
+                not_refreshed.add(node.key)
+            elif dependencies[node.key] and dependencies[node.key] <= not_refreshed:
+                skipped.append((node, "sources unchanged"))
+                not_refreshed.add(node.key)
+            else:
+                stage.append(node)
+        if stage:
+            stages.append(stage)
+        done.update(node.key for node in ready)
+
+    not_refreshed.update(node.key for node in nodes if node.key not in to_refresh and resolve(node.key) in not_refreshed)
+    return RefreshPlan(stages, skipped, frozenset(not_refreshed))
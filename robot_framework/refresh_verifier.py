@@ -0,0 +1,86 @@
+"""This module verifies a refresh from the saved xlsx parts of the workbook without Excel.
+
+After a workbook is saved its parts are read again with xlsx_parts and compared with the parts read
+before the refresh:
+- A pivot cache fails when Excel marked it invalid or its refreshedDate is older than the refresh.
+  Only pivot caches a refresh is expected to update are checked: those filled from a connection or from
+  the table or sheet of a query table, without enableRefresh="0" and not deliberately left unrefreshed.
+- A query table fails when its table had data rows before the refresh and has none after.
+Connections have no error state in the saved parts. A connection fails when its refresh raised an
+error, which refresh_backend passes in, or when one of the query tables or pivot caches it fills fails.
+
+Only the nodes that failed are refreshed again, so a single broken pivot cache doesn't cost a full refresh.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from robot_framework import xlsx_parts
+
+# Excel keeps one empty row in a table whose query returned no rows
+_EMPTY_TABLE_ROWS = 1
+
+# Seconds a refreshedDate may be before the start of the refresh, as Excel stores it with limited precision
+_CLOCK_MARGIN_SECONDS = 1
+
+
+@dataclass
+class Finding:
+    """A node of the workbook that failed verification.
+
+    Attributes:
+        key: The key of the refresh node, see refresh_planner.
+        reason: Why the node failed, for the log.
+    """
+    key: str
+    reason: str
+
+    def __str__(self) -> str:
+        return f"{self.key} ({self.reason})"
+
+
+def verify(file_path: str, before: xlsx_parts.WorkbookStructure, started: datetime, not_refreshed: frozenset[str] = frozenset()) -> list[Finding]:
+    """Verify the saved parts of a refreshed workbook.
+
+    Args:
+        file_path: The path of the saved workbook.
+        before: The structure of the workbook before the refresh.
+        started: The local time the refresh started.
+        not_refreshed: Keys of nodes that were deliberately not refreshed, e.g. because their source was unchanged.
+
+    Returns:
+        list[Finding]: The query tables and pivot caches that failed verification.
+    """
+    after = xlsx_parts.read_structure(file_path)
+    findings = []
+
+    rows_before = {query_table.key: query_table.row_count for query_table in before.query_tables}
+    for query_table in after.query_tables:
+        connection_key = f"connection:{after.connection_name(query_table.connection_id)}"
+        if query_table.key in not_refreshed or connection_key in not_refreshed:
+            continue
+        had_rows = (rows_before.get(query_table.key) or 0) > _EMPTY_TABLE_ROWS
+        if had_rows and (query_table.row_count or 0) <= _EMPTY_TABLE_ROWS:
+            findings.append(Finding(query_table.key, f"no rows, had {rows_before[query_table.key]}"))
+
+    oldest_fresh = to_serial_date(started - timedelta(seconds=_CLOCK_MARGIN_SECONDS))
+    for pivot_cache in after.pivot_caches:
+        if pivot_cache.key in not_refreshed or not pivot_cache.refresh_enabled or not after.reads_connection(pivot_cache):
+            continue
+        if pivot_cache.invalid:
+            findings.append(Finding(pivot_cache.key, "marked invalid"))
+        elif pivot_cache.refreshed_date is None or float(pivot_cache.refreshed_date) < oldest_fresh:
+            findings.append(Finding(pivot_cache.key, f"last refreshed {_describe_serial_date(pivot_cache.refreshed_date)}"))
+
+    return findings
+
+
+def to_serial_date(moment: datetime) -> float:
+    """Convert a time to the serial date Excel stores in refreshedDate."""
+    return (moment - datetime(1899, 12, 30, tzinfo=moment.tzinfo)).total_seconds() / 86400
+
+
+def _describe_serial_date(serial_date: str | None) -> str:
+    if serial_date is None:
+        return "never"
+    return f"{datetime(1899, 12, 30) + timedelta(days=float(serial_date)):%Y-%m-%d %H:%M:%S}"
@@ -1,7 +1,10 @@
 """This module handles resetting the state of the computer so the robot can work with a clean slate."""
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
-import subprocess
+
+from robot_framework import excel_pool
+from robot_framework import notifications
+from robot_framework import queue_source
 
 def reset(orchestrator_connection: OrchestratorConnection) -> None:
     """Clean up, close/kill all programs and start them again. """
@@ -17,12 +20,19 @@ def clean_up(orchestrator_connection: OrchestratorConnection) -> None:
 def close_all(orchestrator_connection: OrchestratorConnection) -> None:
     """Gracefully close all applications used by the robot."""
     orchestrator_connection.log_trace("Closing all applications.")
+    queue_source.close_connection()
+    notifications.shutdown()
 
 
 def kill_all(orchestrator_connection: OrchestratorConnection) -> None:
-    """Forcefully close all applications used by the robot."""
+    """Forcefully close all applications used by the robot.
+    Only the robot's own Excel instances are closed, other Excel instances on the machine are left alone.
+    """
     orchestrator_connection.log_trace("Killing all applications.")
-    subprocess.call("taskkill /F /IM excel.exe /T", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
+    excel_pool.shutdown()
+    orphans = excel_pool.kill_orphaned_excel()
+    if orphans:
+        orchestrator_connection.log_info(f"Killed {orphans} orphaned Excel instances.")
 
 
 def open_all(orchestrator_connection: OrchestratorConnection) -> None:
@@ -0,0 +1,284 @@
+"""This module orders the queue so the night's batch finishes as early as possible.
+
+Before the queue is processed, plan() reads the new elements of config.QUEUE_NAME and estimates the
+cost of each from the workbook history: the median download, refresh and upload durations of the
+workbook, the estimate of its last inspection (see workbook_inspector) if it has no refresh durations,
+else its size times the seconds per byte of the other workbooks, and the median cost of all known
+workbooks if it's new. The elements are ordered by priority lane (config.SCHEDULER_LANES) and longest first within a lane, so the big workbooks don't end up alone
+on one worker at the end of the run. With config.SCHEDULER_GROUP_BY_SITE the workbooks of a site are
+kept together within a lane, the sites with the most work first, so they share the site's session
+and cached folder lookups (see sharepoint_folders). Simulating the workers on that order gives the
+estimated run time.
+
+Pending elements for the same workbook (e.g. a manual re-queue, or a MonthlyFolder and a plain entry
+for one file) are coalesced into one planned element. They are grouped on their site-qualified
+reference (see queue_source.reference), which is also what they are claimed by, so a workbook with
+the same path on another site is never claimed in their place. next_element claims the merged
+elements along with the one that does the work and gives it their combined custom functions, and
+finish() gives them its final status with a message pointing to it, so each workbook is refreshed once per run.
+
+The workers take elements in the planned order with Schedule.next_element. With
+config.SCHEDULER_DEADLINE set, elements that aren't expected to finish before the deadline are left
+in the queue for the next run.
+"""
+
+import heapq
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
+
+from robot_framework import config
+from robot_framework import process
+from robot_framework import queue_source
+from robot_framework import workbook_history
+from robot_framework import workbook_inspector
+
+
+@dataclass
+class PlannedElement:
+    """A queue element in the schedule."""
+    reference: str
+    sharepoint_site: str
+    folder_path: str
+    lane: int
+    estimate: float
+    custom_function: str | None = None
+    # The number of pending elements for the same workbook coalesced into this one
+    merged: int = 0
+
+
+class Schedule:
+    """The planned order of the queue. next_element is safe to call from several workers."""
+
+    def __init__(self, orchestrator_connection: OrchestratorConnection, elements: list[PlannedElement], deadline: datetime | None, default_estimate: float):
+        self.orchestrator_connection = orchestrator_connection
+        self.elements = elements
+        self.deadline = deadline
+        self.default_estimate = default_estimate
+        self._pending = deque(elements)
+        self._deferred = 0
+        # Queue element id -> the queue elements merged into it
+        self._merged: dict = {}
+        self._lock = threading.Lock()
+
+    def next_element(self) -> QueueElement | None:
+        """Take the next queue element in the planned order and mark it as in progress.
+        Elements added to the queue after planning are taken last, unless an element was left for the next run.
+
+        Returns:
+            QueueElement | None: The queue element, or None when nothing more should be processed.
+        """
+        with self._lock:
+            while self._pending:
+                planned = self._pending.popleft()
+                if not self._fits(planned.estimate):
+                    self._deferred += 1
+                    self.orchestrator_connection.log_info(
+                        f"Leaving {planned.folder_path} for the next run: it's estimated to take {_duration(planned.estimate)} "
+                        f"and wouldn't be done before the deadline {self.deadline:%H:%M}."
+                    )
+                    continue
+                queue_element = self.orchestrator_connection.get_next_queue_element(config.QUEUE_NAME, reference=planned.reference)
+                if queue_element:
+                    self._claim_merged(queue_element, planned)
+                    return queue_element
+
+            # Køen hentes i rækkefølge, så et udskudt element ville blive taget her
+            if self._deferred or not self._fits(self.default_estimate):
+                return None
+            return self.orchestrator_connection.get_next_queue_element(config.QUEUE_NAME)
+
+    def _claim_merged(self, queue_element: QueueElement, planned: PlannedElement) -> None:
+        """Claim the elements coalesced into queue_element and give it their combined custom functions.
+        The custom functions are combined from the claimed elements, so an element queued after planning keeps its own.
+        """
+        merged = []
+        for _ in range(planned.merged):
+            duplicate = self.orchestrator_connection.get_next_queue_element(config.QUEUE_NAME, reference=planned.reference)
+            if duplicate:
+                merged.append(duplicate)
+        if not merged:
+            return
+
+        self._merged[queue_element.id] = merged
+        data = json.loads(queue_element.data)
+        data["CustomFunction"] = _combine_custom_functions([data, *(json.loads(duplicate.data) for duplicate in merged)])
+        queue_element.data = json.dumps(data)
+        self.orchestrator_connection.log_info(
+            f"Merged {len(merged)} queue elements for {planned.folder_path} into queue element {queue_element.id} "
+            f"with custom functions {data['CustomFunction']}."
+        )
+
+    def finish(self, queue_element: QueueElement, failed: bool) -> None:
+        """Give the elements merged into a finished queue element the same status.
+
+        Args:
+            queue_element: The queue element that did the work.
+            failed: Whether it failed.
+        """
+        with self._lock:
+            merged = self._merged.pop(queue_element.id, [])
+        for duplicate in merged:
+            self.orchestrator_connection.set_queue_element_status(
+                duplicate.id,
+                QueueStatus.FAILED if failed else QueueStatus.DONE,
+                f"Merged into queue element {queue_element.id}, which {'failed' if failed else 'refreshed the workbook'}.",
+            )
+
+    def _fits(self, estimate: float) -> bool:
+        return self.deadline is None or datetime.now() + timedelta(seconds=estimate) <= self.deadline
+
+    def summary(self, workers: int, task_count: int) -> str:
+        """Describe the estimated run time of the schedule.
+
+        Args:
+            workers: The number of elements processed at a time.
+            task_count: The maximum number of elements processed in the run.
+
+        Returns:
+            str: A message with the estimated run time, finish time and any elements expected to miss the deadline.
+        """
+        now = datetime.now()
+        finish_times = [0.0] * max(workers, 1)
+        planned = late = 0
+        for element in self.elements:
+            if planned >= task_count:
+                break
+            start = heapq.heappop(finish_times)
+            if self.deadline and now + timedelta(seconds=start + element.estimate) > self.deadline:
+                late += 1
+                heapq.heappush(finish_times, start)
+                continue
+            planned += 1
+            heapq.heappush(finish_times, start + element.estimate)
+
+        run_time = max(finish_times)
+        message = (
+            f"Scheduled {planned} queue elements on {workers} workers. "
+            f"Estimated run time {_duration(run_time)}, done around {now + timedelta(seconds=run_time):%H:%M}."
+        )
+        if late:
+            message += f" {late} elements are not expected to finish before the deadline {self.deadline:%H:%M} and are left for the next run."
+        return message
+
+
+def plan(orchestrator_connection: OrchestratorConnection) -> Schedule:
+    """Read the new queue elements and order them by lane and estimated cost.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+
+    Returns:
+        Schedule: The schedule the workers take queue elements from.
+    """
+    queue_elements = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, status=QueueStatus.NEW, limit=config.SCHEDULER_PLAN_LIMIT)
+    history = workbook_history.read_history()
+    default_estimate, seconds_per_byte = _fleet_estimates(history)
+
+    # Ventende elementer for samme projektmappe slås sammen efter den reference, de hentes med
+    groups: dict[str, list[dict]] = {}
+    for queue_element in queue_elements:
+        data = json.loads(queue_element.data)
+        groups.setdefault(queue_source.reference(data["SharePointSite"], data["FolderPath"]), []).append(data)
+
+    elements = []
+    for reference, group in groups.items():
+        data = group[0]
+        estimate = _estimate(history.get(workbook_history.key(data["SharePointSite"], data["FolderPath"]), {}), seconds_per_byte)
+        elements.append(PlannedElement(
+            reference=reference,
+            sharepoint_site=data["SharePointSite"],
+            folder_path=data["FolderPath"],
+            lane=min(_lane(other) for other in group),
+            estimate=estimate if estimate is not None else default_estimate,
+            custom_function=_combine_custom_functions(group),
+            merged=len(group) - 1,
+        ))
+
+    # Længste først inden for hver bane, eventuelt samlet pr. site
+    site_totals: dict[tuple[int, str], float] = {}
+    for element in elements:
+        site_key = (element.lane, _site(element)) if config.SCHEDULER_GROUP_BY_SITE else (element.lane, "")
+        site_totals[site_key] = site_totals.get(site_key, 0) + element.estimate
+
+    def order(element: PlannedElement) -> tuple:
+        site = _site(element) if config.SCHEDULER_GROUP_BY_SITE else ""
+        return element.lane, -site_totals[(element.lane, site)], site, -element.estimate
+
+    elements.sort(key=order)
+    return Schedule(orchestrator_connection, elements, _deadline(config.SCHEDULER_DEADLINE), default_estimate)
+
+
+def _combine_custom_functions(elements_data: list[dict]) -> str | None:
+    """Combine the custom functions of the data of several queue elements into one CustomFunction."""
+    custom_functions = {custom_function for data in elements_data for custom_function in process.custom_functions(data.get("CustomFunction"))}
+    return ",".join(sorted(custom_functions)) or None
+
+
+def _site(element: PlannedElement) -> str:
+    return element.sharepoint_site.rstrip("/").lower()
+
+
+def _lane(data: dict) -> int:
+    """Get the lane of a queue element from its FolderPath, else the lowest lane of its custom functions."""
+    if data["FolderPath"] in config.SCHEDULER_LANES:
+        return config.SCHEDULER_LANES[data["FolderPath"]]
+    lanes = [config.SCHEDULER_LANES[custom_function] for custom_function in process.custom_functions(data.get("CustomFunction")) if custom_function in config.SCHEDULER_LANES]
+    return min(lanes, default=config.SCHEDULER_DEFAULT_LANE)
+
+
+def _estimate(entry: dict, seconds_per_byte: float | None) -> float | None:
+    """Estimate the seconds a workbook takes from its history entry, or None if there is nothing to go by."""
+    refresh = workbook_history.percentile(entry["refresh"], 50) if entry.get("refresh") else None
+    if entry.get("strategy") == workbook_inspector.SKIP:
+        # Excel åbnes ikke, så kun overførslerne koster noget
+        refresh = 0.0
+    elif refresh is None and entry.get("estimate") is not None:
+        refresh = entry["estimate"]
+    if entry.get("timed_out_after"):
+        refresh = max(refresh or 0, entry["timed_out_after"])
+    if refresh is None:
+        if not entry.get("bytes") or seconds_per_byte is None:
+            return None
+        return entry["bytes"] * seconds_per_byte
+
+    transfers = sum(workbook_history.percentile(entry[stage], 50) for stage in ("download", "upload") if entry.get(stage))
+    return refresh + transfers
+
+
+def _fleet_estimates(history: dict) -> tuple[float, float | None]:
+    """Get the median cost of the workbooks with a history, and their seconds per byte."""
+    costs = []
+    total_seconds = total_bytes = 0
+    for entry in history.values():
+        if not entry.get("refresh") or entry.get("strategy") == workbook_inspector.SKIP:
+            continue
+        cost = _estimate(entry, None)
+        costs.append(cost)
+        if entry.get("bytes"):
+            total_seconds += cost
+            total_bytes += entry["bytes"]
+
+    default_estimate = workbook_history.percentile(costs, 50) if costs else config.SCHEDULER_DEFAULT_ESTIMATE
+    return default_estimate, total_seconds / total_bytes if total_bytes else None
+
+
+def _deadline(time_of_day: str | None) -> datetime | None:
+    """Get the next occurrence of a local "HH:MM" time of day."""
+    if not time_of_day:
+        return None
+    hour, minute = (int(part) for part in time_of_day.split(":"))
+    now = datetime.now()
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return deadline
+
+
+def _duration(seconds: float) -> str:
+    return str(timedelta(seconds=round(seconds)))
@@ -0,0 +1,123 @@
+"""This module sends several SharePoint metadata queries in one REST $batch request.
+
+Each query is queued on a Batch and gets an Operation back. Batch.execute sends all queued queries
+in one round trip, reads and writes (e.g. adding folders) alike, and fills each Operation with its
+own result or error, so one failing lookup doesn't hide the results of the others. Writes are sent
+in one change set and run in the order they were queued, so a folder can be added inside a folder
+added earlier in the same batch.
+
+Only metadata belongs in a batch: file content is streamed by sharepoint_transfer.
+"""
+
+from email import message_from_bytes
+from email.message import Message
+from typing import Iterator
+
+import requests
+from office365.runtime.client_object import ClientObject
+from office365.runtime.client_request_exception import ClientRequestException
+from office365.runtime.odata.request import ODataRequest
+from office365.runtime.odata.v3.batch_request import ODataBatchV3Request
+from office365.runtime.odata.v3.json_light_format import JsonLightFormat
+from office365.runtime.paths.v3.entity import EntityPath
+from office365.runtime.queries.batch import BatchQuery
+from office365.runtime.queries.client_query import ClientQuery
+from office365.runtime.queries.read_entity import ReadEntityQuery
+from office365.runtime.queries.service_operation import ServiceOperationQuery
+from office365.sharepoint.client_context import ClientContext
+from office365.sharepoint.folders.collection import FolderCollection
+from office365.sharepoint.folders.folder import Folder
+
+from robot_framework import telemetry
+from robot_framework.sharepoint_transport import ThrottledRequestMixin
+
+
+class Operation:
+    """A query in a batch. Holds its result or error once the batch is executed."""
+
+    def __init__(self, return_type: ClientObject):
+        self.return_type = return_type
+        self.error: Exception | None = None
+        self.done = False
+
+    def result(self) -> ClientObject:
+        """Get the result of the query, raising its error if it failed."""
+        if not self.done:
+            raise RuntimeError("The batch has not been executed.")
+        if self.error is not None:
+            raise self.error
+        return self.return_type
+
+
+class Batch:
+    """Queries for one SharePoint site, sent together by execute.
+
+    Args:
+        client: The client context of the site.
+    """
+
+    def __init__(self, client: ClientContext):
+        self.client = client
+        self._operations: dict[int, tuple[ClientQuery, Operation]] = {}
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def load(self, client_object: ClientObject, properties: list[str] | None = None) -> Operation:
+        """Queue loading the properties of a client object, e.g. a folder or a folder collection."""
+        return self._add(ReadEntityQuery(client_object, properties))
+
+    def add_folder(self, folders: FolderCollection, name: str) -> Operation:
+        """Queue adding a folder to a folder collection. The result is the new folder."""
+        folder = Folder(self.client, EntityPath(name, folders.resource_path))
+        return self._add(ServiceOperationQuery(folders, "Add", [name], None, None, folder))
+
+    def execute(self) -> None:
+        """Send the queued queries in one request.
+        An error in a single query is kept on its Operation, while an error of the whole request is raised.
+        """
+        if not self._operations:
+            return
+        queries = [query for query, _ in self._operations.values()]
+        with telemetry.span("sharepoint_batch", queries=len(queries)):
+            request = _BatchRequest(self._operations)
+            for handler in self.client.pending_request().beforeExecute:
+                request.beforeExecute += handler
+            request.execute_query(BatchQuery(self.client, queries))
+        self._operations = {}
+
+    def _add(self, query: ClientQuery) -> Operation:
+        operation = Operation(query.return_type)
+        self._operations[id(query)] = (query, operation)
+        return operation
+
+
+class _BatchRequest(ThrottledRequestMixin, ODataBatchV3Request):
+    """A $batch request mapping each part of the response to the Operation of its query.
+    It's sent through sharepoint_transport like the other requests of the client.
+    """
+
+    def __init__(self, operations: dict[int, tuple[ClientQuery, Operation]]):
+        super().__init__(JsonLightFormat())
+        self._operations = operations
+
+    def process_response(self, response: requests.Response, query: BatchQuery) -> None:
+        response.raise_for_status()
+        for sub_query, sub_response in self._extract_response(response, query):
+            _, operation = self._operations[id(sub_query)]
+            operation.done = True
+            if sub_response.status_code >= 400:
+                operation.error = ClientRequestException(f"{sub_response.status_code} Error in batch", response=sub_response)
+                continue
+            ODataRequest.process_response(self, sub_response, sub_query)
+
+        for _, operation in self._operations.values():
+            if not operation.done:
+                operation.done = True
+                operation.error = RuntimeError("The batch response has no part for this query.")
+
+    def _extract_response(self, response: requests.Response, query: BatchQuery) -> Iterator[tuple[ClientQuery, requests.Response]]:
+        """Pair the queries with the parts of the response, including the parts nested in a change set."""
+        message = message_from_bytes(b"Content-Type: " + response.headers["Content-Type"].encode("ascii") + b"\r\n\r\n" + response.content)
+        parts: list[Message] = [part for part in message.walk() if part.get_content_type() == "application/http"]
+        yield from zip(query.ordered_queries, map(self._deserialize_response, parts))
@@ -0,0 +1,215 @@
+"""This module caches SharePoint folder lookups per site during a run.
+
+Each upload used to resolve its target folder with a request, and a MonthlyFolder workbook also
+looked up the Dokumenter library, its Historik folder and created the year and month folders.
+Existing subfolders are found in a listing of the parent folder, so folders are only added when missing.
+The server-relative url of every folder resolved or ensured is kept per site, so later workbooks on
+the same site get a folder object built from the url without any requests. The scheduler keeps the
+workbooks of a site together, so a batch of workbooks makes the lookups once.
+
+The lookups of the first workbook on a site are sent together in one $batch request by prefetch,
+and ensure_folders adds a missing year and month folder in one $batch request (see sharepoint_batch).
+"""
+
+import threading
+
+from office365.sharepoint.client_context import ClientContext
+from office365.sharepoint.folders.folder import Folder
+
+from robot_framework import sharepoint_batch
+
+_lock = threading.Lock()
+# (site url, kind, *path) -> server-relative url of the folder
+_folders: dict = {}
+# (site url, "listing", server-relative url) -> the subfolders of the folder, see _subfolders
+_listings: dict = {}
+
+
+def get_folder(client: ClientContext, folder_path: str) -> Folder:
+    """Get a folder by its server-relative path, checking it exists the first time.
+
+    Args:
+        client: The client context of the SharePoint site.
+        folder_path: The server-relative path of the folder.
+
+    Returns:
+        Folder: The folder with its ServerRelativeUrl set.
+    """
+    def resolve() -> Folder:
+        folder = client.web.get_folder_by_server_relative_url(folder_path)
+        client.load(folder, ["ServerRelativeUrl"]).execute_query()
+        return folder
+
+    return _cached(client, ("folder", folder_path.lower()), resolve)
+
+
+def get_list_folder(client: ClientContext, list_title: str, folder_name: str) -> Folder:
+    """Get a folder in the root folder of a list, e.g. Historik in Dokumenter.
+
+    Args:
+        client: The client context of the SharePoint site.
+        list_title: The title of the list or document library.
+        folder_name: The name of the folder in the root folder of the list.
+
+    Returns:
+        Folder: The folder with its ServerRelativeUrl set.
+    """
+    def resolve() -> Folder:
+        folder = client.web.lists.get_by_title(list_title).root_folder.folders.get_by_url(folder_name)
+        client.load(folder, ["ServerRelativeUrl"]).execute_query()
+        return folder
+
+    return _cached(client, ("list", list_title.lower(), folder_name.lower()), resolve)
+
+
+def ensure_folder(client: ClientContext, parent_folder: Folder, folder_name: str) -> Folder:
+    """Get a subfolder, creating it if it doesn't exist.
+
+    Args:
+        client: The client context of the SharePoint site.
+        parent_folder: A folder returned by this module.
+        folder_name: The name of the subfolder.
+
+    Returns:
+        Folder: The subfolder with its ServerRelativeUrl set.
+    """
+    def resolve() -> Folder:
+        existing = _subfolders(client, parent_folder).get(folder_name.lower())
+        if existing:
+            return client.web.get_folder_by_server_relative_url(existing).set_property("ServerRelativeUrl", existing, persist_changes=False)
+        return parent_folder.folders.add(folder_name).execute_query()
+
+    return _cached(client, ("ensure", parent_folder.serverRelativeUrl.lower(), folder_name.lower()), resolve)
+
+
+def ensure_folders(client: ClientContext, parent_folder: Folder, folder_names: list[str]) -> Folder:
+    """Get a path of nested subfolders, e.g. a year and a month folder, creating the missing ones.
+    The missing folders are added in one $batch request.
+
+    Args:
+        client: The client context of the SharePoint site.
+        parent_folder: A folder returned by this module.
+        folder_names: The names of the subfolders, outermost first.
+
+    Returns:
+        Folder: The innermost subfolder with its ServerRelativeUrl set.
+    """
+    folder = parent_folder
+    for index, folder_name in enumerate(folder_names):
+        key = ("ensure", folder.serverRelativeUrl.lower(), folder_name.lower())
+        if _lookup(client, key) is None and folder_name.lower() not in _subfolders(client, folder):
+            return _add_folders(client, folder, folder_names[index:])
+        folder = ensure_folder(client, folder, folder_name)
+    return folder
+
+
+def prefetch(client: ClientContext, folder_paths: list[str] = (), list_folders: list[tuple[str, str]] = ()) -> None:
+    """Look up the folders that aren't cached yet in one $batch request.
+    A list folder is looked up along with its subfolders, so ensure_folder and ensure_folders can find them without a request.
+    A lookup that fails isn't cached, so the following get_folder or get_list_folder raises its error.
+
+    Args:
+        client: The client context of the SharePoint site.
+        folder_paths: Server-relative paths of folders, see get_folder.
+        list_folders: (list title, folder name) of folders in the root folder of a list, see get_list_folder.
+    """
+    batch = sharepoint_batch.Batch(client)
+    lookups = []
+    for folder_path in folder_paths:
+        key = ("folder", folder_path.lower())
+        if _lookup(client, key) is None:
+            folder = client.web.get_folder_by_server_relative_url(folder_path)
+            lookups.append((key, batch.load(folder, ["ServerRelativeUrl"]), None))
+    for list_title, folder_name in list_folders:
+        key = ("list", list_title.lower(), folder_name.lower())
+        if _lookup(client, key) is None:
+            folder = client.web.lists.get_by_title(list_title).root_folder.folders.get_by_url(folder_name)
+            lookups.append((key, batch.load(folder, ["ServerRelativeUrl"]), batch.load(folder.folders, ["Name", "ServerRelativeUrl"])))
+    if len(batch) < 2:
+        # En enkelt forespørgsel sendes som den plejer
+        return
+
+    batch.execute()
+    site = _site(client)
+    with _lock:
+        for key, folder_operation, listing_operation in lookups:
+            if folder_operation.error is not None:
+                continue
+            server_relative_url = folder_operation.result().serverRelativeUrl
+            _folders[(site, *key)] = server_relative_url
+            if listing_operation is not None and listing_operation.error is None:
+                _listings[(site, "listing", server_relative_url.lower())] = {
+                    folder.name.lower(): folder.serverRelativeUrl for folder in listing_operation.result()
+                }
+
+
+def _add_folders(client: ClientContext, parent_folder: Folder, folder_names: list[str]) -> Folder:
+    """Add a path of nested folders in one $batch request and cache them."""
+    batch = sharepoint_batch.Batch(client)
+    parent_url = parent_folder.serverRelativeUrl
+    added = []
+    for folder_name in folder_names:
+        folders = client.web.get_folder_by_server_relative_url(parent_url).folders
+        added.append((parent_url, folder_name, batch.add_folder(folders, folder_name)))
+        parent_url = f"{parent_url}/{folder_name}"
+    batch.execute()
+
+    site = _site(client)
+    for parent_url, folder_name, operation in added:
+        folder = operation.result()
+        with _lock:
+            _folders[(site, "ensure", parent_url.lower(), folder_name.lower())] = folder.serverRelativeUrl
+    return folder
+
+
+def _subfolders(client: ClientContext, parent_folder: Folder) -> dict[str, str]:
+    """List the subfolders of a folder once per run: lower-case name -> server-relative url."""
+    key = (_site(client), "listing", parent_folder.serverRelativeUrl.lower())
+    with _lock:
+        listing = _listings.get(key)
+    if listing is None:
+        folders = parent_folder.folders
+        client.load(folders, ["Name", "ServerRelativeUrl"]).execute_query()
+        listing = {folder.name.lower(): folder.serverRelativeUrl for folder in folders}
+        with _lock:
+            _listings[key] = listing
+    return listing
+
+
+def forget(client: ClientContext) -> None:
+    """Forget the folders of a site, e.g. after an upload failed because a folder was removed."""
+    site = _site(client)
+    with _lock:
+        for cache in (_folders, _listings):
+            for key in [key for key in cache if key[0] == site]:
+                del cache[key]
+
+
+def clear() -> None:
+    """Forget the folders of all sites."""
+    with _lock:
+        _folders.clear()
+        _listings.clear()
+
+
+def _lookup(client: ClientContext, key: tuple) -> str | None:
+    with _lock:
+        return _folders.get((_site(client), *key))
+
+
+def _cached(client: ClientContext, key: tuple, resolve) -> Folder:
+    server_relative_url = _lookup(client, key)
+    key = (_site(client), *key)
+    if server_relative_url:
+        folder = client.web.get_folder_by_server_relative_url(server_relative_url)
+        return folder.set_property("ServerRelativeUrl", server_relative_url, persist_changes=False)
+
+    folder = resolve()
+    if folder.serverRelativeUrl:
+        with _lock:
+            _folders[key] = folder.serverRelativeUrl
+    return folder
+
+
+def _site(client: ClientContext) -> str:
+    return client.base_url.rstrip("/").lower()
@@ -0,0 +1,129 @@
+"""This module caches SharePoint sessions and OpenOrchestrator credentials across queue elements."""
+
+import base64
+import json
+import threading
+import time
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from office365.runtime.http.request_options import RequestOptions
+from office365.sharepoint.client_context import ClientContext
+
+from robot_framework import config
+from robot_framework import telemetry
+from robot_framework.sharepoint_transport import ThrottledClientContext
+
+_lock = threading.Lock()
+# Credential name -> (fetched at, credential)
+_credentials: dict = {}
+# (site url, tenant, client id) -> (expires at, authentication context)
+_sessions: dict = {}
+
+
+def get_credential(orchestrator_connection: OrchestratorConnection, credential_name: str):
+    """Get a credential from OpenOrchestrator.
+    Lookups are reused for config.CREDENTIAL_CACHE_SECONDS.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        credential_name: The name of the credential.
+
+    Returns:
+        Credential: The credential object from OpenOrchestrator.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _credentials.get(credential_name)
+        if cached and now - cached[0] < config.CREDENTIAL_CACHE_SECONDS:
+            return cached[1]
+
+    credential = orchestrator_connection.get_credential(credential_name)
+    with _lock:
+        _credentials[credential_name] = (now, credential)
+    return credential
+
+
+def get_client(orchestrator_connection: OrchestratorConnection, sharepoint_site_url: str) -> ClientContext:
+    """Get a client context for a SharePoint site.
+    The authentication of a site is reused until config.SHAREPOINT_TOKEN_MARGIN seconds
+    before its access token expires, after which a new one is created. The expiry is read from
+    the token itself, and config.SHAREPOINT_TOKEN_LIFETIME is only used when it can't be read.
+    Each call returns a new ClientContext so concurrent workers don't share pending queries.
+    Its requests go through sharepoint_transport, which handles throttling.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+        sharepoint_site_url: The url of the SharePoint site.
+
+    Returns:
+        ClientContext: A client context authenticated against the site.
+    """
+    api = get_credential(orchestrator_connection, "SharePointAPI")
+    certification = get_credential(orchestrator_connection, "SharePointCert")
+    tenant = api.username
+    client_id = api.password
+    key = (sharepoint_site_url.rstrip("/").lower(), tenant, client_id)
+
+    with _lock:
+        cached = _sessions.get(key)
+        if cached and time.monotonic() < cached[0]:
+            orchestrator_connection.log_trace(f"SharePoint session cache hit for {sharepoint_site_url}")
+            return ThrottledClientContext(sharepoint_site_url, cached[1])
+
+    ctx = sharepoint_client(tenant, client_id, certification.username, certification.password, sharepoint_site_url, orchestrator_connection)
+    lifetime = _token_lifetime(ctx)
+    if lifetime is None:
+        orchestrator_connection.log_trace(f"SharePoint token expiry unknown for {sharepoint_site_url}, using {config.SHAREPOINT_TOKEN_LIFETIME} seconds")
+        lifetime = config.SHAREPOINT_TOKEN_LIFETIME
+    expires_at = time.monotonic() + lifetime - config.SHAREPOINT_TOKEN_MARGIN
+    with _lock:
+        _sessions[key] = (expires_at, ctx.authentication_context)
+    return ctx
+
+
+def _token_lifetime(ctx: ClientContext) -> float | None:
+    """Get the seconds left until the access token of an authenticated client expires,
+    from the exp claim of the JWT in its Authorization header.
+
+    Returns:
+        The seconds left, or None if the token isn't a JWT with an exp claim.
+    """
+    request = RequestOptions(ctx.service_root_url())
+    ctx.authentication_context.authenticate_request(request)
+    token = request.headers.get("Authorization", "").rpartition(" ")[2]
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"]) - time.time()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def clear() -> None:
+    """Forget all cached sessions and credentials."""
+    with _lock:
+        _sessions.clear()
+        _credentials.clear()
+
+
+def sharepoint_client(tenant: str, client_id: str, thumbprint: str, cert_path: str, sharepoint_site_url: str, orchestrator_connection: OrchestratorConnection) -> ClientContext:
+    """
+    Creates and returns a SharePoint client context.
+    """
+    # Authenticate to SharePoint
+    cert_credentials = {
+        "tenant": tenant,
+        "client_id": client_id,
+        "thumbprint": thumbprint,
+        "cert_path": cert_path
+    }
+    with telemetry.span("auth", site=sharepoint_site_url):
+        ctx = ThrottledClientContext(sharepoint_site_url).with_client_certificate(**cert_credentials)
+
+        # Load and verify connection
+        web = ctx.web
+        ctx.load(web)
+        ctx.execute_query()
+
+    orchestrator_connection.log_info(f"Authenticated successfully. Site Title: {web.properties['Title']}")
+    return ctx
@@ -0,0 +1,303 @@
+"""This module has functionality to stream files to and from SharePoint."""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import requests
+from office365.runtime.client_request_exception import ClientRequestException
+from office365.runtime.http.request_options import RequestOptions
+from office365.sharepoint.client_context import ClientContext
+
+from robot_framework import config
+from robot_framework import sharepoint_transport
+from robot_framework import telemetry
+
+
+class DownloadError(Exception):
+    """Raised when a downloaded file doesn't match the metadata on SharePoint, e.g. because it changed during the download."""
+
+
+def get_file_metadata(client: ClientContext, server_relative_path: str) -> dict:
+    """Get the metadata of a file on SharePoint with a single request.
+
+    Args:
+        client: The client context of the SharePoint site.
+        server_relative_path: The path of the file on the site.
+
+    Returns:
+        dict: The file properties including Length, ETag, UniqueId and the content url under 'ContentUrl'.
+    """
+    file = client.web.get_file_by_server_relative_path(server_relative_path)
+    client.load(file, ["Length", "ETag", "UniqueId", "ServerRelativeUrl", "TimeLastModified"])
+    client.execute_query()
+
+    metadata = dict(file.properties)
+    metadata["Length"] = int(metadata.get("Length") or 0)
+    metadata["ContentUrl"] = f"{file.resource_url}/$value"
+    return metadata
+
+
+def download_file(client: ClientContext, metadata: dict, download_path: str, log: callable) -> str:
+    """Stream a file from SharePoint to download_path.
+    The file is written to a '.part' file next to download_path, which is renamed into place
+    once the byte count matches the server's Length and the content was served with the ETag of the metadata.
+    SharePoint's REST api has no hash of a file's content, so the SHA-256 can't be compared with the server;
+    it's returned to identify the local copy.
+    An interrupted transfer is resumed with a range request as long as the server's ETag is unchanged,
+    and a transfer that ends with the wrong byte count is started over.
+
+    Args:
+        client: The client context of the SharePoint site.
+        metadata: The file metadata from get_file_metadata.
+        download_path: The local path to download to.
+        log: A function used to log progress.
+
+    Returns:
+        str: The SHA-256 hex digest of the downloaded file.
+
+    Raises:
+        DownloadError: If the file changed on SharePoint during the download, or the byte count was still wrong after the last attempt.
+    """
+    part_path = f"{download_path}.part"
+    expected_size = metadata["Length"]
+    etag = metadata.get("ETag")
+
+    for attempt in range(1, config.DOWNLOAD_ATTEMPTS + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > expected_size:
+            os.remove(part_path)
+            offset = 0
+
+        try:
+            served_etag = _download_range(client, metadata["ContentUrl"], part_path, offset, etag)
+        except requests.RequestException as e:
+            if attempt == config.DOWNLOAD_ATTEMPTS:
+                raise
+            log(f"Download of {download_path} interrupted at {os.path.getsize(part_path) if os.path.exists(part_path) else 0} bytes, resuming. Error: {e}")
+            continue
+
+        if etag and served_etag and _normalize_etag(served_etag) != _normalize_etag(etag):
+            _remove(part_path)
+            raise DownloadError(f"{download_path} changed on SharePoint during the download: served ETag {served_etag}, expected {etag}.")
+
+        actual_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if actual_size == expected_size:
+            break
+        _remove(part_path)
+        if attempt == config.DOWNLOAD_ATTEMPTS:
+            raise DownloadError(f"Downloaded {actual_size} bytes but SharePoint reports {expected_size} bytes for {download_path}.")
+        log(f"Download of {download_path} ended at {actual_size} of {expected_size} bytes, downloading it again.")
+
+    sha256 = file_sha256(part_path)
+    os.replace(part_path, download_path)
+    return sha256
+
+
+def _download_range(client: ClientContext, url: str, part_path: str, offset: int, etag: str | None) -> str | None:
+    """Stream the content at url from offset and append it to part_path.
+    If the server ignores the range (e.g. because the file changed) the file is written from the start.
+
+    Returns:
+        str | None: The ETag the content was served with, or None if the server sent none or nothing was left.
+    """
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if etag:
+            headers["If-Range"] = etag
+
+    with _authenticated_get(client, url, headers) as response:
+        if response.status_code == 416:
+            # Nothing left to download
+            return None
+        response.raise_for_status()
+
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(part_path, mode) as part_file:
+            for chunk in response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                part_file.write(chunk)
+        return response.headers.get("ETag")
+
+
+def _normalize_etag(etag: str) -> str:
+    """Strip the weak marker and quotes of an ETag, e.g. W/"{GUID},3" as {guid},3."""
+    return etag.removeprefix("W/").strip('"').lower()
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _authenticated_get(client: ClientContext, url: str, headers: dict) -> requests.Response:
+    """Send a streaming GET request authenticated with the client's credentials. Throttling is handled by sharepoint_transport."""
+    request = RequestOptions(url)
+    request.headers.update(headers)
+    client.authentication_context.authenticate_request(request)
+    return sharepoint_transport.send("GET", url, headers=request.headers, stream=True)
+
+
+def file_sha256(file_path: str) -> str:
+    """Calculate the SHA-256 hex digest of a file without loading it into memory."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(config.DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_file(target_folder, local_file_path: str, file_name: str, log: callable):
+    """Upload a local file to a SharePoint folder.
+    Small files are sent in a single request, larger files in an upload session
+    that resumes from the last committed offset. See _upload_in_chunks.
+    A small file whose single request fails for any reason is uploaded in a session instead,
+    except an empty file, which can't be uploaded in a session.
+
+    Args:
+        target_folder: The SharePoint folder to upload to.
+        local_file_path: The path of the local file.
+        file_name: The name of the file on SharePoint.
+        log: A function used to log progress.
+
+    Returns:
+        File: The uploaded SharePoint file.
+    """
+    file_size = os.path.getsize(local_file_path)
+
+    # An empty file has no chunk to start an upload session with, so it's always sent in a single request
+    if file_size <= config.SHAREPOINT_SMALL_UPLOAD_LIMIT or file_size == 0:
+        try:
+            with telemetry.span("upload_file", file=file_name, bytes=file_size):
+                with open(local_file_path, "rb") as file:
+                    content = file.read()
+                return target_folder.files.add(file_name, content, True).execute_query()
+        # Enhver fejl i den simple upload giver et forsøg med den opdelte upload
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if file_size == 0:
+                raise
+            log(f"Normal upload failed for '{file_name}', switching to chunked upload. Error: {e}")
+
+    return _upload_in_chunks(target_folder, local_file_path, file_name, file_size, log)
+
+
+def _upload_in_chunks(target_folder, local_file_path: str, file_name: str, file_size: int, log: callable):
+    """Upload a file in chunks through a SharePoint upload session.
+    The session id and the last offset committed by the server are kept in a '.upload' file
+    next to the local file, so a failed chunk is retried from that offset and a later
+    call with the same unchanged file continues the same session.
+    The chunk size is adjusted so each chunk takes about config.UPLOAD_CHUNK_TARGET_SECONDS.
+    """
+    state_path = f"{local_file_path}.upload"
+    file_stat = os.stat(local_file_path)
+    new_state = {"upload_id": str(uuid.uuid4()), "offset": 0, "file_name": file_name, "size": file_size, "mtime": file_stat.st_mtime}
+    state = _read_upload_state(state_path)
+    resumed = all(state.get(key) == new_state[key] for key in ("file_name", "size", "mtime")) and state.get("offset", 0) > 0
+    if resumed:
+        log(f"Resuming upload of '{file_name}' at {state['offset']} of {file_size} bytes")
+    else:
+        state = new_state
+
+    target_file = _get_or_create_file(target_folder, file_name)
+    chunk_size = config.UPLOAD_CHUNK_SIZE
+    failures = 0
+
+    with open(local_file_path, "rb") as file_content:
+        while True:
+            offset = state["offset"]
+            length = min(chunk_size, file_size - offset)
+            # The first chunk must leave something for finish_upload
+            if offset == 0 and length == file_size:
+                length = file_size // 2
+            file_content.seek(offset)
+            content = file_content.read(length)
+            is_last = offset + length == file_size
+
+            started_at = time.time()
+            started = time.perf_counter()
+            try:
+                if is_last:
+                    result = target_file.finish_upload(state["upload_id"], offset, content).execute_query()
+                    telemetry.record("upload_chunk", started_at, time.perf_counter() - started, {"file": file_name, "offset": offset, "bytes": length})
+                    _remove_upload_state(state_path)
+                    return result
+                if offset == 0:
+                    result = target_file.start_upload(state["upload_id"], content)
+                else:
+                    result = target_file.continue_upload(state["upload_id"], offset, content)
+                target_file.context.execute_query()
+
+            except requests.RequestException as e:
+                telemetry.record("upload_chunk", started_at, time.perf_counter() - started, {"file": file_name, "offset": offset, "bytes": length}, str(e))
+                if resumed:
+                    # The saved session may have expired on the server, start over in a new one
+                    log(f"Could not resume upload of '{file_name}', starting a new upload session. Error: {e}")
+                    state = new_state
+                    resumed = False
+                    continue
+                failures += 1
+                if failures >= config.UPLOAD_CHUNK_ATTEMPTS:
+                    raise
+                chunk_size = max(config.UPLOAD_MIN_CHUNK_SIZE, chunk_size // 2)
+                log(f"Chunk at offset {offset} of '{file_name}' failed, retrying with {chunk_size} byte chunks. Error: {e}")
+                time.sleep(2 ** failures)
+                continue
+
+            elapsed = time.perf_counter() - started
+            telemetry.record("upload_chunk", started_at, elapsed, {"file": file_name, "offset": offset, "bytes": length})
+            failures = 0
+            resumed = False
+            state["offset"] = int(result.value or offset + length)
+            _write_upload_state(state_path, state)
+            chunk_size = _next_chunk_size(chunk_size, length, elapsed)
+
+            percent_uploaded = round(state["offset"] / file_size * 100, 2)
+            log(f"Uploaded {state['offset']} bytes of {file_size} ({percent_uploaded}%) for '{file_name}' at {length / max(elapsed, 0.001) / 1024 / 1024:.1f} MB/s")
+
+
+def _next_chunk_size(chunk_size: int, length: int, elapsed: float) -> int:
+    """Scale the chunk size towards config.UPLOAD_CHUNK_TARGET_SECONDS per chunk.
+    The size at most doubles or halves per chunk and stays within the configured bounds.
+    """
+    if elapsed <= 0:
+        return chunk_size
+    target = length * config.UPLOAD_CHUNK_TARGET_SECONDS / elapsed
+    target = min(max(target, chunk_size / 2), chunk_size * 2)
+    return int(min(max(target, config.UPLOAD_MIN_CHUNK_SIZE), config.UPLOAD_MAX_CHUNK_SIZE))
+
+
+def _get_or_create_file(target_folder, file_name: str):
+    """Get a file in a folder, creating an empty one if it doesn't exist.
+    Existing files keep their content until the upload session is finished.
+    """
+    target_file = target_folder.files.get_by_url(file_name)
+    try:
+        target_folder.context.load(target_file, ["Exists"]).execute_query()
+        if target_file.exists:
+            return target_file
+    except ClientRequestException as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+    return target_folder.files.add(file_name, None, True).execute_query()
+
+
+def _read_upload_state(state_path: str) -> dict:
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_upload_state(state_path: str, state: dict) -> None:
+    with open(state_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file)
+
+
+def _remove_upload_state(state_path: str) -> None:
+    try:
+        os.remove(state_path)
+    except FileNotFoundError:
+        pass
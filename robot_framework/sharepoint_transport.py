@@ -0,0 +1,260 @@
+"""This module sends the robot's SharePoint requests and handles SharePoint Online throttling.
+
+SharePoint answers heavy callers with 429 or 503 and a Retry-After header. Instead of failing the
+queue element, a throttled request waits and is sent again:
+- Retry-After is honoured, with config.SHAREPOINT_BACKOFF_JITTER added as random jitter so the workers
+  don't come back at the same moment. Without Retry-After the wait is an exponential backoff.
+- A throttled response pauses every request of the process until the wait is over, as the tenant's
+  limit is shared by all workers.
+- All requests draw from one token bucket of config.SHAREPOINT_REQUESTS_PER_SECOND.
+- The number of concurrent requests adapts (AIMD): it grows by one for every limit's worth of
+  successful requests and is multiplied by config.SHAREPOINT_CONCURRENCY_DECREASE when throttled.
+
+The requests of a ThrottledClientContext go through send, and so do the streamed downloads
+in sharepoint_transfer and the $batch requests in sharepoint_batch. A streamed response
+holds its concurrency slot only until its headers are received.
+The throttling is counted in telemetry's metrics and summarized by summary() at the end of a run.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from office365.runtime.client_request import ClientRequest
+from office365.runtime.http.http_method import HttpMethod
+from office365.runtime.http.request_options import RequestOptions
+from office365.runtime.odata.request import ODataRequest
+from office365.runtime.odata.v3.json_light_format import JsonLightFormat
+from office365.sharepoint.client_context import ClientContext
+
+from robot_framework import config
+from robot_framework import telemetry
+
+# Responses SharePoint uses to throttle
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class _TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to burst requests."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, waiting until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _AdaptiveLimit:
+    """A concurrency limit adjusted by additive increase and multiplicative decrease."""
+
+    def __init__(self, limit: float, minimum: int, maximum: int):
+        self.limit = limit
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._decrease_after = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait for a free slot."""
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self) -> None:
+        """Free a slot."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def succeeded(self) -> None:
+        """Grow the limit by one per limit successful requests."""
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def throttled(self, wait: float) -> None:
+        """Shrink the limit. Responses throttled together, within the wait, only shrink it once."""
+        with self._condition:
+            now = time.monotonic()
+            if now >= self._decrease_after:
+                self.limit = max(self.minimum, self.limit * config.SHAREPOINT_CONCURRENCY_DECREASE)
+                self._decrease_after = now + wait
+
+
+_lock = threading.Lock()
+# Shared by all workers, created on first use
+_bucket: _TokenBucket | None = None
+_limit: _AdaptiveLimit | None = None
+# Monotonic time until which all requests wait after a throttled response
+_paused_until = 0.0
+# Requests, throttled responses, requests given up after config.SHAREPOINT_THROTTLE_ATTEMPTS and seconds waited
+_counters = {"requests": 0, "throttled": 0, "given_up": 0, "wait_seconds": 0.0}
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a SharePoint request, waiting and sending it again while it's throttled.
+
+    Args:
+        method: The HTTP method.
+        url: The url of the request.
+        **kwargs: Passed on to requests.request, e.g. headers, data or stream.
+
+    Returns:
+        requests.Response: The response. It's the throttled response if the request was throttled
+            config.SHAREPOINT_THROTTLE_ATTEMPTS times.
+    """
+    kwargs.setdefault("timeout", config.HTTP_TIMEOUT)
+    data = kwargs.get("data")
+    # A file being uploaded is read again from the same position on every attempt
+    position = data.tell() if hasattr(data, "tell") else None
+
+    bucket, limit = _limits()
+    for attempt in range(1, config.SHAREPOINT_THROTTLE_ATTEMPTS + 1):
+        _wait_for_pause()
+        bucket.acquire()
+        limit.acquire()
+        try:
+            response = requests.request(method, url, **kwargs)
+        finally:
+            limit.release()
+        _count("requests")
+
+        if response.status_code not in THROTTLE_STATUS_CODES:
+            limit.succeeded()
+            return response
+
+        wait = _retry_wait(response, attempt)
+        _count("throttled")
+        telemetry.increment("sharepoint_throttled", "SharePoint responses that throttled the robot.", status=response.status_code)
+        limit.throttled(wait)
+        if attempt == config.SHAREPOINT_THROTTLE_ATTEMPTS:
+            _count("given_up")
+            return response
+
+        response.close()
+        _pause(wait)
+        with telemetry.span("sharepoint_throttled", status=response.status_code, attempt=attempt, wait=round(wait, 3)):
+            _wait_for_pause()
+        if position is not None:
+            data.seek(position)
+    return response
+
+
+def _limits() -> tuple[_TokenBucket, _AdaptiveLimit]:
+    """Get the token bucket and concurrency limit of this run, creating them on first use."""
+    global _bucket, _limit  # pylint: disable=global-statement
+    with _lock:
+        if _bucket is None or _limit is None:
+            _bucket = _TokenBucket(config.SHAREPOINT_REQUESTS_PER_SECOND, config.SHAREPOINT_REQUEST_BURST)
+            _limit = _AdaptiveLimit(config.SHAREPOINT_CONCURRENCY, config.SHAREPOINT_MIN_CONCURRENCY, config.SHAREPOINT_MAX_CONCURRENCY)
+        return _bucket, _limit
+
+
+def _retry_wait(response: requests.Response, attempt: int) -> float:
+    """Get the seconds to wait before sending a throttled request again.
+    Retry-After in seconds or as an HTTP date is used when given, otherwise an exponential backoff.
+    """
+    retry_after = response.headers.get("Retry-After")
+    wait = None
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                wait = None
+    if wait is None:
+        wait = config.SHAREPOINT_BACKOFF_BASE * 2 ** (attempt - 1)
+    wait = min(max(wait, 0.0), config.SHAREPOINT_BACKOFF_MAX)
+    return wait + random.uniform(0, wait * config.SHAREPOINT_BACKOFF_JITTER)
+
+
+def _pause(wait: float) -> None:
+    """Pause all requests for wait seconds, unless they are already paused for longer."""
+    global _paused_until  # pylint: disable=global-statement
+    with _lock:
+        _paused_until = max(_paused_until, time.monotonic() + wait)
+
+
+def _wait_for_pause() -> None:
+    while (remaining := _paused_until - time.monotonic()) > 0:
+        time.sleep(remaining)
+        _count("wait_seconds", remaining)
+
+
+def _count(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def counters() -> dict:
+    """Get the counts of this run: requests, throttled, given_up and wait_seconds, and the current concurrency limit."""
+    with _lock:
+        limit = _limit.limit if _limit else config.SHAREPOINT_CONCURRENCY
+        return {**_counters, "concurrency": round(limit, 2)}
+
+
+def summary() -> str:
+    """Describe the throttling of this run in a single line for the log."""
+    counts = counters()
+    return (
+        f"SharePoint throttled {counts['throttled']} of {counts['requests']} requests, "
+        f"gave up on {counts['given_up']} and waited {counts['wait_seconds']:.1f} seconds. "
+        f"Concurrency limit {counts['concurrency']}."
+    )
+
+
+class ThrottledRequestMixin:
+    """Sends the requests of an office365 request class through send.
+    Mixed in before the request class, e.g. class Request(ThrottledRequestMixin, ODataRequest).
+    """
+
+    def execute_request_direct(self: ClientRequest, request: RequestOptions) -> requests.Response:
+        """Send an authenticated request through send and raise for an error status."""
+        self.beforeExecute.notify(request)
+        kwargs = {"headers": request.headers, "auth": request.auth, "verify": request.verify, "proxies": request.proxies}
+        # The same arguments as office365's ClientRequest.execute_request_direct
+        if request.method == HttpMethod.Put or (request.method == HttpMethod.Post and (request.is_bytes or request.is_file)):
+            kwargs["data"] = request.data
+        elif request.method in (HttpMethod.Post, HttpMethod.Patch):
+            kwargs["json"] = request.data
+        elif request.method == HttpMethod.Get:
+            kwargs["stream"] = request.stream
+        response = send(request.method, request.url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+class _ThrottledODataRequest(ThrottledRequestMixin, ODataRequest):
+    pass
+
+
+class ThrottledClientContext(ClientContext):
+    """A ClientContext whose requests go through send."""
+
+    def pending_request(self) -> ODataRequest:
+        # Like ClientContext.pending_request, with the throttled request class
+        if self._pending_request is None:
+            self._pending_request = _ThrottledODataRequest(JsonLightFormat())
+            self._pending_request.beforeExecute += self._authenticate_request
+            self._pending_request.beforeExecute += self._build_modification_query
+        return self._pending_request
@@ -0,0 +1,168 @@
+"""This module fingerprints the SQL Server sources of a workbook's connections, so unchanged sources aren't refreshed.
+
+A fingerprint is the result of a cheap probe query against a connection's source, hashed together with
+the connection's command and connection string. The probe is the query in config.SOURCE_PROBES for the
+connection's name or, for a connection to a table, the row count and last update of the table from SQL
+Server's statistics. Connections without a probe, to other sources, or whose probe fails get no fingerprint
+and are always refreshed.
+
+The fingerprints of every workbook's last successful refresh are kept in config.SOURCE_FINGERPRINTS_FILE.
+They are held in memory after the refresh and only stored once the refreshed workbook has been uploaded,
+so a workbook whose upload fails is refreshed again by the next run instead of being skipped as unchanged.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import pyodbc
+
+from robot_framework import config
+from robot_framework import workbook_history
+from robot_framework.xlsx_parts import Connection, WorkbookStructure
+
+# Row count and last update of a table. last_user_update is null until the table is written to after a restart of SQL Server
+_TABLE_PROBE = """
+SELECT
+    (SELECT SUM(row_count) FROM sys.dm_db_partition_stats WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)),
+    (SELECT MAX(last_user_update) FROM sys.dm_db_index_usage_stats WHERE database_id = DB_ID() AND object_id = OBJECT_ID(?))
+"""
+
+# OLEDB providers for SQL Server
+_SQL_SERVER_PROVIDERS = ("sqloledb", "sqlncli", "msoledbsql")
+
+_lock = threading.Lock()
+# Fingerprints of refreshed workbooks that haven't been uploaded yet, keyed on workbook_history.key
+_held: dict[str, dict[str, str]] = {}
+
+
+def probe(structure: WorkbookStructure) -> dict[str, str]:
+    """Fingerprint the sources of a workbook's connections.
+
+    Args:
+        structure: The structure of the workbook, see xlsx_parts.read_structure.
+
+    Returns:
+        dict[str, str]: The fingerprint of each connection key ('connection:<name>') that could be probed.
+    """
+    fingerprints = {}
+    for connection in structure.connections:
+        result = _probe_connection(connection)
+        if result is None:
+            continue
+        material = json.dumps([connection.command, connection.connection_string, result], default=str)
+        fingerprints[f"connection:{connection.name}"] = hashlib.sha256(material.encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def unchanged_connections(site_url: str, server_relative_path: str, fingerprints: dict[str, str]) -> frozenset[str]:
+    """Get the keys of the connections whose fingerprint is the same as at the workbook's last refresh."""
+    with _lock:
+        stored = _read().get(workbook_history.key(site_url, server_relative_path), {})
+    return frozenset(key for key, fingerprint in fingerprints.items() if stored.get(key) == fingerprint)
+
+
+def hold(site_url: str, server_relative_path: str, fingerprints: dict[str, str]) -> None:
+    """Hold the fingerprints of a successful refresh until the workbook is uploaded, see store_held.
+    Empty fingerprints drop the ones held for the workbook, e.g. before it's refreshed again.
+    """
+    key = workbook_history.key(site_url, server_relative_path)
+    with _lock:
+        if fingerprints:
+            _held[key] = fingerprints
+        else:
+            _held.pop(key, None)
+
+
+def store_held(site_url: str, server_relative_path: str) -> None:
+    """Keep the fingerprints held for a workbook for the next run, now that it has been uploaded."""
+    key = workbook_history.key(site_url, server_relative_path)
+    with _lock:
+        fingerprints = _held.pop(key, None)
+        if fingerprints:
+            stored = _read()
+            stored[key] = fingerprints
+            _write(stored)
+
+
+def _probe_connection(connection: Connection) -> list | None:
+    """Run the probe of a connection and return its row, or None if it has no probe or the probe fails."""
+    query = config.SOURCE_PROBES.get(connection.name)
+    params = ()
+    if query is None:
+        table = _table_name(connection)
+        if table is None:
+            return None
+        query, params = _TABLE_PROBE, (table, table)
+
+    connection_string = _odbc_connection_string(connection)
+    if connection_string is None:
+        return None
+
+    try:
+        database = pyodbc.connect(connection_string, timeout=config.SOURCE_PROBE_TIMEOUT)
+        try:
+            database.timeout = config.SOURCE_PROBE_TIMEOUT
+            row = database.cursor().execute(query, *params).fetchone()
+        finally:
+            database.close()
+    except pyodbc.Error:
+        return None
+
+    if row is None or (query is _TABLE_PROBE and row[1] is None):
+        return None
+    return list(row)
+
+
+def _table_name(connection: Connection) -> str | None:
+    """Get the table of a connection whose command is a table, e.g. '"Db"."dbo"."Salg"' as [Db].[dbo].[Salg]."""
+    if connection.command_type != "3" or not connection.command:
+        return None
+    parts = [part.strip().strip('"[]') for part in connection.command.split(".")]
+    return ".".join(f"[{part}]" for part in parts if part)
+
+
+def _odbc_connection_string(connection: Connection) -> str | None:
+    """Convert the connection string of an ODBC or SQL Server OLEDB connection to a pyodbc connection string."""
+    connection_string = connection.connection_string or ""
+    if connection.type == "ODBC":
+        return connection_string.removeprefix("ODBC;") or None
+    if connection.type != "OLEDB":
+        return None
+
+    parts = {}
+    for part in connection_string.removeprefix("OLEDB;").split(";"):
+        name, _, value = part.partition("=")
+        parts[name.strip().lower()] = value.strip()
+    if not parts.get("provider", "").lower().startswith(_SQL_SERVER_PROVIDERS) or not parts.get("data source"):
+        return None
+
+    odbc = "DRIVER={SQL Server};" + f"SERVER={parts['data source']};"
+    if parts.get("initial catalog"):
+        odbc += f"DATABASE={parts['initial catalog']};"
+    if parts.get("integrated security", "").lower() in ("sspi", "true"):
+        return odbc + "Trusted_Connection=yes;"
+    if parts.get("user id"):
+        return odbc + f"UID={parts['user id']};PWD={parts.get('password', '')};"
+    return None
+
+
+def _path() -> str:
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    return os.path.join(config.STATE_FOLDER, config.SOURCE_FINGERPRINTS_FILE)
+
+
+def _read() -> dict:
+    try:
+        with open(_path(), encoding="utf-8") as fingerprints_file:
+            return json.load(fingerprints_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write(fingerprints: dict) -> None:
+    path = _path()
+    with open(f"{path}.tmp", "w", encoding="utf-8") as fingerprints_file:
+        json.dump(fingerprints, fingerprints_file)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,261 @@
+"""This module records timed spans of the work done for each queue element and exports them as metrics.
+
+A span is a named, timed piece of work such as a download, an Excel open or the refresh of a single
+connection. Spans carry the identity of the queue element and workbook they belong to, set with
+element(), and any attributes such as bytes transferred. Finished spans are appended to a JSON-lines
+file per run under config.STATE_FOLDER/config.TELEMETRY_FOLDER, and export_metrics writes them
+aggregated as Prometheus or OpenMetrics text at the end of the run.
+
+Spans recorded in an Excel worker process are captured with capture() and recorded in the parent
+with record_spans, so they get the workbook identity of the element being refreshed.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from robot_framework import config
+
+METRIC_PREFIX = "excel_refresher"
+
+# Attributes identifying the queue element a span belongs to
+_element_attributes = contextvars.ContextVar("element_attributes", default={})
+# A list collecting spans instead of recording them, see capture()
+_captured = contextvars.ContextVar("captured_spans", default=None)
+
+_lock = threading.Lock()
+_run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+_spans_file = None
+# (span, workbook, node) -> [count, seconds, bytes, errors]
+_totals = defaultdict(lambda: [0, 0.0, 0, 0])
+# span -> [count per bucket in config.METRICS_BUCKETS, count, seconds]
+_histograms = {}
+# (counter, labels) -> value, and counter -> help text, see increment()
+_counters = defaultdict(float)
+_counter_help = {}
+
+
+@contextmanager
+def element(queue_element_id, sharepoint_site: str | None, folder_path: str | None):
+    """Attach the identity of a queue element and its workbook to the spans recorded inside the block."""
+    token = _element_attributes.set({
+        "element": str(queue_element_id) if queue_element_id is not None else None,
+        "site": sharepoint_site,
+        "workbook": folder_path,
+    })
+    try:
+        yield
+    finally:
+        _element_attributes.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the block as a span.
+    The yielded dict holds the span's attributes, so values only known at the end (e.g. bytes) can be added.
+    A span ending with an exception is recorded with the error and the exception is re-raised.
+
+    Args:
+        name: The name of the span, e.g. 'download' or 'refresh_connection'.
+        attributes: Attributes of the span.
+    """
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = "".join(traceback.format_exception_only(e)).strip()
+        raise
+    finally:
+        record(name, started_at, time.perf_counter() - started, attributes, error)
+
+
+def record(name: str, started_at: float, duration: float, attributes: dict, error: str | None = None) -> None:
+    """Record a finished span. Use span() unless the timing was taken elsewhere.
+
+    Args:
+        name: The name of the span.
+        started_at: The start of the span as a unix timestamp.
+        duration: The duration of the span in seconds.
+        attributes: Attributes of the span.
+        error: The error that ended the span, if any.
+    """
+    entry = {
+        "name": name,
+        "start": datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+        "duration": round(duration, 6),
+        "status": "error" if error else "ok",
+        **{key: value for key, value in attributes.items() if value is not None},
+    }
+    if error:
+        entry["error"] = error
+
+    captured = _captured.get()
+    if captured is not None:
+        captured.append(entry)
+        return
+
+    entry = {**{key: value for key, value in _element_attributes.get().items() if value is not None}, **entry}
+    entry["run"] = _run_id
+    entry["thread"] = threading.current_thread().name
+    _write(entry)
+
+
+def increment(name: str, help_text: str, value: float = 1, **labels) -> None:
+    """Add to a counter that isn't a span, e.g. the number of throttled requests. It's exported with the span metrics.
+
+    Args:
+        name: The name of the counter without the metric prefix and _total.
+        help_text: The description of the counter in the metrics.
+        value: The amount to add.
+        labels: Labels of the counter.
+    """
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+        _counter_help[name] = help_text
+
+
+@contextmanager
+def capture():
+    """Collect the spans recorded inside the block in the yielded list instead of recording them."""
+    spans = []
+    token = _captured.set(spans)
+    try:
+        yield spans
+    finally:
+        _captured.reset(token)
+
+
+def record_spans(spans: list[dict]) -> None:
+    """Record spans captured elsewhere, e.g. in an Excel worker process."""
+    for entry in spans:
+        entry = dict(entry)
+        name = entry.pop("name")
+        started_at = datetime.fromisoformat(entry.pop("start")).timestamp()
+        duration = entry.pop("duration")
+        entry.pop("status", None)
+        error = entry.pop("error", None)
+        record(name, started_at, duration, entry, error)
+
+
+def _write(entry: dict) -> None:
+    global _spans_file  # pylint: disable=global-statement
+    with _lock:
+        key = (entry["name"], entry.get("workbook", ""), entry.get("node", ""))
+        totals = _totals[key]
+        totals[0] += 1
+        totals[1] += entry["duration"]
+        totals[2] += int(entry.get("bytes") or 0)
+        totals[3] += entry["status"] == "error"
+
+        histogram = _histograms.setdefault(entry["name"], [[0] * len(config.METRICS_BUCKETS), 0, 0.0])
+        for i, bucket in enumerate(config.METRICS_BUCKETS):
+            if entry["duration"] <= bucket:
+                histogram[0][i] += 1
+        histogram[1] += 1
+        histogram[2] += entry["duration"]
+
+        if _spans_file is None:
+            _spans_file = open(os.path.join(_telemetry_folder(), f"spans_{_run_id}.jsonl"), "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        _spans_file.write(json.dumps(entry, default=str) + "\n")
+        _spans_file.flush()
+
+
+def _telemetry_folder() -> str:
+    folder = os.path.join(config.STATE_FOLDER, config.TELEMETRY_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def export_metrics() -> str:
+    """Write the spans of this run as metrics in config.METRICS_FORMAT.
+    The metrics are written to a file named after the run and copied to metrics.prom,
+    which always holds the latest run, e.g. for the node_exporter textfile collector.
+
+    Returns:
+        str: The path of the metrics file of this run.
+    """
+    openmetrics = config.METRICS_FORMAT == "openmetrics"
+    text = render_metrics(openmetrics)
+    folder = _telemetry_folder()
+    path = os.path.join(folder, f"metrics_{_run_id}.{'txt' if openmetrics else 'prom'}")
+    with open(path, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(text)
+    latest_path = os.path.join(folder, "metrics.prom")
+    with open(f"{latest_path}.tmp", "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(text)
+    os.replace(f"{latest_path}.tmp", latest_path)
+    return path
+
+
+def render_metrics(openmetrics: bool = False) -> str:
+    """Render the spans recorded so far as Prometheus text or OpenMetrics.
+
+    Args:
+        openmetrics: True for OpenMetrics, False for the Prometheus text format.
+
+    Returns:
+        str: The metrics text.
+    """
+    with _lock:
+        totals = {key: list(value) for key, value in _totals.items()}
+        histograms = {name: (list(buckets), count, seconds) for name, (buckets, count, seconds) in _histograms.items()}
+        counters = dict(_counters)
+        counter_help = dict(_counter_help)
+
+    lines = []
+
+    def counter(name: str, help_text: str, samples: list[tuple[dict, float]]) -> None:
+        family = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {family if openmetrics else family + '_total'} {help_text}")
+        lines.append(f"# TYPE {family if openmetrics else family + '_total'} counter")
+        for labels, value in samples:
+            lines.append(f"{family}_total{_labels(labels)} {_number(value)}")
+
+    duration = f"{METRIC_PREFIX}_span_duration_seconds"
+    lines.append(f"# HELP {duration} Duration of spans.")
+    lines.append(f"# TYPE {duration} histogram")
+    for name, (buckets, count, seconds) in sorted(histograms.items()):
+        for bucket, bucket_count in zip(config.METRICS_BUCKETS, buckets):
+            lines.append(f"{duration}_bucket{_labels({'span': name, 'le': repr(float(bucket))})} {bucket_count}")
+        lines.append(f"{duration}_bucket{_labels({'span': name, 'le': '+Inf'})} {count}")
+        lines.append(f"{duration}_count{_labels({'span': name})} {count}")
+        lines.append(f"{duration}_sum{_labels({'span': name})} {_number(seconds)}")
+
+    def labels_of(key: tuple) -> dict:
+        name, workbook, node = key
+        labels = {"span": name, "workbook": workbook}
+        if node:
+            labels["node"] = node
+        return labels
+
+    ordered = sorted(totals.items())
+    counter("span_seconds", "Seconds spent in spans per workbook.", [(labels_of(key), value[1]) for key, value in ordered])
+    counter("spans", "Number of spans per workbook.", [(labels_of(key), value[0]) for key, value in ordered])
+    counter("span_bytes", "Bytes handled in spans per workbook.", [(labels_of(key), value[2]) for key, value in ordered if value[2]])
+    counter("span_errors", "Spans that ended with an error per workbook.", [(labels_of(key), value[3]) for key, value in ordered if value[3]])
+    for name, help_text in sorted(counter_help.items()):
+        counter(name, help_text, [(dict(labels), value) for (counter_name, labels), value in sorted(counters.items()) if counter_name == name])
+
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
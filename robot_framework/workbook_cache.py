@@ -0,0 +1,125 @@
+"""This module keeps a local on-disk cache of workbooks keyed on their SharePoint path and ETag.
+
+A cached workbook is only used while the ETag on SharePoint is unchanged, so a workbook
+uploaded by the robot the night before doesn't have to be downloaded again.
+The cache is capped at config.WORKBOOK_CACHE_MAX_BYTES and evicts the least recently used workbooks.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from robot_framework import config
+
+_lock = threading.Lock()
+_INDEX_FILE = "index.json"
+
+
+def _cache_folder() -> str:
+    folder = os.path.join(config.STATE_FOLDER, config.WORKBOOK_CACHE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _cache_key(site_url: str, server_relative_path: str) -> str:
+    return f"{site_url.rstrip('/').lower()}|{server_relative_path.lower()}"
+
+
+def _read_index() -> dict:
+    try:
+        with open(os.path.join(_cache_folder(), _INDEX_FILE), encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index(index: dict) -> None:
+    index_path = os.path.join(_cache_folder(), _INDEX_FILE)
+    with open(f"{index_path}.tmp", "w", encoding="utf-8") as index_file:
+        json.dump(index, index_file)
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+def fetch(site_url: str, server_relative_path: str, etag: str, destination_path: str) -> bool:
+    """Copy a cached workbook to destination_path if the cached copy has the given ETag.
+
+    Args:
+        site_url: The url of the SharePoint site.
+        server_relative_path: The path of the workbook on the site.
+        etag: The current ETag of the workbook on SharePoint.
+        destination_path: Where to copy the cached workbook to.
+
+    Returns:
+        bool: True if the workbook was found in the cache and copied.
+    """
+    if not config.WORKBOOK_CACHE_ENABLED or not etag:
+        return False
+
+    key = _cache_key(site_url, server_relative_path)
+    with _lock:
+        index = _read_index()
+        entry = index.get(key)
+        if not entry or entry["etag"] != etag:
+            return False
+
+        cached_path = os.path.join(_cache_folder(), entry["file"])
+        if not os.path.exists(cached_path) or os.path.getsize(cached_path) != entry["size"]:
+            del index[key]
+            _write_index(index)
+            return False
+
+        entry["last_used"] = time.time()
+        _write_index(index)
+
+    shutil.copyfile(cached_path, destination_path)
+    return True
+
+
+def store(site_url: str, server_relative_path: str, etag: str, local_file_path: str) -> None:
+    """Store a copy of a workbook in the cache under the given ETag
+    and evict the least recently used workbooks if the cache is too big.
+
+    Args:
+        site_url: The url of the SharePoint site.
+        server_relative_path: The path of the workbook on the site.
+        etag: The ETag of the workbook on SharePoint.
+        local_file_path: The local workbook matching the ETag.
+    """
+    if not config.WORKBOOK_CACHE_ENABLED or not etag:
+        return
+
+    size = os.path.getsize(local_file_path)
+    if size > config.WORKBOOK_CACHE_MAX_BYTES:
+        return
+
+    key = _cache_key(site_url, server_relative_path)
+    file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + os.path.splitext(server_relative_path)[1]
+    cached_path = os.path.join(_cache_folder(), file_name)
+
+    with _lock:
+        shutil.copyfile(local_file_path, f"{cached_path}.tmp")
+        os.replace(f"{cached_path}.tmp", cached_path)
+
+        index = _read_index()
+        index[key] = {"etag": etag, "file": file_name, "size": size, "last_used": time.time()}
+        _evict(index, keep=key)
+        _write_index(index)
+
+
+def _evict(index: dict, keep: str) -> None:
+    """Remove the least recently used workbooks until the cache fits in config.WORKBOOK_CACHE_MAX_BYTES."""
+    total_size = sum(entry["size"] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]["last_used"]):
+        if total_size <= config.WORKBOOK_CACHE_MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        entry = index.pop(key)
+        total_size -= entry["size"]
+        try:
+            os.remove(os.path.join(_cache_folder(), entry["file"]))
+        except FileNotFoundError:
+            pass
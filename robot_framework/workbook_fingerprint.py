@@ -0,0 +1,105 @@
+"""This module fingerprints the content of xlsx workbooks so unchanged refreshes can skip the upload.
+
+The fingerprint ignores parts that change on every save, such as the timestamps in
+docProps/core.xml and the refreshedDate attributes of pivot caches.
+Other parts are fingerprinted by the CRC-32 and size stored in the zip directory,
+so only the few parts with volatile attributes are decompressed.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import zipfile
+
+# Parts that are left out of the fingerprint entirely
+VOLATILE_PARTS = ("docProps/core.xml",)
+
+# Parts where volatile attributes are removed before fingerprinting
+_VOLATILE_ATTRIBUTE_PARTS = re.compile(r"^xl/pivotCache/pivotCacheDefinition\d+\.xml$")
+_VOLATILE_ATTRIBUTES = re.compile(rb'\s(?:refreshedDate|refreshedDateIso|refreshedBy)="[^"]*"')
+
+_FINGERPRINT_SUFFIX = ".fingerprint"
+
+_lock = threading.Lock()
+_skipped_uploads = 0
+_skipped_bytes = 0
+
+
+def fingerprint(file_path: str) -> str:
+    """Calculate a fingerprint of the data in an xlsx workbook.
+
+    Args:
+        file_path: The path of the workbook.
+
+    Returns:
+        str: A hex digest that is equal for workbooks with the same data.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(file_path) as archive:
+        for info in sorted(archive.infolist(), key=lambda i: i.filename):
+            if info.filename in VOLATILE_PARTS:
+                continue
+
+            digest.update(info.filename.encode("utf-8"))
+            if _VOLATILE_ATTRIBUTE_PARTS.match(info.filename):
+                digest.update(_VOLATILE_ATTRIBUTES.sub(b"", archive.read(info)))
+            else:
+                digest.update(f"{info.CRC:08x}:{info.file_size}".encode("ascii"))
+    return digest.hexdigest()
+
+
+def remember(file_path: str) -> None:
+    """Store the fingerprint of a freshly downloaded workbook next to it.
+    A workbook that isn't a zip file, e.g. an xls workbook, gets no fingerprint and is always uploaded.
+    """
+    try:
+        workbook_fingerprint = fingerprint(file_path)
+    except zipfile.BadZipFile:
+        forget(file_path)
+        return
+    with open(file_path + _FINGERPRINT_SUFFIX, "w", encoding="ascii") as fingerprint_file:
+        fingerprint_file.write(workbook_fingerprint)
+
+
+def forget(file_path: str) -> None:
+    """Remove the stored fingerprint of a workbook, if any."""
+    try:
+        os.remove(file_path + _FINGERPRINT_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def is_unchanged(file_path: str) -> bool:
+    """Check if a refreshed workbook has the same data as when it was downloaded.
+
+    Args:
+        file_path: The path of the refreshed workbook.
+
+    Returns:
+        bool: True if a fingerprint was stored for the workbook and it still matches.
+    """
+    try:
+        with open(file_path + _FINGERPRINT_SUFFIX, encoding="ascii") as fingerprint_file:
+            original = fingerprint_file.read()
+    except FileNotFoundError:
+        return False
+
+    try:
+        return fingerprint(file_path) == original
+    except zipfile.BadZipFile:
+        return False
+
+
+def record_skipped_upload(size: int) -> None:
+    """Count an upload that was skipped because the workbook was unchanged."""
+    global _skipped_uploads, _skipped_bytes  # pylint: disable=global-statement
+    with _lock:
+        _skipped_uploads += 1
+        _skipped_bytes += size
+
+
+def skipped_uploads() -> tuple[int, int]:
+    """Get the number of skipped uploads and the bytes they would have sent in this run."""
+    with _lock:
+        return _skipped_uploads, _skipped_bytes
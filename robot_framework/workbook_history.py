@@ -0,0 +1,136 @@
+"""This module keeps the history of how long each workbook takes to download, refresh and upload, across runs.
+
+The history gives every workbook its own refresh timeout: the p99 of its recent refresh durations
+times config.REFRESH_TIMEOUT_FACTOR, kept between config.REFRESH_TIMEOUT_FLOOR and config.REFRESH_TIMEOUT.
+A hung workbook that usually takes 30 seconds is then cut off after minutes instead of an hour.
+After a timeout the next timeout of the workbook is doubled, so a workbook that has become slower
+gets room to finish and build a new history.
+
+The scheduler uses the durations and the recorded size of each workbook to estimate its cost,
+and the strategy and estimate of its last inspection (see workbook_inspector) until it has durations.
+"""
+
+import json
+import math
+import os
+import threading
+
+from robot_framework import config
+
+_lock = threading.Lock()
+
+
+def _history_path() -> str:
+    os.makedirs(config.STATE_FOLDER, exist_ok=True)
+    return os.path.join(config.STATE_FOLDER, config.WORKBOOK_HISTORY_FILE)
+
+
+def key(site_url: str, server_relative_path: str) -> str:
+    """Get the history key of a workbook."""
+    return f"{site_url.rstrip('/').lower()}|{server_relative_path.lower()}"
+
+
+def _read() -> dict:
+    try:
+        with open(_history_path(), encoding="utf-8") as history_file:
+            return json.load(history_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write(history: dict) -> None:
+    history_path = _history_path()
+    with open(f"{history_path}.tmp", "w", encoding="utf-8") as history_file:
+        json.dump(history, history_file)
+    os.replace(f"{history_path}.tmp", history_path)
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get a percentile of values with the nearest-rank method."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * percent / 100))
+    return ordered[rank - 1]
+
+
+def read_history() -> dict:
+    """Get the whole history: key() -> {"refresh": [...], "download": [...], "upload": [...], "bytes": int, ...}."""
+    with _lock:
+        return _read()
+
+
+def refresh_durations(site_url: str, server_relative_path: str) -> list[float]:
+    """Get the recorded refresh durations of a workbook in seconds, oldest first."""
+    with _lock:
+        return list(_read().get(key(site_url, server_relative_path), {}).get("refresh", []))
+
+
+def refresh_timeout(site_url: str, server_relative_path: str) -> float:
+    """Get the refresh timeout of a workbook in seconds.
+
+    Args:
+        site_url: The url of the SharePoint site.
+        server_relative_path: The path of the workbook on the site.
+
+    Returns:
+        float: config.REFRESH_TIMEOUT until the workbook has config.REFRESH_HISTORY_MIN_SAMPLES durations,
+            then the adaptive timeout, and at least double the last timeout if the last refresh timed out.
+    """
+    with _lock:
+        entry = _read().get(key(site_url, server_relative_path), {})
+
+    durations = entry.get("refresh", [])
+    if len(durations) < config.REFRESH_HISTORY_MIN_SAMPLES:
+        timeout = config.REFRESH_TIMEOUT
+    else:
+        timeout = percentile(durations, 99) * config.REFRESH_TIMEOUT_FACTOR
+        timeout = min(max(timeout, config.REFRESH_TIMEOUT_FLOOR), config.REFRESH_TIMEOUT)
+
+    if entry.get("timed_out_after"):
+        timeout = min(max(timeout, entry["timed_out_after"] * 2), config.REFRESH_TIMEOUT)
+    return timeout
+
+
+def record_refresh(site_url: str, server_relative_path: str, seconds: float) -> None:
+    """Record the duration of a successful refresh, keeping the last config.REFRESH_HISTORY_SIZE durations."""
+    with _lock:
+        history = _read()
+        entry = history.setdefault(key(site_url, server_relative_path), {})
+        entry["refresh"] = (entry.get("refresh", []) + [round(seconds, 3)])[-config.REFRESH_HISTORY_SIZE:]
+        entry.pop("timed_out_after", None)
+        _write(history)
+
+
+def record_transfer(site_url: str, server_relative_path: str, stage: str, seconds: float, size: int) -> None:
+    """Record the duration of a successful download or upload and the size of the workbook.
+
+    Args:
+        site_url: The url of the SharePoint site.
+        server_relative_path: The path of the workbook on the site.
+        stage: "download" or "upload".
+        seconds: The duration of the transfer.
+        size: The size of the workbook in bytes.
+    """
+    with _lock:
+        history = _read()
+        entry = history.setdefault(key(site_url, server_relative_path), {})
+        entry[stage] = (entry.get(stage, []) + [round(seconds, 3)])[-config.REFRESH_HISTORY_SIZE:]
+        entry["bytes"] = size
+        _write(history)
+
+
+def record_inspection(site_url: str, server_relative_path: str, strategy: str, estimate: float) -> None:
+    """Record the refresh strategy chosen for a workbook and its estimated refresh seconds."""
+    with _lock:
+        history = _read()
+        entry = history.setdefault(key(site_url, server_relative_path), {})
+        entry["strategy"] = strategy
+        entry["estimate"] = round(estimate, 3)
+        _write(history)
+
+
+def record_timeout(site_url: str, server_relative_path: str, timeout: float) -> None:
+    """Record that a refresh was cut off after timeout seconds."""
+    with _lock:
+        history = _read()
+        history.setdefault(key(site_url, server_relative_path), {})["timed_out_after"] = timeout
+        _write(history)
@@ -0,0 +1,116 @@
+"""This module inspects a downloaded workbook without Excel to choose how it is refreshed.
+
+The structure read by xlsx_parts decides the strategy:
+- SKIP when the workbook has no connections, query tables, pivot caches, external links or data model.
+  Excel isn't opened, so the workbook is unchanged and its upload is skipped as well.
+- PLANNED when pivot caches are filled from connections, directly or through query tables. The workbook
+  is refreshed in dependency order through refresh_planner, like a VeryRefreshed workbook, so the pivots
+  are refreshed after their data.
+- REFRESH_ALL otherwise, with a single RefreshAll.
+
+The nodes the plan would refresh and the size of the parts also give an estimate of the refresh,
+which is kept in the workbook history for the scheduler until the workbook has refresh durations.
+"""
+
+import zipfile
+from dataclasses import dataclass, field
+from xml.etree import ElementTree
+
+from robot_framework import config
+from robot_framework import refresh_backend
+from robot_framework import refresh_planner
+from robot_framework import xlsx_parts
+
+SKIP = "skip"
+REFRESH_ALL = "refresh_all"
+PLANNED = "planned"
+
+# Parts that make Excel fetch data from outside the workbook without a connection
+_LINKED_PART_PREFIXES = ("xl/externalLinks/", "xl/model/")
+
+# Number of the largest parts listed in the description
+_LARGEST_PART_COUNT = 3
+
+
+class InspectionError(Exception):
+    """Raised when a workbook can't be inspected, e.g. because it isn't an xlsx file."""
+
+
+@dataclass
+class Inspection:
+    """The strategy chosen for a workbook and what it was chosen from.
+
+    Attributes:
+        strategy: SKIP, REFRESH_ALL or PLANNED.
+        reason: Why the strategy was chosen, for the log.
+        node_counts: The number of refreshable nodes of each kind.
+        estimate: Estimated seconds of the refresh.
+        largest_parts: The largest parts and their uncompressed sizes, largest first.
+        structure: The structure of the workbook.
+    """
+    strategy: str
+    reason: str
+    node_counts: dict[str, int]
+    estimate: float
+    largest_parts: list[tuple[str, int]] = field(default_factory=list)
+    structure: xlsx_parts.WorkbookStructure | None = None
+
+    def describe(self) -> str:
+        """Describe the inspection in a single line for the log."""
+        nodes = ", ".join(f"{count} {kind}" for kind, count in self.node_counts.items() if count) or "no refreshable nodes"
+        parts = ", ".join(f"{part} {size / 1024 / 1024:.1f} MB" for part, size in self.largest_parts)
+        return f"Strategy {self.strategy}: {self.reason}. {nodes}; estimated {self.estimate:.0f}s; largest parts {parts}."
+
+
+def inspect(file_path: str) -> Inspection:
+    """Inspect a workbook and choose its refresh strategy.
+
+    Args:
+        file_path: The path of the xlsx workbook.
+
+    Returns:
+        Inspection: The strategy and the estimated cost of the refresh.
+
+    Raises:
+        InspectionError: If the workbook isn't a readable xlsx file, e.g. an xls workbook.
+    """
+    try:
+        structure = xlsx_parts.read_structure(file_path)
+    except (zipfile.BadZipFile, ElementTree.ParseError, KeyError) as e:
+        raise InspectionError(f"{file_path} could not be inspected: {e}") from e
+    nodes = refresh_backend.structure_nodes(structure)
+    node_counts = {kind: 0 for kind in (refresh_planner.CONNECTION, refresh_planner.QUERY_TABLE, refresh_planner.PIVOT_CACHE, refresh_planner.PIVOT_TABLE)}
+    for node in nodes:
+        node_counts[node.kind] += 1
+
+    linked_parts = [part for part in structure.part_sizes if part.startswith(_LINKED_PART_PREFIXES)]
+    if not nodes and not linked_parts:
+        strategy, reason = SKIP, "nothing to refresh"
+    elif _pivots_on_connections(structure):
+        strategy, reason = PLANNED, "pivot caches are filled from connections"
+    else:
+        strategy, reason = REFRESH_ALL, "no pivot caches depend on connections"
+
+    return Inspection(
+        strategy=strategy,
+        reason=reason,
+        node_counts=node_counts,
+        estimate=0.0 if strategy == SKIP else _estimate(structure, nodes),
+        largest_parts=sorted(structure.part_sizes.items(), key=lambda item: item[1], reverse=True)[:_LARGEST_PART_COUNT],
+        structure=structure,
+    )
+
+
+def _pivots_on_connections(structure: xlsx_parts.WorkbookStructure) -> bool:
+    """Check if a pivot cache reads a connection, or the table or sheet of a query table."""
+    return any(structure.reads_connection(pivot_cache) for pivot_cache in structure.pivot_caches)
+
+
+def _estimate(structure: xlsx_parts.WorkbookStructure, nodes: list[refresh_planner.RefreshNode]) -> float:
+    """Estimate the seconds of a refresh from the nodes the plan refreshes and the size of the parts."""
+    try:
+        refreshed = [node for stage in refresh_planner.build_plan(nodes).stages for node in stage]
+    except refresh_planner.RefreshPlanError:
+        refreshed = nodes
+    seconds = sum(config.INSPECTION_NODE_SECONDS.get(node.kind, 0) for node in refreshed)
+    return seconds + sum(structure.part_sizes.values()) / 1024 / 1024 * config.INSPECTION_SECONDS_PER_MB
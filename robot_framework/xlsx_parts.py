@@ -0,0 +1,302 @@
+"""This module reads the structure of an xlsx workbook directly from its zip parts without Excel.
+
+Only the small parts describing connections, query tables, tables, pivot caches and pivot tables
+are parsed, and pivot cache definitions only up to their source. Worksheets and pivot cache records
+are never loaded, so large workbooks are cheap to read.
+"""
+
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass, field
+from xml.etree import ElementTree
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIP_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIP_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# The 'type' attribute of a connection in xl/connections.xml
+CONNECTION_TYPES = {
+    "1": "ODBC",
+    "2": "DAO",
+    "3": "file",
+    "4": "web",
+    "5": "OLEDB",
+    "6": "text",
+    "7": "ADO",
+    "8": "DSP",
+}
+
+_CELL_REFERENCE = re.compile(r"[A-Z]+(\d+)")
+
+
+@dataclass
+class Connection:
+    """A connection in xl/connections.xml."""
+    id: str
+    name: str
+    type: str
+    background: bool
+    refresh_on_load: bool
+    in_model: bool
+    is_model: bool
+    command: str | None
+    connection_string: str | None
+    # The commandType of the connection, e.g. "2" for SQL and "3" for a table
+    command_type: str | None = None
+
+    @property
+    def key(self) -> str:
+        """The key of the connection's refresh node, see refresh_planner."""
+        return f"connection:{self.name}"
+
+
+@dataclass
+class QueryTable:
+    """A query table and the table (ListObject) it fills."""
+    part: str
+    name: str
+    connection_id: str
+    table_name: str | None = None
+    sheet: str | None = None
+    # Data rows of the table. Excel keeps one empty row in a table without data
+    row_count: int | None = None
+
+    @property
+    def key(self) -> str:
+        """The key of the query table's refresh node, see refresh_planner."""
+        return f"query table:{self.sheet}!{self.table_name or self.name}"
+
+
+@dataclass
+class PivotCache:
+    """A pivot cache definition."""
+    part: str
+    connection_id: str | None
+    source_sheet: str | None
+    source_ref: str | None
+    source_name: str | None
+    refreshed_date: str | None
+    record_count: int | None
+    # Excel marks a pivot cache invalid when it has to be refreshed before it can be used
+    invalid: bool = False
+    # False when the pivot cache has enableRefresh="0" and Excel never refreshes it
+    refresh_enabled: bool = True
+    # The 1-based position in xl/workbook.xml, which is the Index of the pivot cache in Excel
+    index: int | None = None
+
+    @property
+    def key(self) -> str:
+        """The key of the pivot cache's refresh node, see refresh_planner. Uses the index like Excel when it's known."""
+        return f"pivot cache:{self.index or self.part}"
+
+
+@dataclass
+class PivotTable:
+    """A pivot table and the pivot cache it is based on."""
+    part: str
+    name: str
+    cache_part: str | None
+    sheet: str | None = None
+
+
+@dataclass
+class WorkbookStructure:
+    """The refreshable structure of a workbook."""
+    connections: list[Connection] = field(default_factory=list)
+    query_tables: list[QueryTable] = field(default_factory=list)
+    pivot_caches: list[PivotCache] = field(default_factory=list)
+    pivot_tables: list[PivotTable] = field(default_factory=list)
+    # Uncompressed size of every part
+    part_sizes: dict[str, int] = field(default_factory=dict)
+
+    def connection_name(self, connection_id: str | None) -> str | None:
+        """Get the name of a connection from its id."""
+        for connection in self.connections:
+            if connection.id == connection_id:
+                return connection.name
+        return None
+
+    def reads_connection(self, pivot_cache: PivotCache) -> bool:
+        """Check if a pivot cache reads a connection, or the table or sheet of a query table."""
+        if pivot_cache.connection_id:
+            return True
+        query_sources = {query_table.table_name for query_table in self.query_tables} | {query_table.sheet for query_table in self.query_tables}
+        return bool({pivot_cache.source_name, pivot_cache.source_sheet} & (query_sources - {None}))
+
+
+def read_structure(file_path: str) -> WorkbookStructure:
+    """Read the refreshable structure of an xlsx workbook.
+
+    Args:
+        file_path: The path of the workbook.
+
+    Returns:
+        WorkbookStructure: The connections, query tables, pivot caches and pivot tables of the workbook.
+    """
+    structure = WorkbookStructure()
+    with zipfile.ZipFile(file_path) as archive:
+        names = set(archive.namelist())
+        structure.part_sizes = {info.filename: info.file_size for info in archive.infolist()}
+
+        if "xl/connections.xml" in names:
+            structure.connections = _read_connections(archive)
+
+        sheet_of_part = _read_sheet_parts(archive, names)
+        table_names = {}
+        table_rows = {}
+        for part in names:
+            if part.startswith("xl/tables/") and part.endswith(".xml"):
+                root = _parse(archive, part)
+                table_names[part] = root.get("displayName") or root.get("name")
+                table_rows[part] = _data_rows(root)
+
+        # Query tables are linked from the table they fill
+        query_table_table = {}
+        for table_part in table_names:
+            for target in _relationship_targets(archive, names, table_part).values():
+                query_table_table[target] = table_part
+
+        for part in sorted(names):
+            if part.startswith("xl/queryTables/") and part.endswith(".xml"):
+                root = _parse(archive, part)
+                table_part = query_table_table.get(part)
+                structure.query_tables.append(QueryTable(
+                    part=part,
+                    name=root.get("name", ""),
+                    connection_id=root.get("connectionId", ""),
+                    table_name=table_names.get(table_part),
+                    sheet=sheet_of_part.get(table_part),
+                    row_count=table_rows.get(table_part),
+                ))
+
+            elif part.startswith("xl/pivotCache/pivotCacheDefinition") and part.endswith(".xml"):
+                structure.pivot_caches.append(_read_pivot_cache(archive, part))
+
+            elif part.startswith("xl/pivotTables/") and part.endswith(".xml"):
+                root = _parse(archive, part)
+                cache_parts = list(_relationship_targets(archive, names, part).values())
+                structure.pivot_tables.append(PivotTable(
+                    part=part,
+                    name=root.get("name", ""),
+                    cache_part=cache_parts[0] if cache_parts else None,
+                    sheet=sheet_of_part.get(part),
+                ))
+
+        cache_indexes = _read_pivot_cache_indexes(archive, names)
+        for pivot_cache in structure.pivot_caches:
+            pivot_cache.index = cache_indexes.get(pivot_cache.part)
+
+    return structure
+
+
+def _read_connections(archive: zipfile.ZipFile) -> list[Connection]:
+    connections = []
+    for element in _parse(archive, "xl/connections.xml").iter(f"{{{MAIN_NS}}}connection"):
+        db_pr = element.find(f"{{{MAIN_NS}}}dbPr")
+        # Connections to and from the data model are flagged with model="1" in an extension element
+        in_model = any(child.get("model") in ("1", "true") for child in element.iter() if child is not element)
+        is_model = db_pr is not None and db_pr.get("connection") == "Data Model Connection"
+        connections.append(Connection(
+            id=element.get("id", ""),
+            name=element.get("name", ""),
+            type=CONNECTION_TYPES.get(element.get("type", ""), element.get("type", "")),
+            background=element.get("background") in ("1", "true"),
+            refresh_on_load=element.get("refreshOnLoad") in ("1", "true"),
+            in_model=in_model and not is_model,
+            is_model=is_model,
+            command=db_pr.get("command") if db_pr is not None else None,
+            connection_string=db_pr.get("connection") if db_pr is not None else None,
+            command_type=db_pr.get("commandType") if db_pr is not None else None,
+        ))
+    return connections
+
+
+def _read_pivot_cache(archive: zipfile.ZipFile, part: str) -> PivotCache:
+    # The cache fields with their shared items follow cacheSource and can be large, so they aren't read
+    root = cache_source = None
+    with archive.open(part) as part_file:
+        for event, element in ElementTree.iterparse(part_file, events=("start", "end")):
+            if root is None:
+                root = element
+            elif event == "end" and element.tag == f"{{{MAIN_NS}}}cacheSource":
+                cache_source = element
+                break
+    worksheet_source = cache_source.find(f"{{{MAIN_NS}}}worksheetSource") if cache_source is not None else None
+    record_count = root.get("recordCount")
+    return PivotCache(
+        part=part,
+        connection_id=cache_source.get("connectionId") if cache_source is not None else None,
+        source_sheet=worksheet_source.get("sheet") if worksheet_source is not None else None,
+        source_ref=worksheet_source.get("ref") if worksheet_source is not None else None,
+        source_name=worksheet_source.get("name") if worksheet_source is not None else None,
+        refreshed_date=root.get("refreshedDate"),
+        record_count=int(record_count) if record_count is not None else None,
+        invalid=root.get("invalid") in ("1", "true"),
+        refresh_enabled=root.get("enableRefresh") not in ("0", "false"),
+    )
+
+
+def _data_rows(table: ElementTree.Element) -> int | None:
+    """Count the data rows of a table from its range, without the header and totals rows."""
+    rows = [int(row) for row in _CELL_REFERENCE.findall(table.get("ref", ""))]
+    if len(rows) != 2:
+        return None
+    header_rows = int(table.get("headerRowCount", "1"))
+    totals_rows = int(table.get("totalsRowCount", "0"))
+    return max(rows[1] - rows[0] + 1 - header_rows - totals_rows, 0)
+
+
+def _read_pivot_cache_indexes(archive: zipfile.ZipFile, names: set[str]) -> dict[str, int]:
+    """Map the pivot cache definition parts to their 1-based position in xl/workbook.xml."""
+    if "xl/workbook.xml" not in names:
+        return {}
+
+    workbook_targets = _relationship_targets(archive, names, "xl/workbook.xml")
+    indexes = {}
+    for index, pivot_cache in enumerate(_parse(archive, "xl/workbook.xml").iter(f"{{{MAIN_NS}}}pivotCache"), start=1):
+        part = workbook_targets.get(pivot_cache.get(f"{{{RELATIONSHIP_NS}}}id"))
+        if part:
+            indexes[part] = index
+    return indexes
+
+
+def _read_sheet_parts(archive: zipfile.ZipFile, names: set[str]) -> dict[str, str]:
+    """Map the table and pivot table parts of each worksheet to the worksheet's name."""
+    if "xl/workbook.xml" not in names:
+        return {}
+
+    workbook_targets = _relationship_targets(archive, names, "xl/workbook.xml")
+    sheet_of_part = {}
+    for sheet in _parse(archive, "xl/workbook.xml").iter(f"{{{MAIN_NS}}}sheet"):
+        sheet_part = workbook_targets.get(sheet.get(f"{{{RELATIONSHIP_NS}}}id"))
+        if not sheet_part:
+            continue
+        for target in _relationship_targets(archive, names, sheet_part).values():
+            sheet_of_part[target] = sheet.get("name")
+    return sheet_of_part
+
+
+def _relationship_targets(archive: zipfile.ZipFile, names: set[str], part: str) -> dict[str, str]:
+    """Get the internal relationship targets of a part as absolute part names keyed on relationship id."""
+    folder, file_name = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", f"{file_name}.rels")
+    if rels_part not in names:
+        return {}
+
+    targets = {}
+    for relationship in _parse(archive, rels_part).iter(f"{{{PACKAGE_RELATIONSHIP_NS}}}Relationship"):
+        if relationship.get("TargetMode") == "External":
+            continue
+        target = relationship.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        targets[relationship.get("Id")] = target
+    return targets
+
+
+def _parse(archive: zipfile.ZipFile, part: str) -> ElementTree.Element:
+    with archive.open(part) as part_file:
+        return ElementTree.parse(part_file).getroot()
@@ -0,0 +1,112 @@
+"""Tests of how the parent side of an Excel worker handles a worker that dies, hangs or is sick."""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from benchmark.workbooks import create_workbook
+from robot_framework import config, excel_pool, refresh_backend
+
+
+class _CrashingStartBackend(refresh_backend.SimulatedRefreshBackend):
+    """Dies while starting, without sending anything."""
+
+    def start(self) -> None:
+        """Exit the worker process at once."""
+        os._exit(3)  # pylint: disable=protected-access
+
+
+class _HangingStartBackend(refresh_backend.SimulatedRefreshBackend):
+    """Never finishes starting, like DispatchEx waiting for a stuck Excel."""
+
+    def start(self) -> None:
+        """Sleep for longer than any test."""
+        time.sleep(60)
+
+
+class _CrashingRefreshBackend(refresh_backend.SimulatedRefreshBackend):
+    """Dies while opening a workbook."""
+
+    def open(self, file_path: str) -> None:
+        """Exit the worker process at once."""
+        os._exit(3)  # pylint: disable=protected-access
+
+
+class _SickBackend(refresh_backend.SimulatedRefreshBackend):
+    """Refreshes workbooks but fails to report its health."""
+
+    def is_healthy(self) -> bool:
+        """Fail like OpenProcess on a sick Excel."""
+        raise OSError("Access denied")
+
+
+class ExcelWorkerTest(unittest.TestCase):
+    """ExcelWorker with test backends in a real worker process."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.file_path = os.path.join(folder.name, "Rapport.xlsx")
+        create_workbook(self.file_path, 0)
+        patches = [
+            mock.patch.dict(refresh_backend.BACKENDS, {
+                "crashing start": _CrashingStartBackend,
+                "hanging start": _HangingStartBackend,
+                "crashing refresh": _CrashingRefreshBackend,
+                "sick": _SickBackend,
+            }),
+            mock.patch.object(config, "STATE_FOLDER", os.path.join(folder.name, "state")),
+            mock.patch.object(config, "SIMULATED_LATENCY", {}),
+            mock.patch.object(config, "SIMULATED_SECONDS_PER_MB", 0),
+            mock.patch.object(config, "EXCEL_START_TIMEOUT", 2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def worker(self, backend_name: str) -> excel_pool.ExcelWorker:
+        """Start a worker that is stopped after the test."""
+        worker = excel_pool.ExcelWorker(backend_name)
+        self.addCleanup(worker.stop)
+        return worker
+
+    def test_worker_dying_at_start_fails_fast(self):
+        """A worker that dies before Excel has started raises instead of blocking the pool."""
+        started = time.monotonic()
+        with self.assertRaises(excel_pool.ExcelWorkerError):
+            self.worker("crashing start")
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_hanging_start_times_out(self):
+        """A worker whose Excel doesn't start is killed after config.EXCEL_START_TIMEOUT."""
+        started = time.monotonic()
+        with self.assertRaises(excel_pool.ExcelWorkerError):
+            self.worker("hanging start")
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_worker_dying_during_refresh_fails_fast(self):
+        """A worker that dies during a refresh is reported at once, not after the refresh timeout."""
+        worker = self.worker("crashing refresh")
+
+        started = time.monotonic()
+        with self.assertRaises(excel_pool.ExcelWorkerError):
+            worker.refresh(self.file_path, pivot=False, timeout=60)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertFalse(worker.healthy)
+
+    def test_failing_health_check_still_answers(self):
+        """A worker whose health can't be read answers as unhealthy, so it's recycled."""
+        worker = self.worker("sick")
+
+        result = worker.refresh(self.file_path, pivot=False, timeout=60)
+
+        self.assertIsInstance(result, refresh_backend.RefreshResult)
+        self.assertFalse(worker.healthy)
+        self.assertEqual(worker.memory_usage, 0)
+        self.assertTrue(worker.needs_recycling())
+
+
+if __name__ == "__main__":
+    unittest.main()
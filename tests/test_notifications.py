@@ -0,0 +1,95 @@
+"""Tests of the delivery futures and failure handling of the notification dispatcher."""
+
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmark.smtp_server import SmtpServer
+from robot_framework import config, notifications
+
+
+def _notification(**kwargs) -> notifications.Notification:
+    return notifications.Notification(sender="robot@localhost", to="someone@localhost", subject="Test", html="<p>Test</p>", **kwargs)
+
+
+def _closed_port() -> int:
+    """Get a local port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class DispatcherTest(unittest.TestCase):
+    """Dispatcher with a local SMTP server."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.smtp_server = SmtpServer(os.path.join(folder.name, "mail"))
+        self.smtp_server.start()
+        self.addCleanup(self.smtp_server.stop)
+        patches = [
+            mock.patch.object(config, "SMTP_SERVER", "127.0.0.1"),
+            mock.patch.object(config, "SMTP_PORT", self.smtp_server.port),
+            mock.patch.object(config, "NOTIFICATION_SEND_ATTEMPTS", 1),
+            mock.patch.object(config, "NOTIFICATION_TIMEOUT", 5),
+            mock.patch.object(config, "NOTIFICATION_DIGEST", False),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.dispatcher = notifications.Dispatcher()
+        self.addCleanup(self.dispatcher.close)
+
+    def test_delivery_is_confirmed(self):
+        """The future of a sent mail is done without an error."""
+        delivered = self.dispatcher.notify(_notification())
+
+        self.assertIsNone(delivered.result(timeout=5))
+        self.assertEqual(self.smtp_server.mail_count, 1)
+
+    def test_failed_delivery_is_raised(self):
+        """The future of a mail that couldn't be sent fails and the error is logged."""
+        errors = []
+        with mock.patch.object(config, "SMTP_PORT", _closed_port()):
+            delivered = self.dispatcher.notify(_notification(log_error=errors.append))
+
+            with self.assertRaises(notifications.NotificationError):
+                delivered.result(timeout=5)
+        self.assertEqual(len(errors), 1)
+
+    def test_unexpected_error_keeps_dispatcher_running(self):
+        """An error other than an SMTP error fails the mail but not the dispatcher."""
+        with mock.patch.object(notifications, "_send", side_effect=ValueError("bad address")):
+            delivered = self.dispatcher.notify(_notification())
+            with self.assertRaises(notifications.NotificationError):
+                delivered.result(timeout=5)
+
+        self.assertTrue(self.dispatcher.is_alive())
+        self.assertIsNone(self.dispatcher.notify(_notification()).result(timeout=5))
+
+    def test_stopped_dispatcher_raises(self):
+        """notify and flush raise instead of waiting for a dispatcher that has stopped."""
+        self.dispatcher.close()
+
+        with self.assertRaises(notifications.NotificationError):
+            self.dispatcher.notify(_notification())
+        with self.assertRaises(notifications.NotificationError):
+            self.dispatcher.flush()
+
+    def test_digest_is_delivered_on_flush(self):
+        """Held notifications are sent as one mail by flush, and each of their futures is done."""
+        with mock.patch.object(config, "NOTIFICATION_DIGEST", True):
+            futures = [self.dispatcher.notify(_notification(digest_key="test")) for _ in range(3)]
+            self.assertFalse(any(future.done() for future in futures))
+
+            self.dispatcher.flush()
+
+        self.assertTrue(all(future.done() and future.exception() is None for future in futures))
+        self.assertEqual(self.smtp_server.mail_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Tests of downloading workbooks through the local workbook cache in process."""
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from benchmark.workbooks import create_workbook
+from robot_framework import config, process, sharepoint_transfer
+
+SITE = "https://tenant/sites/a"
+REPORT = "Delte dokumenter/Rapport.xlsx"
+
+
+class DownloadCacheTest(unittest.TestCase):
+    """download_file_from_sharepoint with the transfers mocked."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.work_dir = os.path.join(folder.name, "work")
+        os.makedirs(self.work_dir)
+        self.client = SimpleNamespace(base_url=SITE)
+        self.orchestrator_connection = SimpleNamespace(log_info=lambda message: None)
+        self.etag = '"{1},1"'
+
+        def download_file(_client, _metadata, download_path, _log):
+            create_workbook(download_path, 0)
+            return "sha256"
+
+        patches = [
+            mock.patch.object(config, "STATE_FOLDER", os.path.join(folder.name, "state")),
+            mock.patch.object(config, "WORKBOOK_CACHE_ENABLED", True),
+            mock.patch.object(sharepoint_transfer, "get_file_metadata", lambda client, url: {"ETag": self.etag, "Length": 1}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        download_patch = mock.patch.object(sharepoint_transfer, "download_file", side_effect=download_file)
+        self.download_file = download_patch.start()
+        self.addCleanup(download_patch.stop)
+
+    def download(self) -> str:
+        """Download the report and remove the local copy like upload_file_to_sharepoint does."""
+        download_path = process.download_file_from_sharepoint(self.client, REPORT, self.orchestrator_connection, self.work_dir)
+        os.remove(download_path)
+        return download_path
+
+    def test_unchanged_workbook_is_not_downloaded_again(self):
+        """A workbook that wasn't uploaded, e.g. because its refresh changed nothing, comes from the cache the next time."""
+        self.download()
+        self.download()
+
+        self.assertEqual(self.download_file.call_count, 1)
+
+    def test_changed_workbook_is_downloaded_again(self):
+        """A new ETag on SharePoint bypasses the cached copy."""
+        self.download()
+        self.etag = '"{1},2"'
+        self.download()
+
+        self.assertEqual(self.download_file.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Tests of claiming QueueExcelRefresher rows in queue_source, against the SQLite table of the benchmark."""
+
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from benchmark.queue_store import BenchmarkOrchestrator, QueueTable
+from robot_framework import config, queue_source
+
+
+class ClaimTest(unittest.TestCase):
+    """enqueue_due_rows with a small claim batch."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.folder.cleanup)
+        self.table = QueueTable(os.path.join(self.folder.name, "queue.db"))
+        self.orchestrator = BenchmarkOrchestrator(config.QUEUE_NAME, os.path.join(self.folder.name, "robot.log"), {"SqlServer": "test"}, {})
+        self.addCleanup(self.orchestrator.close)
+
+        patches = [
+            mock.patch.object(queue_source, "pyodbc", SimpleNamespace(connect=self.table.connect)),
+            mock.patch.object(config, "CLAIM_BATCH_SIZE", 2),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(queue_source.close_connection)
+
+    def queued_data(self) -> list[dict]:
+        """Get the data of the queued elements."""
+        return [json.loads(queue_element.data) for queue_element in self.orchestrator.get_queue_elements(config.QUEUE_NAME)]
+
+    def test_rows_are_claimed_once(self):
+        """Claiming again doesn't queue rows that were already claimed."""
+        self.table.add_rows([("https://tenant/sites/a", f"Delte dokumenter/{i}.xlsx", None) for i in range(5)])
+
+        self.assertEqual(queue_source.enqueue_due_rows(self.orchestrator), 5)
+        self.assertEqual(queue_source.enqueue_due_rows(self.orchestrator), 0)
+
+        folder_paths = [data["FolderPath"] for data in self.queued_data()]
+        self.assertEqual(sorted(folder_paths), [f"Delte dokumenter/{i}.xlsx" for i in range(5)])
+
+    def test_failed_enqueue_leaves_rows_due(self):
+        """A batch that couldn't be queued is rolled back and claimed by the next call."""
+        self.table.add_rows([("https://tenant/sites/a", f"Delte dokumenter/{i}.xlsx", None) for i in range(3)])
+
+        with mock.patch.object(self.orchestrator, "bulk_create_queue_elements", side_effect=RuntimeError("queue unavailable")):
+            with self.assertRaises(RuntimeError):
+                queue_source.enqueue_due_rows(self.orchestrator)
+
+        self.assertEqual(queue_source.enqueue_due_rows(self.orchestrator), 3)
+        self.assertEqual(len(self.queued_data()), 3)
+
+    def test_references_are_qualified_by_site(self):
+        """The same FolderPath on two sites gets two references."""
+        self.table.add_rows([
+            ("https://tenant/sites/a", "Delte dokumenter/Rapport.xlsx", None),
+            ("https://tenant/sites/b", "Delte dokumenter/Rapport.xlsx", None),
+        ])
+
+        queue_source.enqueue_due_rows(self.orchestrator)
+
+        references = {queue_element.reference for queue_element in self.orchestrator.get_queue_elements(config.QUEUE_NAME)}
+        self.assertEqual(references, {
+            queue_source.reference("https://tenant/sites/a", "Delte dokumenter/Rapport.xlsx"),
+            queue_source.reference("https://tenant/sites/b", "Delte dokumenter/Rapport.xlsx"),
+        })
+        self.assertEqual(len(references), 2)
+
+
+class ReferenceTest(unittest.TestCase):
+    """queue_source.reference."""
+
+    def test_same_workbook_gets_same_reference(self):
+        """The site is compared like workbook_history.key does."""
+        self.assertEqual(
+            queue_source.reference("https://tenant/sites/a/", "Delte dokumenter/Rapport.xlsx"),
+            queue_source.reference("https://TENANT/sites/a", "Delte dokumenter/Rapport.xlsx"),
+        )
+
+    def test_reference_fits_in_orchestrator(self):
+        """A long FolderPath is cut off after the hash."""
+        reference = queue_source.reference("https://tenant/sites/a", "Delte dokumenter/" + "x" * 200 + ".xlsx")
+        self.assertLessEqual(len(reference), 100)
+        self.assertIn(":Delte dokumenter/", reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests of ordering and skipping refresh nodes in refresh_planner.build_plan."""
+
+import unittest
+
+from robot_framework.refresh_planner import CONNECTION, PIVOT_CACHE, PIVOT_TABLE, QUERY_TABLE, RefreshNode, RefreshPlanError, build_plan
+
+
+def _workbook() -> list[RefreshNode]:
+    """Nodes of a workbook where a connection fills a query table that a pivot cache reads, and a second connection fills a pivot cache directly."""
+    return [
+        RefreshNode("connection:Sales", CONNECTION, "Sales"),
+        RefreshNode("query table:Data!Sales", QUERY_TABLE, "Sales", depends_on=["connection:Sales"], covered_by="connection:Sales"),
+        RefreshNode("pivot cache:1", PIVOT_CACHE, "#1", depends_on=["query table:Data!Sales"]),
+        RefreshNode("pivot table:Pivot!Sales", PIVOT_TABLE, "Sales", depends_on=["pivot cache:1"], covered_by="pivot cache:1"),
+        RefreshNode("connection:Budget", CONNECTION, "Budget"),
+        RefreshNode("pivot cache:2", PIVOT_CACHE, "#2", depends_on=["connection:Budget"], covered_by="connection:Budget"),
+        RefreshNode("pivot table:Pivot!Budget", PIVOT_TABLE, "Budget", depends_on=["pivot cache:2"], covered_by="pivot cache:2"),
+    ]
+
+
+def _keys(stages: list[list[RefreshNode]]) -> list[set[str]]:
+    return [{node.key for node in stage} for stage in stages]
+
+
+class BuildPlanTest(unittest.TestCase):
+    """build_plan."""
+
+    def test_covered_nodes_are_refreshed_once(self):
+        """Nodes refreshed by the node covering them aren't planned again."""
+        plan = build_plan(_workbook())
+
+        planned = [node.key for stage in plan.stages for node in stage]
+        self.assertCountEqual(planned, ["connection:Sales", "pivot cache:1", "connection:Budget"])
+        self.assertCountEqual(
+            [node.key for node, _ in plan.skipped],
+            ["query table:Data!Sales", "pivot table:Pivot!Sales", "pivot cache:2", "pivot table:Pivot!Budget"],
+        )
+        self.assertEqual(plan.not_refreshed, frozenset())
+
+    def test_stages_follow_dependencies(self):
+        """A pivot cache reading a query table is refreshed in a stage after the connection filling it."""
+        plan = build_plan(_workbook())
+
+        self.assertEqual(_keys(plan.stages), [{"connection:Sales", "connection:Budget"}, {"pivot cache:1"}])
+
+    def test_dependency_chain_gets_a_stage_per_step(self):
+        """Each node of a chain of uncovered dependencies gets its own stage."""
+        nodes = [
+            RefreshNode("pivot cache:2", PIVOT_CACHE, "#2", depends_on=["pivot cache:1"]),
+            RefreshNode("pivot cache:1", PIVOT_CACHE, "#1", depends_on=["connection:Sales"]),
+            RefreshNode("connection:Sales", CONNECTION, "Sales"),
+        ]
+
+        plan = build_plan(nodes)
+
+        self.assertEqual(_keys(plan.stages), [{"connection:Sales"}, {"pivot cache:1"}, {"pivot cache:2"}])
+
+    def test_cycle_raises(self):
+        """Nodes depending on each other can't be ordered."""
+        nodes = [
+            RefreshNode("pivot cache:1", PIVOT_CACHE, "#1", depends_on=["pivot cache:2"]),
+            RefreshNode("pivot cache:2", PIVOT_CACHE, "#2", depends_on=["pivot cache:1"]),
+        ]
+
+        with self.assertRaises(RefreshPlanError):
+            build_plan(nodes)
+
+    def test_unchanged_connection_is_not_refreshed(self):
+        """An unchanged connection is skipped with everything that only reads it, including covered nodes."""
+        plan = build_plan(_workbook(), unchanged=frozenset({"connection:Sales"}))
+
+        self.assertEqual(_keys(plan.stages), [{"connection:Budget"}])
+        self.assertEqual(plan.not_refreshed, frozenset({
+            "connection:Sales", "query table:Data!Sales", "pivot cache:1", "pivot table:Pivot!Sales",
+        }))
+
+    def test_node_with_a_changed_source_is_refreshed(self):
+        """A node reading both an unchanged and a changed connection is still refreshed."""
+        nodes = [
+            RefreshNode("connection:Sales", CONNECTION, "Sales"),
+            RefreshNode("connection:Budget", CONNECTION, "Budget"),
+            RefreshNode("pivot cache:1", PIVOT_CACHE, "#1", depends_on=["connection:Sales", "connection:Budget"]),
+        ]
+
+        plan = build_plan(nodes, unchanged=frozenset({"connection:Sales"}))
+
+        self.assertEqual(_keys(plan.stages), [{"connection:Budget"}, {"pivot cache:1"}])
+        self.assertEqual(plan.not_refreshed, frozenset({"connection:Sales"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
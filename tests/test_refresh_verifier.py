@@ -0,0 +1,174 @@
+"""Tests of verifying the saved parts of a refreshed workbook in refresh_verifier and choosing a strategy in workbook_inspector."""
+
+import os
+import tempfile
+import unittest
+import zipfile
+from datetime import datetime
+
+from benchmark.workbooks import MAIN_NS, create_workbook
+from robot_framework import refresh_verifier, workbook_inspector, xlsx_parts
+
+TABLE = "xl/tables/table1.xml"
+PIVOT_CACHE = "xl/pivotCache/pivotCacheDefinition1.xml"
+
+
+def _table(ref: str) -> str:
+    return f'<table xmlns="{MAIN_NS}" id="1" name="Data" displayName="Data" ref="{ref}" tableType="queryTable"/>'
+
+
+def _pivot_cache(refreshed_date: float, invalid: bool = False, attributes: str = "", source: str = 'name="Data"') -> str:
+    invalid_attribute = ' invalid="1"' if invalid else ""
+    return (
+        f'<pivotCacheDefinition xmlns="{MAIN_NS}" refreshedDate="{refreshed_date}" recordCount="1"{invalid_attribute}{attributes}>'
+        f'<cacheSource type="worksheet"><worksheetSource {source}/></cacheSource></pivotCacheDefinition>'
+    )
+
+
+def replace_parts(file_path: str, parts: dict[str, str | None]) -> None:
+    """Write new contents for some parts of a workbook. A part with the contents None is removed."""
+    with zipfile.ZipFile(file_path) as archive:
+        contents = {info.filename: archive.read(info) for info in archive.infolist()}
+    for name, content in parts.items():
+        if content is None:
+            contents.pop(name, None)
+        else:
+            contents[name] = content.encode()
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in contents.items():
+            archive.writestr(name, content)
+
+
+class VerifyTest(unittest.TestCase):
+    """refresh_verifier.verify with the benchmark workbook, whose pivot cache reads a query table."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.file_path = os.path.join(folder.name, "Rapport.xlsx")
+        create_workbook(self.file_path, 0)
+        self.started = datetime.now()
+        replace_parts(self.file_path, {TABLE: _table("A1:B11")})
+        self.before = xlsx_parts.read_structure(self.file_path)
+        self.query_table_key = self.before.query_tables[0].key
+        self.pivot_cache_key = self.before.pivot_caches[0].key
+
+    def save(self, ref: str = "A1:B11", refreshed_date: float | None = None, invalid: bool = False) -> None:
+        """Save the workbook like Excel would after a refresh."""
+        if refreshed_date is None:
+            refreshed_date = refresh_verifier.to_serial_date(datetime.now())
+        replace_parts(self.file_path, {TABLE: _table(ref), PIVOT_CACHE: _pivot_cache(refreshed_date, invalid)})
+
+    def test_refreshed_workbook_passes(self):
+        """A table that kept its rows and a freshly stamped pivot cache have no findings."""
+        self.save()
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, self.before, self.started), [])
+
+    def test_emptied_query_table_fails(self):
+        """A query table that had rows and is left with Excel's one empty row fails."""
+        self.save(ref="A1:B2")
+
+        findings = refresh_verifier.verify(self.file_path, self.before, self.started)
+
+        self.assertEqual([finding.key for finding in findings], [self.query_table_key])
+        self.assertIn("no rows, had 10", findings[0].reason)
+
+    def test_table_that_was_empty_passes(self):
+        """A query table without rows before the refresh may stay empty."""
+        replace_parts(self.file_path, {TABLE: _table("A1:B2")})
+        before = xlsx_parts.read_structure(self.file_path)
+        self.save(ref="A1:B2")
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, before, self.started), [])
+
+    def test_not_refreshed_connection_skips_its_query_table(self):
+        """A query table of a connection that was deliberately not refreshed isn't checked."""
+        self.save(ref="A1:B2")
+        connection_key = self.before.connections[0].key
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, self.before, self.started, frozenset({connection_key})), [])
+
+    def test_invalid_pivot_cache_fails(self):
+        """A pivot cache Excel marked invalid fails even though it was stamped."""
+        self.save(invalid=True)
+
+        findings = refresh_verifier.verify(self.file_path, self.before, self.started)
+
+        self.assertEqual([(finding.key, finding.reason) for finding in findings], [(self.pivot_cache_key, "marked invalid")])
+
+    def test_stale_pivot_cache_fails(self):
+        """A pivot cache whose refreshedDate is before the refresh started fails."""
+        self.save(refreshed_date=45292.5)
+
+        findings = refresh_verifier.verify(self.file_path, self.before, self.started)
+
+        self.assertEqual([finding.key for finding in findings], [self.pivot_cache_key])
+        self.assertIn("2024-01-01 12:00:00", findings[0].reason)
+
+    def test_pivot_cache_with_refresh_disabled_passes(self):
+        """A pivot cache with enableRefresh="0" isn't refreshed by Excel, so its old refreshedDate is fine."""
+        self.save()
+        replace_parts(self.file_path, {PIVOT_CACHE: _pivot_cache(45292.5, attributes=' enableRefresh="0"')})
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, self.before, self.started), [])
+
+    def test_pivot_cache_on_worksheet_range_passes(self):
+        """A pivot cache on a plain worksheet range isn't filled by a connection and isn't checked."""
+        self.save()
+        replace_parts(self.file_path, {PIVOT_CACHE: _pivot_cache(45292.5, source='ref="A1:B5" sheet="Input"')})
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, self.before, self.started), [])
+
+    def test_unchanged_pivot_cache_passes(self):
+        """A pivot cache left unrefreshed because its source was unchanged isn't checked."""
+        self.save(refreshed_date=45292.5)
+
+        self.assertEqual(refresh_verifier.verify(self.file_path, self.before, self.started, frozenset({self.pivot_cache_key})), [])
+
+
+class InspectTest(unittest.TestCase):
+    """workbook_inspector.inspect."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.file_path = os.path.join(folder.name, "Rapport.xlsx")
+        create_workbook(self.file_path, 0)
+
+    def test_pivot_on_query_table_is_planned(self):
+        """A pivot cache reading a query table makes the refresh planned."""
+        self.assertEqual(workbook_inspector.inspect(self.file_path).strategy, workbook_inspector.PLANNED)
+
+    def test_workbook_without_sources_is_skipped(self):
+        """A workbook with nothing to refresh isn't opened in Excel."""
+        replace_parts(self.file_path, {
+            "xl/connections.xml": None,
+            "xl/queryTables/queryTable1.xml": None,
+            "xl/tables/_rels/table1.xml.rels": None,
+            "xl/pivotCache/pivotCacheDefinition1.xml": None,
+            "xl/pivotTables/pivotTable1.xml": None,
+            "xl/pivotTables/_rels/pivotTable1.xml.rels": None,
+            "xl/worksheets/_rels/sheet2.xml.rels": None,
+            "xl/workbook.xml": (
+                f'<workbook xmlns="{MAIN_NS}" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+                '<sheet name="Data" sheetId="1" r:id="rId1"/><sheet name="Pivot" sheetId="2" r:id="rId2"/></sheets></workbook>'
+            ),
+        })
+
+        inspection = workbook_inspector.inspect(self.file_path)
+
+        self.assertEqual(inspection.strategy, workbook_inspector.SKIP)
+        self.assertEqual(inspection.estimate, 0.0)
+
+    def test_not_an_xlsx_file_raises(self):
+        """An xls workbook can't be inspected."""
+        with open(self.file_path, "wb") as file:
+            file.write(b"\xd0\xcf\x11\xe0 not a zip file")
+
+        with self.assertRaises(workbook_inspector.InspectionError):
+            workbook_inspector.inspect(self.file_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Tests of coalescing and claiming queue elements in scheduler."""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from OpenOrchestrator.database.queues import QueueStatus
+
+from benchmark.queue_store import BenchmarkOrchestrator
+from robot_framework import config, queue_source, scheduler
+
+SITE_A = "https://tenant/sites/a"
+SITE_B = "https://tenant/sites/b"
+REPORT = "Delte dokumenter/Rapport.xlsx"
+
+
+class CoalesceTest(unittest.TestCase):
+    """plan and Schedule.next_element with pending elements for the same path."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        patch = mock.patch.object(config, "STATE_FOLDER", os.path.join(folder.name, "state"))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.orchestrator = BenchmarkOrchestrator(config.QUEUE_NAME, os.path.join(folder.name, "robot.log"), {}, {})
+        self.addCleanup(self.orchestrator.close)
+
+    def queue(self, site: str, folder_path: str, custom_function: str | None = None) -> None:
+        """Add an element to the queue like queue_source does."""
+        self.orchestrator.bulk_create_queue_elements(
+            config.QUEUE_NAME,
+            references=(queue_source.reference(site, folder_path),),
+            data=(json.dumps({"SharePointSite": site, "FolderPath": folder_path, "CustomFunction": custom_function}),),
+        )
+
+    def take_all(self, schedule: scheduler.Schedule) -> list:
+        """Take every element of the schedule and finish it as done, like queue_framework does."""
+        taken = []
+        while queue_element := schedule.next_element():
+            taken.append(json.loads(queue_element.data))
+            self.orchestrator.set_queue_element_status(queue_element.id, QueueStatus.DONE)
+            schedule.finish(queue_element, failed=False)
+        return taken
+
+    def test_same_path_on_two_sites_is_not_merged(self):
+        """Each site's workbook is refreshed with its own custom function."""
+        self.queue(SITE_A, REPORT, "MonthlyFolder")
+        self.queue(SITE_B, REPORT)
+
+        taken = self.take_all(scheduler.plan(self.orchestrator))
+
+        self.assertCountEqual(
+            [(data["SharePointSite"], data["CustomFunction"]) for data in taken],
+            [(SITE_A, "MonthlyFolder"), (SITE_B, None)],
+        )
+
+    def test_same_workbook_is_merged(self):
+        """Pending elements for one workbook are refreshed once with their custom functions combined."""
+        self.queue(SITE_A, REPORT, "MonthlyFolder")
+        self.queue(SITE_A, REPORT)
+        self.queue(SITE_B, REPORT)
+
+        taken = self.take_all(scheduler.plan(self.orchestrator))
+
+        self.assertCountEqual(
+            [(data["SharePointSite"], data["CustomFunction"]) for data in taken],
+            [(SITE_A, "MonthlyFolder"), (SITE_B, None)],
+        )
+        statuses = [queue_element.status for queue_element in self.orchestrator.get_queue_elements(config.QUEUE_NAME)]
+        self.assertEqual(statuses, [QueueStatus.DONE] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests of the session cache expiry in sharepoint_session."""
+
+import base64
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from office365.runtime.auth.token_response import TokenResponse
+
+from robot_framework import config, sharepoint_session
+from robot_framework.sharepoint_transport import ThrottledClientContext
+
+SITE = "https://tenant/sites/a"
+
+
+def _jwt(expires_in: float) -> str:
+    """Make an unsigned JWT that expires in expires_in seconds."""
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+    return f"{encode({'alg': 'none'})}.{encode({'exp': int(time.time() + expires_in)})}."
+
+
+class SessionExpiryTest(unittest.TestCase):
+    """get_client with a token whose lifetime differs from config.SHAREPOINT_TOKEN_LIFETIME."""
+
+    def setUp(self):
+        self.orchestrator_connection = SimpleNamespace(
+            get_credential=lambda name: SimpleNamespace(username=name, password=name),
+            log_trace=lambda message: None,
+        )
+        self.created = []
+        patches = [
+            mock.patch.object(sharepoint_session, "sharepoint_client", self.client),
+            mock.patch.object(config, "SHAREPOINT_TOKEN_LIFETIME", 60 * 60),
+            mock.patch.object(config, "SHAREPOINT_TOKEN_MARGIN", 60),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(sharepoint_session.clear)
+        self.access_token = ""
+
+    def client(self, *args):
+        """Stand-in for sharepoint_client returning a context with the test's access token."""
+        self.created.append(args)
+        token = TokenResponse(self.access_token, "Bearer")
+        return ThrottledClientContext(SITE).with_access_token(lambda: token)
+
+    def test_short_lived_token_is_not_reused(self):
+        """A token expiring before the margin is replaced, even though the configured lifetime is longer."""
+        self.access_token = _jwt(30)
+
+        sharepoint_session.get_client(self.orchestrator_connection, SITE)
+        sharepoint_session.get_client(self.orchestrator_connection, SITE)
+
+        self.assertEqual(len(self.created), 2)
+
+    def test_valid_token_is_reused(self):
+        """A token with time left after the margin is reused."""
+        self.access_token = _jwt(10 * 60)
+
+        sharepoint_session.get_client(self.orchestrator_connection, SITE)
+        sharepoint_session.get_client(self.orchestrator_connection, SITE)
+
+        self.assertEqual(len(self.created), 1)
+
+    def test_unreadable_token_uses_configured_lifetime(self):
+        """A token that isn't a JWT is reused for config.SHAREPOINT_TOKEN_LIFETIME."""
+        self.access_token = "benchmark"
+
+        sharepoint_session.get_client(self.orchestrator_connection, SITE)
+        with mock.patch.object(time, "monotonic", return_value=time.monotonic() + 60 * 60):
+            sharepoint_session.get_client(self.orchestrator_connection, SITE)
+
+        self.assertEqual(len(self.created), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
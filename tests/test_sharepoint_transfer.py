@@ -0,0 +1,64 @@
+"""Tests of choosing between the single request and the upload session in sharepoint_transfer.upload_file."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from robot_framework import config, sharepoint_transfer
+
+
+class UploadFileTest(unittest.TestCase):
+    """upload_file with a mocked SharePoint folder."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.file_path = os.path.join(folder.name, "Rapport.xlsx")
+        self.target_folder = mock.Mock()
+        self.log = mock.Mock()
+
+    def write(self, content: bytes) -> None:
+        """Write the local file to upload."""
+        with open(self.file_path, "wb") as file:
+            file.write(content)
+
+    def test_empty_file_is_sent_in_a_single_request(self):
+        """An empty file is uploaded with files.add even when small uploads are disabled."""
+        self.write(b"")
+
+        with mock.patch.object(config, "SHAREPOINT_SMALL_UPLOAD_LIMIT", 0):
+            uploaded = sharepoint_transfer.upload_file(self.target_folder, self.file_path, "Rapport.xlsx", self.log)
+
+        self.target_folder.files.add.assert_called_once_with("Rapport.xlsx", b"", True)
+        self.assertIs(uploaded, self.target_folder.files.add.return_value.execute_query.return_value)
+        self.target_folder.files.get_by_url.assert_not_called()
+
+    def test_failed_empty_file_is_not_uploaded_in_a_session(self):
+        """A failed upload of an empty file raises instead of finishing an upload session that was never started."""
+        self.write(b"")
+        self.target_folder.files.add.return_value.execute_query.side_effect = requests.ConnectionError("reset")
+
+        with self.assertRaises(requests.ConnectionError):
+            sharepoint_transfer.upload_file(self.target_folder, self.file_path, "Rapport.xlsx", self.log)
+
+        self.target_folder.files.get_by_url.assert_not_called()
+
+    def test_failed_small_file_falls_back_to_a_session(self):
+        """A small file whose single request fails is uploaded in a session starting with start_upload."""
+        self.write(b"data")
+        self.target_folder.files.add.return_value.execute_query.side_effect = requests.ConnectionError("reset")
+        target_file = self.target_folder.files.get_by_url.return_value
+        target_file.exists = True
+        target_file.start_upload.return_value.value = 2
+
+        sharepoint_transfer.upload_file(self.target_folder, self.file_path, "Rapport.xlsx", self.log)
+
+        self.assertEqual(target_file.start_upload.call_args.args[1], b"da")
+        self.assertEqual(target_file.finish_upload.call_args.args[1:], (2, b"ta"))
+
+
+if __name__ == "__main__":
+    unittest.main()
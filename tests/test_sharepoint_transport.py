@@ -0,0 +1,283 @@
+"""Tests of the throttling handled by sharepoint_transport, with requests.request mocked and a fake clock."""
+# pylint: disable=protected-access
+
+import io
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+from robot_framework import config, sharepoint_transport
+
+URL = "https://tenant/sites/a/_api/web"
+
+
+def _response(status_code: int, retry_after: str | None = None) -> mock.Mock:
+    """A response with a status code and optionally a Retry-After header."""
+    return mock.Mock(status_code=status_code, headers={"Retry-After": retry_after} if retry_after else {})
+
+
+class FakeClock:
+    """Stands in for the time module of sharepoint_transport. Sleeping moves the clock instead of waiting."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def monotonic(self) -> float:
+        """Get the fake time."""
+        return self.now
+
+    def time(self) -> float:
+        """Get the fake time as a Unix timestamp."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Move the fake time forward."""
+        self.now += seconds
+
+
+class TransportTest(unittest.TestCase):
+    """Resets the shared state of sharepoint_transport and removes the jitter."""
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(sharepoint_transport, "_bucket", None),
+            mock.patch.object(sharepoint_transport, "_limit", None),
+            mock.patch.object(sharepoint_transport, "_paused_until", 0.0),
+            mock.patch.object(sharepoint_transport, "_counters", {"requests": 0, "throttled": 0, "given_up": 0, "wait_seconds": 0.0}),
+            mock.patch.object(config, "SHAREPOINT_BACKOFF_JITTER", 0),
+            mock.patch.object(config, "SHAREPOINT_BACKOFF_BASE", 2),
+            mock.patch.object(config, "SHAREPOINT_BACKOFF_MAX", 60),
+            mock.patch.object(config, "SHAREPOINT_THROTTLE_ATTEMPTS", 4),
+            mock.patch.object(config, "SHAREPOINT_REQUESTS_PER_SECOND", 1000),
+            mock.patch.object(config, "SHAREPOINT_REQUEST_BURST", 1000),
+            mock.patch.object(config, "SHAREPOINT_CONCURRENCY", 4),
+            mock.patch.object(config, "SHAREPOINT_MIN_CONCURRENCY", 1),
+            mock.patch.object(config, "SHAREPOINT_MAX_CONCURRENCY", 16),
+            mock.patch.object(config, "SHAREPOINT_CONCURRENCY_DECREASE", 0.5),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def use_fake_clock(self) -> FakeClock:
+        """Replace the clock of sharepoint_transport for the rest of the test."""
+        clock = FakeClock()
+        patch = mock.patch.object(sharepoint_transport, "time", clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return clock
+
+    def mock_requests(self, side_effect) -> mock.Mock:
+        """Replace requests.request for the rest of the test."""
+        patch = mock.patch.object(sharepoint_transport.requests, "request", side_effect=side_effect)
+        self.addCleanup(patch.stop)
+        return patch.start()
+
+
+class SendTest(TransportTest):
+    """send."""
+
+    def test_retry_after_is_honoured(self):
+        """A 429 with Retry-After is sent again once the wait is over."""
+        clock = self.use_fake_clock()
+        sent_at = []
+
+        def request(*_args, **_kwargs):
+            sent_at.append(clock.now)
+            return _response(429, "3") if len(sent_at) == 1 else _response(200)
+
+        self.mock_requests(request)
+
+        response = sharepoint_transport.send("GET", URL)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sent_at[1] - sent_at[0], 3)
+        counters = sharepoint_transport.counters()
+        self.assertEqual((counters["requests"], counters["throttled"], counters["given_up"]), (2, 1, 0))
+        self.assertEqual(counters["wait_seconds"], 3)
+
+    def test_503_without_retry_after_backs_off(self):
+        """A 503 without Retry-After waits SHAREPOINT_BACKOFF_BASE doubled for each attempt."""
+        clock = self.use_fake_clock()
+        started = clock.now
+        self.mock_requests([_response(503), _response(503), _response(200)])
+
+        response = sharepoint_transport.send("GET", URL)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(clock.now - started, 2 + 4)
+
+    def test_gives_up_after_attempts(self):
+        """The throttled response is returned after SHAREPOINT_THROTTLE_ATTEMPTS attempts."""
+        self.use_fake_clock()
+        request = self.mock_requests(lambda *_args, **_kwargs: _response(429, "1"))
+
+        response = sharepoint_transport.send("GET", URL)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(request.call_count, config.SHAREPOINT_THROTTLE_ATTEMPTS)
+        self.assertEqual(sharepoint_transport.counters()["given_up"], 1)
+
+    def test_data_is_read_again_from_its_position(self):
+        """A file being uploaded is sent from the same position on every attempt."""
+        self.use_fake_clock()
+        sent = []
+
+        def request(*_args, **kwargs):
+            sent.append(kwargs["data"].read())
+            return _response(429, "1") if len(sent) == 1 else _response(200)
+
+        self.mock_requests(request)
+        data = io.BytesIO(b"headerpayload")
+        data.seek(len(b"header"))
+
+        sharepoint_transport.send("PUT", URL, data=data)
+
+        self.assertEqual(sent, [b"payload", b"payload"])
+
+    def test_throttled_response_pauses_other_requests(self):
+        """A request sent while another one waits for Retry-After waits as well."""
+        throttled_at = []
+        second_sent_at = []
+        first_throttled = threading.Event()
+
+        def request(_method, url, **_kwargs):
+            if url == URL and not throttled_at:
+                throttled_at.append(time.monotonic())
+                first_throttled.set()
+                return _response(429, "0.5")
+            if url != URL:
+                second_sent_at.append(time.monotonic())
+            return _response(200)
+
+        self.mock_requests(request)
+        worker = threading.Thread(target=sharepoint_transport.send, args=("GET", URL))
+        worker.start()
+        self.assertTrue(first_throttled.wait(timeout=5))
+        time.sleep(0.1)
+        sharepoint_transport.send("GET", URL + "/lists")
+        worker.join(timeout=5)
+
+        self.assertGreaterEqual(second_sent_at[0] - throttled_at[0], 0.45)
+
+
+class RetryWaitTest(TransportTest):
+    """_retry_wait."""
+
+    def test_retry_after_seconds(self):
+        """Retry-After in seconds is used as is."""
+        self.assertEqual(sharepoint_transport._retry_wait(_response(429, "7"), 1), 7)
+
+    def test_retry_after_http_date(self):
+        """Retry-After as an HTTP date is the time left until then."""
+        clock = self.use_fake_clock()
+        retry_after = formatdate(clock.now + 10, usegmt=True)
+
+        self.assertEqual(sharepoint_transport._retry_wait(_response(503, retry_after), 1), 10)
+
+    def test_invalid_retry_after_backs_off(self):
+        """An unreadable Retry-After falls back to the exponential backoff."""
+        self.assertEqual(sharepoint_transport._retry_wait(_response(429, "soon"), 3), 8)
+
+    def test_wait_is_capped(self):
+        """No wait is longer than SHAREPOINT_BACKOFF_MAX or negative."""
+        self.assertEqual(sharepoint_transport._retry_wait(_response(429, "3600"), 1), 60)
+        self.assertEqual(sharepoint_transport._retry_wait(_response(429), 20), 60)
+        self.assertEqual(sharepoint_transport._retry_wait(_response(429, "-5"), 1), 0)
+
+    def test_jitter_is_added(self):
+        """Up to SHAREPOINT_BACKOFF_JITTER of the wait is added."""
+        with mock.patch.object(config, "SHAREPOINT_BACKOFF_JITTER", 0.2):
+            waits = [sharepoint_transport._retry_wait(_response(429, "10"), 1) for _ in range(20)]
+
+        self.assertTrue(all(10 <= wait <= 12 for wait in waits))
+
+
+class TokenBucketTest(TransportTest):
+    """_TokenBucket."""
+
+    def test_burst_then_rate(self):
+        """The burst is available at once, after which tokens come at the rate."""
+        clock = self.use_fake_clock()
+        started = clock.now
+        bucket = sharepoint_transport._TokenBucket(rate=2, burst=2)
+
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(clock.now, started)
+        bucket.acquire()
+        bucket.acquire()
+
+        self.assertAlmostEqual(clock.now - started, 1.0)
+
+    def test_tokens_are_capped_at_burst(self):
+        """An idle bucket doesn't save up more than the burst."""
+        clock = self.use_fake_clock()
+        bucket = sharepoint_transport._TokenBucket(rate=2, burst=2)
+        clock.sleep(60)
+        started = clock.now
+
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertAlmostEqual(clock.now - started, 0.5)
+
+
+class AdaptiveLimitTest(TransportTest):
+    """_AdaptiveLimit."""
+
+    def test_throttled_decreases_once_per_wait(self):
+        """Responses throttled within the wait of the first only halve the limit once."""
+        clock = self.use_fake_clock()
+        limit = sharepoint_transport._AdaptiveLimit(8, 1, 16)
+
+        limit.throttled(10)
+        limit.throttled(10)
+        self.assertEqual(limit.limit, 4)
+
+        clock.sleep(10)
+        limit.throttled(10)
+        self.assertEqual(limit.limit, 2)
+
+    def test_throttled_stops_at_minimum(self):
+        """The limit isn't decreased below the minimum."""
+        clock = self.use_fake_clock()
+        limit = sharepoint_transport._AdaptiveLimit(2, 1, 16)
+
+        for _ in range(3):
+            limit.throttled(1)
+            clock.sleep(1)
+
+        self.assertEqual(limit.limit, 1)
+
+    def test_succeeded_increases_by_one_per_limit(self):
+        """The limit grows by about one for every limit's worth of successful requests, up to the maximum."""
+        limit = sharepoint_transport._AdaptiveLimit(4, 1, 6)
+
+        for _ in range(4):
+            limit.succeeded()
+        self.assertGreater(limit.limit, 4.8)
+        self.assertLess(limit.limit, 5)
+
+        for _ in range(100):
+            limit.succeeded()
+        self.assertEqual(limit.limit, 6)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        """No more than the limit of requests are in flight."""
+        limit = sharepoint_transport._AdaptiveLimit(1, 1, 16)
+        limit.acquire()
+        acquired = threading.Event()
+        waiting = threading.Thread(target=lambda: (limit.acquire(), acquired.set()))
+        waiting.start()
+
+        self.assertFalse(acquired.wait(timeout=0.2))
+        limit.release()
+        self.assertTrue(acquired.wait(timeout=5))
+        waiting.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Tests of detecting unchanged workbooks in workbook_fingerprint."""
+
+import os
+import tempfile
+import unittest
+
+from benchmark.workbooks import create_workbook
+from robot_framework import workbook_fingerprint
+from tests.test_refresh_verifier import replace_parts
+
+
+class FingerprintTest(unittest.TestCase):
+    """remember and is_unchanged."""
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def test_unchanged_data_is_detected(self):
+        """A workbook saved with new timestamps but the same data is unchanged."""
+        file_path = os.path.join(self.folder, "Rapport.xlsx")
+        create_workbook(file_path, 0)
+        workbook_fingerprint.remember(file_path)
+
+        replace_parts(file_path, {"docProps/core.xml": "<coreProperties/>"})
+        self.assertTrue(workbook_fingerprint.is_unchanged(file_path))
+
+        replace_parts(file_path, {"xl/worksheets/sheet2.xml": "<worksheet/>"})
+        self.assertFalse(workbook_fingerprint.is_unchanged(file_path))
+
+    def test_xls_workbook_is_never_unchanged(self):
+        """A workbook that isn't a zip file gets no fingerprint, so its upload is never skipped."""
+        file_path = os.path.join(self.folder, "Rapport.xls")
+        with open(file_path, "wb") as file:
+            file.write(b"\xd0\xcf\x11\xe0 not a zip file")
+
+        workbook_fingerprint.remember(file_path)
+
+        self.assertFalse(workbook_fingerprint.is_unchanged(file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()